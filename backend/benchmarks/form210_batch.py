@@ -0,0 +1,109 @@
+"""
+Benchmark: Form 210 for many taxpayers, per-taxpayer loop vs NumPy batch.
+
+Generates random declarations (each input casilla filled with some
+probability), computes them with `Form210Engine.compute` one by one and with
+`Form210Engine.compute_batch` column-wise, checks that both agree and reports
+throughput (taxpayers/s) and speedup. Also checks that the engine calculates
+exactly the frontend's CALCULATED_FIELD_IDS (frontend/src/utils/formulas.ts).
+
+Usage (from the backend directory):
+    python benchmarks/form210_batch.py [--taxpayers 1000,10000,100000] [--json results.json]
+"""
+
+import argparse
+import json
+import re
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import form210
+
+# Share of input casillas with a value in a typical declaration
+FILL_RATE = 0.3
+FRONTEND_FORMULAS = Path(__file__).resolve().parents[2] / "frontend" / "src" / "utils" / "formulas.ts"
+
+
+def check_calculated_fields(engine: form210.Form210Engine):
+    """The engine's calculated casillas must be the frontend's CALCULATED_FIELD_IDS."""
+    if not FRONTEND_FORMULAS.exists():
+        return
+    match = re.search(r"CALCULATED_FIELD_IDS = \[(.*?)\]", FRONTEND_FORMULAS.read_text(encoding="utf-8"), re.DOTALL)
+    frontend_ids = set(re.findall(r"'(\d+)'", match.group(1)))
+    assert frontend_ids == set(engine.order), (
+        f"only in frontend: {sorted(frontend_ids - set(engine.order))}, "
+        f"only in engine: {sorted(set(engine.order) - frontend_ids)}"
+    )
+
+
+def random_inputs(engine: form210.Form210Engine, taxpayers: int, seed: int = 0) -> dict[str, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    input_ids = [casilla_id for casilla_id in engine.casillas if not engine.is_calculated(casilla_id)]
+    return {
+        casilla_id: np.round(rng.uniform(0, 200_000_000, taxpayers) * (rng.random(taxpayers) < FILL_RATE))
+        for casilla_id in input_ids
+    }
+
+
+def bench(engine: form210.Form210Engine, taxpayers: int, loop_limit: int) -> dict:
+    columns = random_inputs(engine, taxpayers)
+
+    start = time.perf_counter()
+    batch = engine.compute_batch(columns)
+    batch_seconds = time.perf_counter() - start
+
+    # The loop is timed on at most `loop_limit` taxpayers and extrapolated
+    looped = min(taxpayers, loop_limit)
+    declarations = [
+        {casilla_id: float(column[i]) for casilla_id, column in columns.items()}
+        for i in range(looped)
+    ]
+    start = time.perf_counter()
+    results = [engine.compute(declaration) for declaration in declarations]
+    loop_seconds = (time.perf_counter() - start) * taxpayers / looped
+
+    for i, result in enumerate(results):
+        for casilla_id in engine.order:
+            assert abs(result[casilla_id] - batch[casilla_id][i]) < 1e-6, (casilla_id, i)
+
+    return {
+        "taxpayers": taxpayers,
+        "casillas_calculated": len(engine.order),
+        "loop_seconds": round(loop_seconds, 4),
+        "batch_seconds": round(batch_seconds, 4),
+        "loop_taxpayers_per_second": round(taxpayers / loop_seconds),
+        "batch_taxpayers_per_second": round(taxpayers / batch_seconds),
+        "speedup": round(loop_seconds / batch_seconds, 1),
+        "loop_extrapolated": looped < taxpayers,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--taxpayers", default="1000,10000,100000", help="Comma-separated batch sizes")
+    parser.add_argument("--loop-limit", type=int, default=20000, help="Taxpayers timed in the per-taxpayer loop")
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    engine = form210.get_engine()
+    check_calculated_fields(engine)
+    results = []
+    for taxpayers in (int(size) for size in args.taxpayers.split(",")):
+        result = bench(engine, taxpayers, args.loop_limit)
+        results.append(result)
+        print(
+            f"{taxpayers:>8} taxpayers: loop {result['loop_taxpayers_per_second']:>10,}/s  "
+            f"batch {result['batch_taxpayers_per_second']:>12,}/s  ({result['speedup']}x)"
+        )
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
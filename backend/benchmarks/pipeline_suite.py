@@ -0,0 +1,265 @@
+"""
+Benchmark suite for the extraction pipeline.
+
+Runs each benchmark against synthetic bank statements of several sizes and
+reports throughput (pages/s), p50/p95 latency and peak RSS:
+
+- pdf_to_images: the former rasterization to PNG files on disk (baseline)
+- render_pages: in-memory rendering with the default render profile
+- base64: encoding rendered pages for the vision model
+- refine_chips: word index build + chip coordinate refinement
+- value_check: chip values checked against every number of the text layer
+- schema_to_chips: stage 2 schema -> chips conversion
+- markdown: text-layer markdown, page assembly and pruning
+- upload_with_relevance: the full HTTP request, with the LLM replaced by the
+  replay backend (see llm_backend) and a configurable simulated latency
+
+Usage (from the backend directory):
+    python benchmarks/pipeline_suite.py [--sizes 1,10,50,200] [--repeat 5]
+        [--llm-latency-ms 300] [--no-text-layer] [--only render_pages,markdown]
+        [--json results.json] [--compare baseline.json]
+
+Results are saved with the current git commit so runs can be compared.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+# Offline, uncached and unthrottled: only our own code is measured
+os.environ["LLM_BACKEND"] = "replay"
+os.environ["EXTRACTION_CACHE_ENABLED"] = "false"
+os.environ.setdefault("LLM_RATE_LIMITS", json.dumps({
+    model: {"rpm": 10 ** 9, "tpm": 10 ** 12} for model in ("gpt-4o", "gpt-4o-mini")
+}))
+
+import pdf_utils
+from render_profiles import synthetic_statement
+
+DEFAULT_SIZES = [1, 10, 50, 200]
+
+
+class PeakRSS:
+    """Samples the process RSS in a background thread and keeps the maximum (in MB)."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def current_mb() -> float:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+        except (OSError, ValueError):
+            import resource
+            # ru_maxrss is the lifetime peak (KB on Linux, bytes on macOS)
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return maxrss / 2 ** 20 if sys.platform == "darwin" else maxrss / 2 ** 10
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current_mb())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current_mb()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current_mb())
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_case(name: str, pages: int, repeat: int, setup, run) -> dict:
+    """Times `run(state)` `repeat` times after an untimed warm-up; `setup()` builds the state."""
+    state = setup()
+    run(state)
+    timings = []
+    with PeakRSS() as rss:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run(state)
+            timings.append(time.perf_counter() - start)
+    p50 = statistics.median(timings)
+    return {
+        "benchmark": name,
+        "pages": pages,
+        "runs": repeat,
+        "p50_ms": round(p50 * 1000, 3),
+        "p95_ms": round(percentile(timings, 0.95) * 1000, 3),
+        "pages_per_second": round(pages / p50, 1) if p50 else None,
+        "peak_rss_mb": round(rss.peak, 1),
+    }
+
+
+def sample_chips() -> list[dict]:
+    """Chips for values that appear in the synthetic statement (summary block of each page)."""
+    values = [326814.0, 7500102.22, 7772194.0, 54822.21]
+    labels = ["Saldo Inicial", "Total Abonos", "Total Cargos", "Saldo Final"]
+    return [{"label": label, "value": value, "page": 1} for label, value in zip(labels, values)]
+
+
+def benchmarks(pdf_bytes: bytes, args) -> dict:
+    """name -> (setup, run) for one document."""
+    import markdown_pruning
+    import number_parser
+    import text_extractor
+    from schemas.document_specific_schemas import ExtractoBancarioExtraido
+
+    profile = pdf_utils.get_render_profile(None, None)
+
+    def legacy_render(_):
+        # The renderer the app used before rendering in memory, kept here as the baseline:
+        # default resolution, one PNG file per page
+        import fitz  # PyMuPDF
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            pdf_path = Path(output_dir) / "document.pdf"
+            pdf_path.write_bytes(pdf_bytes)
+            with fitz.open(str(pdf_path)) as doc:
+                for page in doc:
+                    page.get_pixmap().save(str(Path(output_dir) / f"page_{page.number + 1}.png"))
+
+    def encode(images):
+        for image in images:
+            # A fresh PageImage so the cached encoding isn't reused
+            pdf_utils.PageImage(image.page_num, image.data, image.mime_type).base64
+
+    def refine(_):
+        indexes = pdf_utils.build_word_indexes(pdf_bytes)
+        pdf_utils.refine_chip_coordinates(indexes, sample_chips(), search_all_pages=True)
+
+    def value_check(indexes):
+        # Every chip misread by a factor of 1000, as a separator mix-up would
+        chips = [{**chip, "value": chip["value"] / 1000} for chip in sample_chips()]
+        number_parser.check_chip_values(indexes, chips * 25, search_all_pages=True)
+
+    schema = ExtractoBancarioExtraido.model_validate({
+        name: (54822.21 if field.annotation in (float, float | None) else None)
+        for name, field in ExtractoBancarioExtraido.model_fields.items()
+    })
+
+    def markdown(_):
+        pages = pdf_utils.extract_text_layer_markdown(pdf_bytes)
+        full_markdown = ""
+        for i, page_markdown in enumerate(pages):
+            full_markdown += f"\n\n--- PAGE {i+1} ---\n\n" + (page_markdown or "")
+        markdown_pruning.prune_markdown(full_markdown, "extracto_bancario")
+
+    def upload_setup():
+        import llm_backend
+        import main
+        import vision_processor
+        from fastapi.testclient import TestClient
+
+        replay = llm_backend.ReplayClient(latency_ms=args.llm_latency_ms, seed=0)
+        vision_processor.client = replay
+        text_extractor.client = replay
+        return TestClient(main.app)
+
+    def upload(client):
+        response = client.post(
+            "/upload-with-relevance",
+            params={"text_layer": "false"} if args.no_text_layer else None,
+            files={"file": ("statement.pdf", pdf_bytes, "application/pdf")},
+        )
+        response.raise_for_status()
+
+    return {
+        "pdf_to_images": (lambda: None, legacy_render),
+        "render_pages": (lambda: None, lambda _: pdf_utils.render_pages(pdf_bytes, profile)),
+        "base64": (lambda: pdf_utils.render_pages(pdf_bytes, profile), encode),
+        "refine_chips": (lambda: None, refine),
+        "value_check": (lambda: pdf_utils.build_word_indexes(pdf_bytes), value_check),
+        "schema_to_chips": (
+            lambda: schema.model_dump(),
+            lambda data: text_extractor.schema_to_chips(data, ExtractoBancarioExtraido),
+        ),
+        "markdown": (lambda: None, markdown),
+        "upload_with_relevance": (upload_setup, upload),
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list[dict], baseline_path: str):
+    """Prints p50 changes against a previous results file."""
+    baseline = {
+        (result["benchmark"], result["pages"]): result
+        for result in json.loads(Path(baseline_path).read_text())["results"]
+    }
+    for result in results:
+        previous = baseline.get((result["benchmark"], result["pages"]))
+        if previous and previous["p50_ms"]:
+            change = (result["p50_ms"] - previous["p50_ms"]) / previous["p50_ms"] * 100
+            print(f"{result['benchmark']:>22} {result['pages']:>4} pages: "
+                  f"{previous['p50_ms']:>10.2f} -> {result['p50_ms']:>10.2f} ms ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="Page counts of the synthetic documents")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per benchmark and size")
+    parser.add_argument("--llm-latency-ms", type=float, default=0, help="Simulated latency of each model call")
+    parser.add_argument("--no-text-layer", action="store_true", help="Send every page to the (replayed) vision model")
+    parser.add_argument("--only", help="Comma-separated benchmark names to run")
+    parser.add_argument("--json", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Previous results JSON to compare p50 latencies against")
+    args = parser.parse_args()
+
+    only = set(args.only.split(",")) if args.only else None
+    results = []
+    for pages in (int(size) for size in args.sizes.split(",")):
+        pdf_bytes = synthetic_statement(pages)
+        for name, (setup, run) in benchmarks(pdf_bytes, args).items():
+            if only and name not in only:
+                continue
+            result = run_case(name, pages, args.repeat, setup, run)
+            results.append(result)
+            print(json.dumps(result))
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "settings": {"repeat": args.repeat, "llm_latency_ms": args.llm_latency_ms, "text_layer": not args.no_text_layer},
+            "results": results,
+        }, indent=2))
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Compares render profiles: bytes per page, render time, estimated image tokens
+and (optionally) end-to-end vision latency.
+
+Usage (from the backend directory):
+    python benchmarks/render_profiles.py [document.pdf ...] [--llm] [--json results.json]
+
+Without PDFs a synthetic bank statement is generated. `--llm` also sends every
+page to the vision model (requires OPENAI_API_KEY and costs tokens).
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import fitz  # PyMuPDF
+import pdf_utils
+
+
+def synthetic_statement(pages: int = 3) -> bytes:
+    """Builds a bank-statement-like PDF with a summary block and a dense transaction table."""
+    doc = fitz.open()
+    for page_index in range(pages):
+        page = doc.new_page()
+        page.insert_text((50, 50), "BANCO XYZ - Extracto Bancario", fontsize=16)
+        page.insert_text((50, 80), "Resumen del Periodo", fontsize=12)
+        for row, (label, value) in enumerate([
+            ("Saldo Inicial", "326.814,00"), ("Total Abonos", "7.500.102,22"),
+            ("Total Cargos", "7.772.194,00"), ("Saldo Final", "54.822,21"),
+        ]):
+            page.insert_text((50, 100 + row * 14), label, fontsize=9)
+            page.insert_text((300, 100 + row * 14), value, fontsize=9)
+        for row in range(45):
+            y = 180 + row * 13
+            page.insert_text((50, y), f"{(row % 28) + 1:02d}/07", fontsize=7)
+            page.insert_text((100, y), f"Movimiento {page_index * 45 + row}", fontsize=7)
+            page.insert_text((400, y), f"{(row * 7919) % 1000000:,}".replace(",", "."), fontsize=7)
+    return doc.tobytes()
+
+
+async def vision_latency(images: list) -> list[float]:
+    import vision_processor
+
+    async def timed(image):
+        start = time.perf_counter()
+        await vision_processor.convert_to_markdown(image, image.page_num)
+        return time.perf_counter() - start
+
+    return await asyncio.gather(*[timed(image) for image in images])
+
+
+def bench_profile(pdf_bytes: bytes, profile: pdf_utils.RenderProfile, with_llm: bool) -> dict:
+    start = time.perf_counter()
+    images = pdf_utils.render_pages(pdf_bytes, profile)
+    render_seconds = time.perf_counter() - start
+
+    sizes = [len(image.data) for image in images]
+    tokens = [pdf_utils.estimate_image_tokens(image) for image in images]
+
+    result = {
+        "profile": profile.name,
+        "pages": len(images),
+        "bytes_per_page": round(statistics.mean(sizes)),
+        "base64_bytes_per_page": round(statistics.mean(len(image.base64) for image in images)),
+        "render_ms_per_page": round(render_seconds * 1000 / len(images), 2),
+        "est_image_tokens_per_page": round(statistics.mean(tokens)),
+    }
+    if with_llm:
+        latencies = asyncio.run(vision_latency(images))
+        result["vision_latency_p50_s"] = round(statistics.median(latencies), 2)
+        result["vision_latency_max_s"] = round(max(latencies), 2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="*", help="PDF files to benchmark (default: synthetic statement)")
+    parser.add_argument("--llm", action="store_true", help="Also measure vision model latency")
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    inputs = [(path, Path(path).read_bytes()) for path in args.pdfs] or [("synthetic", synthetic_statement())]
+
+    results = []
+    for name, pdf_bytes in inputs:
+        for profile in pdf_utils.RENDER_PROFILES.values():
+            result = {"document": name, **bench_profile(pdf_bytes, profile, args.llm)}
+            results.append(result)
+            print(json.dumps(result))
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
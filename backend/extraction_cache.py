@@ -0,0 +1,168 @@
+"""
+Content-addressed cache for extraction results.
+
+Entries are keyed by a hash of the uploaded PDF bytes plus the pipeline
+configuration (models, prompt versions, schema version), so re-uploading the
+same document skips the vision and text models entirely, while any change to
+the pipeline naturally invalidates old entries.
+
+Entries live in an in-memory LRU and are persisted as JSON files on disk so
+they survive restarts. Both layers are bounded (entry count, disk bytes) and
+entries expire after a TTL.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import tracing
+
+CACHE_ENABLED = os.getenv("EXTRACTION_CACHE_ENABLED", "true").lower() == "true"
+CACHE_DIR = Path(os.getenv("EXTRACTION_CACHE_DIR", str(Path(__file__).parent / ".cache" / "extractions")))
+CACHE_MAX_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "256"))
+CACHE_MAX_DISK_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_DISK_BYTES", str(200 * 1024 * 1024)))
+CACHE_TTL_SECONDS = int(os.getenv("EXTRACTION_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+
+def hash_bytes(data: bytes) -> str:
+    """Returns the SHA-256 hex digest of the given bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_cache_key(content_hash: str, config: dict) -> str:
+    """
+    Builds the cache key from the document content hash and the pipeline config.
+
+    Args:
+        content_hash: SHA-256 hex digest of the PDF bytes
+        config: JSON-serializable description of the pipeline (models, versions...)
+
+    Returns:
+        Hex digest identifying this (document, pipeline) pair
+    """
+    config_blob = json.dumps(config, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{content_hash}:{config_blob}".encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    """
+    Two-level (memory LRU + disk) cache of extraction payloads.
+
+    Payloads are plain JSON-serializable dicts. All methods are thread-safe so
+    they can be called from `asyncio.to_thread`.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path = CACHE_DIR,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        max_disk_bytes: int = CACHE_MAX_DISK_BYTES,
+        ttl_seconds: int = CACHE_TTL_SECONDS,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self._memory: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path_for(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def _is_expired(self, created_at: float) -> bool:
+        return time.time() - created_at > self.ttl_seconds
+
+    def get(self, key: str) -> dict | None:
+        """Returns the cached payload for `key`, or None on miss/expiry."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, payload = entry
+                if not self._is_expired(created_at):
+                    self._memory.move_to_end(key)
+                    return payload
+                del self._memory[key]
+
+        path = self._path_for(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            tracing.log("Cache read error", level="error", key=key, error=str(e))
+            return None
+
+        created_at = stored.get("created_at", 0)
+        if self._is_expired(created_at):
+            path.unlink(missing_ok=True)
+            return None
+
+        payload = stored.get("payload")
+        with self._lock:
+            self._remember(key, created_at, payload)
+        return payload
+
+    def put(self, key: str, payload: dict) -> None:
+        """Stores `payload` under `key` in memory and on disk."""
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, created_at, payload)
+
+        path = self._path_for(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"created_at": created_at, "payload": payload}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            self._enforce_disk_quota()
+        except Exception as e:
+            tracing.log("Cache write error", level="error", key=key, error=str(e))
+
+    def _remember(self, key: str, created_at: float, payload: dict) -> None:
+        # Caller must hold self._lock
+        self._memory[key] = (created_at, payload)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _enforce_disk_quota(self) -> None:
+        """Drops expired entries, then the oldest ones until under the byte quota."""
+        files = []
+        total_bytes = 0
+        now = time.time()
+        for path in self.cache_dir.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.ttl_seconds:
+                path.unlink(missing_ok=True)
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total_bytes += stat.st_size
+
+        if total_bytes <= self.max_disk_bytes:
+            return
+
+        files.sort()
+        for _, size, path in files:
+            if total_bytes <= self.max_disk_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total_bytes -= size
+
+    def clear(self) -> None:
+        """Removes every entry from memory and disk."""
+        with self._lock:
+            self._memory.clear()
+        for path in self.cache_dir.glob("*/*.json"):
+            path.unlink(missing_ok=True)
+
+
+extraction_cache = ExtractionCache()
@@ -0,0 +1,256 @@
+"""
+Form 210 calculation engine.
+
+Casilla definitions (name, section, formula) are loaded from
+`Formulario_210_2025.json`; formulas such as "Casilla 29 - Casilla 30" or
+"Mayor(97,98) + 103 + 107 + 108 - 118" are parsed into terms, and the
+casillas form a dependency DAG. `compute` evaluates every calculated casilla
+in topological order; `update` recomputes only the casillas downstream of
+the changed inputs, and stops propagating where a value did not change.
+`compute_batch` evaluates the same formulas column-wise with NumPy for many
+taxpayers at once (e.g. recomputing every client after a rule change).
+
+The results match `calculateBuckets` in frontend/src/utils/formulas.ts:
+missing inputs count as 0 and calculated casillas are never negative.
+"""
+
+import json
+import os
+import re
+from dataclasses import dataclass
+from functools import cache
+from graphlib import TopologicalSorter
+from pathlib import Path
+
+import numpy as np
+from pydantic import BaseModel, Field
+
+FORM_210_DEFINITIONS = Path(os.getenv(
+    "FORM_210_DEFINITIONS", str(Path(__file__).parent.parent / "Formulario_210_2025.json")
+))
+# Maximum taxpayers per POST /form210/calculate-batch request
+FORM_210_BATCH_MAX_ROWS = int(os.getenv("FORM_210_BATCH_MAX_ROWS", "100000"))
+
+CASILLA_KEY_PATTERN = re.compile(r"^casilla_(\d+)$")
+# One term of a formula: an optional sign and "Casilla 29", "29" or "Mayor(97,98)"
+TERM_PATTERN = re.compile(
+    r"\s*([+-])?\s*(?:Mayor\s*\(\s*(\d+)\s*,\s*(\d+)\s*\)|(?:Casilla\s+)?(\d+))\s*",
+    re.IGNORECASE,
+)
+
+
+@dataclass(frozen=True)
+class Term:
+    """`sign` times the largest of `casillas` (a single casilla, or the operands of Mayor)."""
+    sign: int
+    casillas: tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class Casilla:
+    id: str
+    name: str
+    section: str
+    # Formula as written in the instructions (None for inputs)
+    formula: str | None = None
+    terms: tuple[Term, ...] = ()
+
+    @property
+    def calculated(self) -> bool:
+        return bool(self.terms)
+
+    @property
+    def inputs(self) -> list[str]:
+        return list(dict.fromkeys(casilla for term in self.terms for casilla in term.casillas))
+
+    def evaluate(self, values: dict[str, float]) -> float:
+        total = sum(term.sign * max(values.get(casilla) or 0 for casilla in term.casillas) for term in self.terms)
+        return max(0.0, total)
+
+
+def parse_formula(formula: str) -> tuple[Term, ...] | None:
+    """Parses an arithmetic formula of casillas; None if it is not one (e.g. a prose rule)."""
+    terms = []
+    position = 0
+    while position < len(formula):
+        match = TERM_PATTERN.match(formula, position)
+        if match is None or match.end() == position or (terms and match.group(1) is None):
+            return None
+        sign = -1 if match.group(1) == "-" else 1
+        if match.group(2):
+            terms.append(Term(sign, (match.group(2), match.group(3))))
+        else:
+            terms.append(Term(sign, (match.group(4),)))
+        position = match.end()
+    return tuple(terms) or None
+
+
+def load_casillas(path: Path = FORM_210_DEFINITIONS) -> dict[str, Casilla]:
+    """Reads every `casilla_N` entry of the form's instructions, with its section and formula."""
+    with open(path, "r", encoding="utf-8") as f:
+        instructions = json.load(f)
+
+    casillas = {}
+
+    def walk(node, section: str):
+        if isinstance(node, list):
+            for item in node:
+                walk(item, section)
+        if not isinstance(node, dict):
+            return
+        for key, value in node.items():
+            match = CASILLA_KEY_PATTERN.match(key)
+            if match and isinstance(value, dict) and "nombre" in value:
+                formula = value.get("formula")
+                casillas[match.group(1)] = Casilla(
+                    id=match.group(1),
+                    name=value["nombre"],
+                    section=section,
+                    formula=formula,
+                    terms=(parse_formula(formula) or ()) if isinstance(formula, str) else (),
+                )
+            walk(value, section or key)
+
+    walk(instructions, "")
+    return casillas
+
+
+class Form210Engine:
+    """Dependency graph of the form's casillas."""
+
+    def __init__(self, casillas: dict[str, Casilla]):
+        self.casillas = casillas
+        self.dependencies = {casilla.id: casilla.inputs for casilla in casillas.values() if casilla.calculated}
+        self.dependents: dict[str, list[str]] = {}
+        for casilla_id, inputs in self.dependencies.items():
+            for input_id in inputs:
+                self.dependents.setdefault(input_id, []).append(casilla_id)
+        # Raises graphlib.CycleError if the formulas are circular
+        self.order = [
+            casilla_id for casilla_id in TopologicalSorter(self.dependencies).static_order()
+            if casilla_id in self.dependencies
+        ]
+        self._rank = {casilla_id: rank for rank, casilla_id in enumerate(self.order)}
+
+    @classmethod
+    def load(cls, path: Path = FORM_210_DEFINITIONS) -> "Form210Engine":
+        return cls(load_casillas(path))
+
+    def is_calculated(self, casilla_id: str) -> bool:
+        return casilla_id in self.dependencies
+
+    def downstream(self, casilla_ids) -> list[str]:
+        """Calculated casillas affected by `casilla_ids`, in evaluation order."""
+        affected = set()
+        stack = list(casilla_ids)
+        while stack:
+            for dependent in self.dependents.get(stack.pop(), ()):
+                if dependent not in affected:
+                    affected.add(dependent)
+                    stack.append(dependent)
+        return sorted(affected, key=self._rank.__getitem__)
+
+    def compute(self, values: dict[str, float]) -> dict[str, float]:
+        """Returns `values` with every calculated casilla (re)computed."""
+        result = dict(values)
+        for casilla_id in self.order:
+            result[casilla_id] = self.casillas[casilla_id].evaluate(result)
+        return result
+
+    def update(self, values: dict[str, float], changes: dict[str, float]) -> tuple[dict[str, float], dict[str, float]]:
+        """
+        Applies input `changes` to a computed declaration and recomputes only the
+        casillas downstream of them.
+
+        Returns:
+            (all values, the values that changed)
+
+        Raises:
+            ValueError: If a change targets a calculated casilla
+        """
+        for casilla_id in changes:
+            if self.is_calculated(casilla_id):
+                raise ValueError(f"Casilla {casilla_id} is calculated and can't be set")
+
+        result = dict(values)
+        changed = {}
+        for casilla_id, value in changes.items():
+            if (result.get(casilla_id) or 0) != value:
+                changed[casilla_id] = value
+            result[casilla_id] = value
+
+        dirty = set(changed)
+        for casilla_id in self.downstream(changed):
+            # Skip casillas whose inputs all kept their value
+            if dirty.isdisjoint(self.dependencies[casilla_id]):
+                continue
+            value = self.casillas[casilla_id].evaluate(result)
+            if result.get(casilla_id) != value:
+                result[casilla_id] = value
+                changed[casilla_id] = value
+                dirty.add(casilla_id)
+        return result, changed
+
+    def compute_batch(self, columns: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+        """
+        Computes many declarations at once. `columns` maps casilla ids to arrays
+        with one value per taxpayer (all the same length); missing casillas and
+        NaN count as 0. Returns every input column plus every calculated casilla.
+        """
+        arrays = {casilla_id: np.nan_to_num(np.asarray(column, dtype=np.float64)) for casilla_id, column in columns.items()}
+        rows = len(next(iter(arrays.values()))) if arrays else 0
+        zeros = np.zeros(rows)
+
+        for casilla_id in self.order:
+            total = np.zeros(rows)
+            for term in self.casillas[casilla_id].terms:
+                operands = [arrays.get(casilla, zeros) for casilla in term.casillas]
+                operand = operands[0] if len(operands) == 1 else np.maximum.reduce(operands)
+                if term.sign > 0:
+                    total += operand
+                else:
+                    total -= operand
+            arrays[casilla_id] = np.maximum(total, 0, out=total)
+        return arrays
+
+    def compute_table(self, column_ids: list[str], rows: list[list[float | None]]) -> tuple[list[str], np.ndarray]:
+        """
+        compute_batch for a row-per-taxpayer table. Returns the output column ids
+        (the input columns followed by the calculated casillas) and the computed table.
+        """
+        table = np.array(rows, dtype=np.float64).reshape(len(rows), len(column_ids))
+        computed = self.compute_batch({casilla_id: table[:, i] for i, casilla_id in enumerate(column_ids)})
+        output_ids = list(dict.fromkeys(column_ids + self.order))
+        return output_ids, np.column_stack([computed[casilla_id] for casilla_id in output_ids])
+
+    def describe(self) -> list[dict]:
+        """Casilla definitions for API clients."""
+        return [
+            {
+                "id": casilla.id,
+                "name": casilla.name,
+                "section": casilla.section,
+                "calculated": self.is_calculated(casilla.id),
+                "formula": casilla.formula,
+                "inputs": casilla.inputs,
+            }
+            for casilla in sorted(self.casillas.values(), key=lambda casilla: int(casilla.id))
+        ]
+
+
+@cache
+def get_engine() -> Form210Engine:
+    """The engine for the bundled instructions, loaded on first use."""
+    return Form210Engine.load()
+
+
+class CalculationRequest(BaseModel):
+    """Body of POST /form210/calculate."""
+    values: dict[str, float] = Field(default_factory=dict, description="Casilla values (inputs, and calculated ones from a previous response)")
+    changes: dict[str, float] | None = Field(None, description="Inputs that changed; only their downstream casillas are recomputed")
+
+
+class BatchCalculationRequest(BaseModel):
+    """Body of POST /form210/calculate-batch: one row of input casillas per taxpayer."""
+    columns: list[str] = Field(..., description="Casilla ids of the table's columns")
+    rows: list[list[float | None]] = Field(..., description="One row per taxpayer; null counts as 0")
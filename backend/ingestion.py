@@ -0,0 +1,176 @@
+"""
+Size-bounded ingestion of uploaded PDFs.
+
+Starlette spools each multipart file into a SpooledTemporaryFile (in memory
+up to 1 MB, on disk beyond that). `read_upload` streams it out in chunks,
+hashing as it reads, so the content hash used for the extraction cache and
+batch deduplication needs no second pass over the bytes. A file over
+MAX_UPLOAD_BYTES is rejected as soon as its declared size (or the bytes read
+so far) exceeds the limit, before the rest is read. The PDF is then opened
+from memory with PyMuPDF to check it is readable and has at most
+MAX_UPLOAD_PAGES pages, so oversized documents never reach the workers.
+
+`RequestSizeLimitMiddleware` bounds whole requests to MAX_REQUEST_BYTES: one
+whose Content-Length is over the limit is rejected before its body is read,
+and one without it (a chunked body) as soon as the bytes received exceed it,
+so the multipart parser never spools more than the limit.
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+import unicodedata
+from dataclasses import dataclass
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import pdf_utils
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+MAX_UPLOAD_PAGES = int(os.getenv("MAX_UPLOAD_PAGES", "200"))
+# Whole request (every file of a batch plus multipart overhead)
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", str(200 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+DEFAULT_FILENAME = "document.pdf"
+UNSAFE_FILENAME_CHARS = re.compile(r"[\x00-\x1f\x7f/\\]")
+
+
+class UploadRejectedError(Exception):
+    """The upload can't be processed; `status_code` is the HTTP status to respond with."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass
+class Upload:
+    filename: str
+    data: bytes
+    # SHA-256 hex digest of `data`
+    content_hash: str
+    page_count: int
+
+
+def safe_filename(filename: str | None) -> str:
+    """
+    The client's filename reduced to a display name: no directories, control
+    characters or path separators, at most 255 characters.
+    """
+    name = unicodedata.normalize("NFC", filename or "")
+    name = re.split(r"[/\\]", name)[-1]
+    name = UNSAFE_FILENAME_CHARS.sub("", name).strip().lstrip(".")
+    return name[:255] or DEFAULT_FILENAME
+
+
+def _count_pages(data: bytes) -> int:
+    try:
+        return pdf_utils.count_pages(data)
+    except Exception:
+        raise UploadRejectedError("The file is not a readable PDF")
+
+
+async def read_upload(
+    file: UploadFile,
+    max_bytes: int = MAX_UPLOAD_BYTES,
+    max_pages: int = MAX_UPLOAD_PAGES,
+) -> Upload:
+    """
+    Reads an uploaded PDF in chunks, hashing it on the way, and checks its
+    size and page count.
+
+    Raises:
+        UploadRejectedError: 413 if the file is over `max_bytes` or
+            `max_pages`, 400 if it is empty or not a readable PDF
+    """
+    filename = safe_filename(file.filename)
+    too_large = UploadRejectedError(f"{filename} is larger than {max_bytes} bytes", status_code=413)
+    if file.size is not None and file.size > max_bytes:
+        raise too_large
+
+    digest = hashlib.sha256()
+    chunks = []
+    nbytes = 0
+    while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+        nbytes += len(chunk)
+        if nbytes > max_bytes:
+            raise too_large
+        digest.update(chunk)
+        chunks.append(chunk)
+    if not nbytes:
+        raise UploadRejectedError(f"{filename} is empty")
+    # A single chunk (most certificates) is used as is, without a copy
+    data = chunks[0] if len(chunks) == 1 else b"".join(chunks)
+    del chunks
+
+    page_count = await asyncio.to_thread(_count_pages, data)
+    if page_count > max_pages:
+        raise UploadRejectedError(f"{filename} has {page_count} pages; at most {max_pages} are accepted", status_code=413)
+    return Upload(filename, data, digest.hexdigest(), page_count)
+
+
+def request_too_large(content_length: str | None, max_bytes: int = MAX_REQUEST_BYTES) -> bool:
+    """Whether a request's declared Content-Length is over the limit."""
+    try:
+        return content_length is not None and int(content_length) > max_bytes
+    except ValueError:
+        return False
+
+
+class RequestSizeLimitMiddleware:
+    """
+    ASGI middleware answering 413 to requests whose body is over `max_bytes`.
+    Bodies are counted as they are received, since Content-Length may be
+    missing (chunked transfer encoding) and only the declared size can be
+    checked up front.
+    """
+
+    def __init__(self, app: ASGIApp, max_bytes: int = MAX_REQUEST_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        too_large = HTTPException(status_code=413, detail=f"Request body is larger than {self.max_bytes} bytes")
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if request_too_large(content_length.decode("latin-1") if content_length else None, self.max_bytes):
+            await self._reject(too_large, scope, receive, send)
+            return
+
+        received = 0
+        response_started = False
+
+        async def counting_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # The app's exception handling turns it into the 413 response
+                    raise too_large
+            return message
+
+        async def tracking_send(message: Message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, tracking_send)
+        except HTTPException as e:
+            # Raised where the app doesn't handle it (e.g. a background read)
+            if e is not too_large or response_started:
+                raise
+            await self._reject(too_large, scope, receive, send)
+
+    @staticmethod
+    async def _reject(error: HTTPException, scope: Scope, receive: Receive, send: Send):
+        response = JSONResponse(status_code=error.status_code, content={"detail": error.detail})
+        await response(scope, receive, send)
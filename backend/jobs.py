@@ -0,0 +1,157 @@
+"""
+Asynchronous extraction jobs.
+
+`POST /jobs` enqueues a document and returns immediately; a bounded pool of
+worker tasks runs the extraction pipeline and `GET /jobs/{job_id}` reports
+status and results. The queue depth is bounded, so bursts get backpressure
+(HTTP 503 + Retry-After) instead of unbounded fan-out of model calls.
+"""
+
+import asyncio
+import os
+import time
+import traceback
+import uuid
+from typing import Awaitable, Callable
+
+import tracing
+from llm_scheduler import batch_priority
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+# Finished jobs are kept this long so clients can collect their results
+JOB_RESULT_TTL_SECONDS = int(os.getenv("JOB_RESULT_TTL_SECONDS", "3600"))
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class Job:
+    def __init__(self, run: Callable[[], Awaitable[dict]], filename: str):
+        self.id = str(uuid.uuid4())
+        self.filename = filename
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self._run = run
+
+    def to_dict(self) -> dict:
+        data = {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == "completed":
+            data["result"] = self.result
+        elif self.status == "failed":
+            data["error"] = self.error
+        return data
+
+
+class JobQueue:
+    """Bounded job queue drained by a fixed number of worker tasks."""
+
+    def __init__(
+        self,
+        workers: int = JOB_WORKERS,
+        max_queue: int = JOB_QUEUE_SIZE,
+        result_ttl_seconds: int = JOB_RESULT_TTL_SECONDS,
+    ):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.result_ttl_seconds = result_ttl_seconds
+        self._jobs: dict[str, Job] = {}
+        self._queue: asyncio.Queue | None = None
+        self._worker_tasks: list[asyncio.Task] = []
+
+    async def start(self):
+        """Starts the worker tasks; must be called from the running event loop."""
+        if self._worker_tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(), name=f"job-worker-{i}")
+            for i in range(self.workers)
+        ]
+
+    async def stop(self):
+        """Cancels the workers. Queued and running jobs are abandoned."""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    def submit(self, run: Callable[[], Awaitable[dict]], filename: str) -> Job:
+        """
+        Enqueues a job. `run` is called by a worker and must return the result dict;
+        a dict with an "error" key marks the job as failed.
+
+        Raises:
+            QueueFullError: If the queue is at capacity
+        """
+        if self._queue is None:
+            raise RuntimeError("JobQueue.start() has not been called")
+        self._prune()
+        job = Job(run, filename)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFullError(f"Job queue is full ({self.max_queue} jobs)")
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        return self._jobs.get(job_id)
+
+    def stats(self) -> dict:
+        statuses = [job.status for job in self._jobs.values()]
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "queued": statuses.count("queued"),
+            "running": statuses.count("running"),
+        }
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                # Queued jobs yield model capacity to interactive uploads
+                with batch_priority():
+                    result = await job._run()
+                if isinstance(result, dict) and "error" in result:
+                    job.status = "failed"
+                    job.error = result["error"]
+                else:
+                    job.status = "completed"
+                    job.result = result
+            except Exception as e:
+                tracing.log("Job failed", level="error", job_id=job.id, error=str(e), traceback=traceback.format_exc())
+                job.status = "failed"
+                job.error = str(e)
+            finally:
+                job.finished_at = time.time()
+                job._run = None  # Release the uploaded bytes held by the closure
+                self._queue.task_done()
+
+    def _prune(self):
+        """Forgets finished jobs older than the result TTL."""
+        cutoff = time.time() - self.result_ttl_seconds
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+job_queue = JobQueue()
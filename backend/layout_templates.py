@@ -0,0 +1,573 @@
+"""
+Layout templates: deterministic extraction for recurring issuer layouts.
+
+Banks, employers and pension funds issue the same layout every year. A
+document's layout is read from its PDF text layer (`extract_layout`): its
+text lines with their positions, and the label "anchors" among them (the
+words of a line without digits, e.g. "Total aportes a salud"). A template
+records the anchors of a known layout and, for each schema field of its
+document type, the anchor label the value sits next to and the value's box
+relative to it.
+
+When an upload's anchors match a template (same labels at about the same
+positions, see LAYOUT_TEMPLATE_MIN_SIMILARITY), every field is read straight
+from the text layer and the vision and text models are skipped. If any field
+can't be found, the document goes through the models as usual.
+
+Templates are learned from confirmed extractions: the pipeline keeps the
+layout of each processed document for a while (`pending_layouts`), and
+POST /templates/learn turns it plus the confirmed field values into a
+template (or extends the matching one), so the hit rate grows over the
+season. Templates are stored as JSON files in LAYOUT_TEMPLATES_DIR.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from pydantic import BaseModel, Field
+
+import number_parser
+import pdf_utils
+import tracing
+from page_routing import normalize_text
+from schemas.document_specific_schemas import DOCUMENT_TYPE_TO_SCHEMA
+
+# "auto": apply templates to text-layer documents; "off": always use the models
+LAYOUT_TEMPLATES_MODE = os.getenv("LAYOUT_TEMPLATES_MODE", "auto")
+LAYOUT_TEMPLATES_DIR = Path(os.getenv(
+    "LAYOUT_TEMPLATES_DIR", str(Path(__file__).parent / ".data" / "layout_templates")
+))
+# Share of anchors two layouts must have in common (Dice coefficient) to match
+LAYOUT_TEMPLATE_MIN_SIMILARITY = float(os.getenv("LAYOUT_TEMPLATE_MIN_SIMILARITY", "0.75"))
+# How long a processed document's layout can still be confirmed into a template
+LAYOUT_PENDING_TTL_SECONDS = int(os.getenv("LAYOUT_PENDING_TTL_SECONDS", "3600"))
+LAYOUT_PENDING_MAX_DOCUMENTS = int(os.getenv("LAYOUT_PENDING_MAX_DOCUMENTS", "256"))
+
+# Pages whose anchors make up the fingerprint (fields can be on any page)
+FINGERPRINT_PAGES = 2
+# Anchors at most this far apart (page fraction) are the same anchor
+ANCHOR_TOLERANCE = 0.03
+# A value may drift this far (page fraction) from where the template expects it
+FIELD_TOLERANCE_X = 0.05
+FIELD_TOLERANCE_Y = 0.012
+# Shortest anchor label (characters), so stray words don't become anchors
+MIN_ANCHOR_CHARS = 4
+MAX_ANCHOR_CHARS = 80
+
+
+@dataclass
+class Line:
+    """One text line of a page; boxes are page fractions (x0, y0, x1, y1)."""
+    label: str
+    label_box: tuple | None
+    # Runs of adjacent numeric words: (text, box)
+    numbers: list[tuple[str, tuple]] = field(default_factory=list)
+
+
+@dataclass
+class Layout:
+    pages: list[list[Line]]
+
+    def anchors(self, max_pages: int | None = None) -> list[tuple[int, str, tuple]]:
+        """(page, label, center) of every label line, on the first `max_pages` pages."""
+        pages = self.pages if max_pages is None else self.pages[:max_pages]
+        return [
+            (page_num, line.label, _center(line.label_box))
+            for page_num, lines in enumerate(pages, 1)
+            for line in lines
+            if line.label
+        ]
+
+    @property
+    def has_text(self) -> bool:
+        return any(self.pages[:FINGERPRINT_PAGES])
+
+
+def _center(box: tuple) -> tuple[float, float]:
+    return ((box[0] + box[2]) / 2, (box[1] + box[3]) / 2)
+
+
+def _union(boxes: list[tuple]) -> tuple:
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+def page_layout(page) -> list[Line]:
+    """The lines of a page's text layer, split into label words and numeric runs."""
+    width, height = page.rect.width, page.rect.height
+    # (x0, y0, x1, y1, "word", block_no, line_no, word_no)
+    grouped: dict[tuple, list] = {}
+    for word in page.get_text("words", sort=True):
+        grouped.setdefault(word[5:7], []).append(word)
+
+    lines = []
+    for words in grouped.values():
+        label_words, numbers, run = [], [], []
+        for word in words:
+            box = (word[0] / width, word[1] / height, word[2] / width, word[3] / height)
+            if pdf_utils.NUMBER_TOKEN_PATTERN.fullmatch(word[4]):
+                run.append((word[4], box))
+                continue
+            if run:
+                numbers.append(run)
+                run = []
+            if not any(ch.isdigit() for ch in word[4]):
+                label_words.append((word[4], box))
+        if run:
+            numbers.append(run)
+
+        label = normalize_text(" ".join(text for text, _ in label_words))
+        label = re.sub(r"[^\w ]", "", label).strip()
+        if not MIN_ANCHOR_CHARS <= len(label) <= MAX_ANCHOR_CHARS:
+            label = ""
+        lines.append(Line(
+            label=label,
+            label_box=_union([box for _, box in label_words]) if label else None,
+            numbers=[("".join(text for text, _ in run), _union([box for _, box in run])) for run in numbers],
+        ))
+    return lines
+
+
+def extract_layout(pdf) -> Layout | None:
+    """The layout of a PDF (bytes or path), or None if it can't be read."""
+    try:
+        with pdf_utils.open_pdf(pdf) as doc:
+            return Layout([page_layout(page) if pdf_utils.has_usable_text_layer(page) else [] for page in doc])
+    except Exception as e:
+        tracing.log("Layout extraction error", level="error", error=str(e))
+        return None
+
+
+def anchor_similarity(a: list[tuple[int, str, tuple]], b: list[tuple[int, str, tuple]]) -> float:
+    """Dice coefficient of two anchor lists: same page and label, centers within ANCHOR_TOLERANCE."""
+    if not a or not b:
+        return 0.0
+    remaining: dict[tuple, list] = {}
+    for page_num, label, center in b:
+        remaining.setdefault((page_num, label), []).append(center)
+    matched = 0
+    for page_num, label, center in a:
+        centers = remaining.get((page_num, label))
+        if not centers:
+            continue
+        for i, other in enumerate(centers):
+            if abs(other[0] - center[0]) <= ANCHOR_TOLERANCE and abs(other[1] - center[1]) <= ANCHOR_TOLERANCE:
+                del centers[i]
+                matched += 1
+                break
+    return 2 * matched / (len(a) + len(b))
+
+
+@dataclass
+class TemplateField:
+    page: int
+    # Label the value sits next to ("" to use the absolute box)
+    anchor: str
+    anchor_center: tuple
+    box: tuple
+
+    def read(self, layout: Layout) -> tuple[float, tuple] | None:
+        """(value, box) of the field in `layout`, or None if it isn't where expected."""
+        if self.page > len(layout.pages):
+            return None
+        lines = layout.pages[self.page - 1]
+        shift = (0.0, 0.0)
+        if self.anchor:
+            centers = [_center(line.label_box) for line in lines if line.label == self.anchor]
+            if not centers:
+                return None
+            nearest = min(centers, key=lambda c: (c[0] - self.anchor_center[0]) ** 2 + (c[1] - self.anchor_center[1]) ** 2)
+            shift = (nearest[0] - self.anchor_center[0], nearest[1] - self.anchor_center[1])
+
+        # Amounts are usually right-aligned, so compare right edges and vertical centers
+        expected_x = self.box[2] + shift[0]
+        expected_y = (self.box[1] + self.box[3]) / 2 + shift[1]
+        best = None
+        for line in lines:
+            for text, box in line.numbers:
+                dx = box[2] - expected_x
+                dy = (box[1] + box[3]) / 2 - expected_y
+                if abs(dx) > FIELD_TOLERANCE_X or abs(dy) > FIELD_TOLERANCE_Y:
+                    continue
+                distance = dx ** 2 + (pdf_utils.LABEL_ROW_WEIGHT * dy) ** 2
+                if best is None or distance < best[0]:
+                    best = (distance, text, box)
+        if best is None:
+            return None
+        value = number_parser.parse_number(best[1])
+        return (value, best[2]) if value is not None else None
+
+    def to_dict(self) -> dict:
+        return {"page": self.page, "anchor": self.anchor, "anchor_center": list(self.anchor_center), "box": list(self.box)}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TemplateField":
+        return cls(data["page"], data["anchor"], tuple(data["anchor_center"]), tuple(data["box"]))
+
+
+@dataclass
+class Template:
+    id: str
+    document_type: str
+    anchors: list[tuple[int, str, tuple]]
+    fields: dict[str, TemplateField]
+    confirmations: int = 1
+    # Documents read with the template since the server started (not saved)
+    hits: int = 0
+    created_at: float = 0.0
+    updated_at: float = 0.0
+
+    def read(self, layout: Layout) -> dict[str, tuple[float, int, tuple]] | None:
+        """{field: (value, page, box)}, or None unless every field was found."""
+        values = {}
+        for name, template_field in self.fields.items():
+            found = template_field.read(layout)
+            if found is None:
+                return None
+            values[name] = (found[0], template_field.page, found[1])
+        return values
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "document_type": self.document_type,
+            "anchors": [[page_num, label, list(center)] for page_num, label, center in self.anchors],
+            "fields": {name: template_field.to_dict() for name, template_field in self.fields.items()},
+            "confirmations": self.confirmations,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Template":
+        return cls(
+            id=data["id"],
+            document_type=data["document_type"],
+            anchors=[(page_num, label, tuple(center)) for page_num, label, center in data["anchors"]],
+            fields={name: TemplateField.from_dict(value) for name, value in data["fields"].items()},
+            confirmations=data.get("confirmations", 1),
+            created_at=data.get("created_at", 0.0),
+            updated_at=data.get("updated_at", 0.0),
+        )
+
+    def describe(self) -> dict:
+        """Summary for API clients (without the anchors)."""
+        return {
+            "id": self.id,
+            "document_type": self.document_type,
+            "fields": sorted(self.fields),
+            "anchors": len(self.anchors),
+            "confirmations": self.confirmations,
+            "hits": self.hits,
+            "updated_at": self.updated_at,
+        }
+
+
+@dataclass
+class TemplateMatch:
+    template: Template
+    similarity: float
+    # field -> (value, page, box)
+    values: dict[str, tuple[float, int, tuple]]
+
+    def chips(self) -> list[dict]:
+        """Chips as the text model's extraction would produce them, with their page and page-fraction box."""
+        import text_extractor
+
+        schema_class = DOCUMENT_TYPE_TO_SCHEMA[self.template.document_type]
+        chips = text_extractor.schema_to_chips({name: value for name, (value, _, _) in self.values.items()}, schema_class)
+        for chip in chips:
+            _, page_num, box = self.values[chip["field_name"]]
+            chip["page"] = page_num
+            chip["box"] = box
+            chip["value_check"] = "confirmed"
+        return chips
+
+
+def _stems(text: str) -> set[str]:
+    """Word stems (first 5 letters of words of 4+) for comparing labels: "pensiones" ~ "pension"."""
+    return {word[:5] for word in re.findall(r"\w+", normalize_text(text.replace("_", " "))) if len(word) >= 4}
+
+
+def _locate(
+    layout: Layout, value: float, page_hint: int | None, description: str, taken: set
+) -> tuple[int, Line, tuple] | None:
+    """
+    Where `value` is printed: a numeric run on `page_hint` if possible, next to
+    the label sharing most words with the field's `description`, then the
+    closest label. Runs in `taken` (already assigned to a field) are skipped.
+    """
+    stems = _stems(description)
+    best = None
+    for page_num, lines in enumerate(layout.pages, 1):
+        for line in lines:
+            for text, box in line.numbers:
+                parsed = number_parser.parse_number(text)
+                # The model may drop the decimals ("54.822,21" -> 54822)
+                if parsed is None or abs(abs(parsed) - abs(value)) >= 1 or (page_num, box) in taken:
+                    continue
+                anchor = _nearest_anchor(lines, box)
+                overlap = len(stems & _stems(anchor[1].label)) if anchor else 0
+                rank = (page_num != page_hint, -overlap, anchor[0] if anchor else 10.0)
+                if best is None or rank < best[0]:
+                    best = (rank, page_num, anchor[1] if anchor else None, box)
+    return best[1:] if best else None
+
+
+def _nearest_anchor(lines: list[Line], box: tuple) -> tuple[float, Line] | None:
+    """
+    The label line closest to `box`, with its distance: labels on the same
+    row come first (values sit right of their label, often far across a
+    table), then the closest by gap between the boxes.
+    """
+    value_center = _center(box)
+    best = None
+    for line in lines:
+        if not line.label:
+            continue
+        label_box = line.label_box
+        gap_x = max(0.0, box[0] - label_box[2], label_box[0] - box[2])
+        dy = _center(label_box)[1] - value_center[1]
+        same_row = abs(dy) <= (box[3] - box[1]) / 2
+        distance = gap_x ** 2 + (pdf_utils.LABEL_ROW_WEIGHT * dy) ** 2 + (0.0 if same_row else 1.0)
+        if best is None or distance < best[0]:
+            best = (distance, line)
+    return best
+
+
+class TemplateLibrary:
+    """Templates on disk, indexed in memory by anchor label. Thread-safe."""
+
+    def __init__(self, directory: Path = LAYOUT_TEMPLATES_DIR):
+        self.directory = Path(directory)
+        self._templates: dict[str, Template] = {}
+        # (page, label) -> ids of the templates having that anchor
+        self._index: dict[tuple, set[str]] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _ensure_loaded(self):
+        # Caller must hold self._lock
+        if self._loaded:
+            return
+        self._loaded = True
+        for path in sorted(self.directory.glob("*.json")):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._add(Template.from_dict(json.load(f)))
+            except Exception as e:
+                tracing.log("Layout template read error", level="error", path=str(path), error=str(e))
+
+    def _add(self, template: Template):
+        self._templates[template.id] = template
+        for page_num, label, _ in template.anchors:
+            self._index.setdefault((page_num, label), set()).add(template.id)
+
+    def _remove(self, template_id: str) -> Template | None:
+        template = self._templates.pop(template_id, None)
+        if template is not None:
+            for page_num, label, _ in template.anchors:
+                self._index.get((page_num, label), set()).discard(template_id)
+        return template
+
+    def _save(self, template: Template):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{template.id}.json"
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(template.to_dict(), f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+
+    def _best(self, anchors: list[tuple[int, str, tuple]], document_type: str | None = None) -> tuple[Template, float] | None:
+        # Caller must hold self._lock
+        candidates = set()
+        for page_num, label, _ in anchors:
+            candidates.update(self._index.get((page_num, label), ()))
+        best = None
+        for template_id in candidates:
+            template = self._templates[template_id]
+            if document_type is not None and template.document_type != document_type:
+                continue
+            similarity = anchor_similarity(anchors, template.anchors)
+            if similarity >= LAYOUT_TEMPLATE_MIN_SIMILARITY and (best is None or similarity > best[1]):
+                best = (template, similarity)
+        return best
+
+    def match(self, layout: Layout) -> TemplateMatch | None:
+        """Reads a document with the best matching template, if one matches and finds every field."""
+        if layout is None or not layout.has_text:
+            return None
+        anchors = layout.anchors(FINGERPRINT_PAGES)
+        with self._lock:
+            self._ensure_loaded()
+            best = self._best(anchors)
+        if best is None:
+            return None
+        template, similarity = best
+        values = template.read(layout)
+        if values is None:
+            tracing.log("Layout template incomplete", level="warning", template_id=template.id)
+            return None
+        with self._lock:
+            template.hits += 1
+        return TemplateMatch(template, round(similarity, 3), values)
+
+    def learn(self, layout: Layout, document_type: str, fields: dict[str, float], page_hints: dict[str, int] | None = None) -> Template:
+        """
+        Creates a template from a document's layout and its confirmed field
+        values, or adds the fields to the template already matching the layout.
+
+        Raises:
+            ValueError: If the document type is unknown, the layout has no text
+                layer, or no confirmed value could be located in it
+        """
+        schema_class = DOCUMENT_TYPE_TO_SCHEMA.get(document_type)
+        if schema_class is None:
+            raise ValueError(f"Unknown document type: {document_type}")
+        if layout is None or not layout.has_text:
+            raise ValueError("The document has no usable text layer")
+
+        page_hints = page_hints or {}
+        learned = {}
+        taken = set()
+        for name, value in fields.items():
+            if name not in schema_class.model_fields or value is None:
+                continue
+            description = f"{name} {schema_class.model_fields[name].description or ''}"
+            located = _locate(layout, value, page_hints.get(name), description, taken)
+            if located is None:
+                continue
+            page_num, anchor_line, box = located
+            taken.add((page_num, box))
+            learned[name] = TemplateField(
+                page=page_num,
+                anchor=anchor_line.label if anchor_line else "",
+                anchor_center=_center(anchor_line.label_box) if anchor_line else (0.0, 0.0),
+                box=box,
+            )
+        # Keep only the fields the template reads back correctly from this same document
+        learned = {
+            name: template_field for name, template_field in learned.items()
+            if (found := template_field.read(layout)) is not None and abs(abs(found[0]) - abs(fields[name])) < 1
+        }
+        if not learned:
+            raise ValueError("None of the confirmed values were found in the text layer")
+
+        anchors = layout.anchors(FINGERPRINT_PAGES)
+        now = time.time()
+        with self._lock:
+            self._ensure_loaded()
+            best = self._best(anchors, document_type)
+            if best is not None:
+                template = best[0]
+                self._remove(template.id)
+                # A new dict, never an update in place: match() reads templates outside the lock
+                template.fields = {**template.fields, **learned}
+                template.anchors = anchors
+                template.confirmations += 1
+                template.updated_at = now
+            else:
+                digest = hashlib.sha256(json.dumps([document_type, anchors]).encode("utf-8")).hexdigest()
+                template = Template(
+                    id=f"{document_type}-{digest[:12]}",
+                    document_type=document_type,
+                    anchors=anchors,
+                    fields=learned,
+                    created_at=now,
+                    updated_at=now,
+                )
+            self._add(template)
+            self._save(template)
+        tracing.log("Layout template learned", template_id=template.id, fields=sorted(learned))
+        return template
+
+    def templates(self) -> list[Template]:
+        with self._lock:
+            self._ensure_loaded()
+            return sorted(self._templates.values(), key=lambda template: template.id)
+
+    def delete(self, template_id: str) -> bool:
+        with self._lock:
+            self._ensure_loaded()
+            if self._remove(template_id) is None:
+                return False
+            (self.directory / f"{template_id}.json").unlink(missing_ok=True)
+            return True
+
+
+class PendingLayouts:
+    """
+    Layouts of recently processed documents with the extraction's document
+    type and chips, kept (bounded, TTL'd) until they are confirmed into a template.
+    """
+
+    def __init__(self, max_documents: int = LAYOUT_PENDING_MAX_DOCUMENTS, ttl_seconds: int = LAYOUT_PENDING_TTL_SECONDS):
+        self.max_documents = max_documents
+        self.ttl_seconds = ttl_seconds
+        # doc_id -> (stored at, layout, document type, chips)
+        self._documents: OrderedDict[str, tuple[float, Layout, str | None, list[dict]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, doc_id: str, layout: Layout, document_type: str | None, chips: list[dict]):
+        with self._lock:
+            self._expire()
+            self._documents[doc_id] = (time.monotonic(), layout, document_type, chips)
+            while len(self._documents) > self.max_documents:
+                self._documents.popitem(last=False)
+
+    def get(self, doc_id: str) -> tuple[Layout, str | None, list[dict]] | None:
+        with self._lock:
+            self._expire()
+            entry = self._documents.get(doc_id)
+            return entry[1:] if entry else None
+
+    def alias(self, doc_id: str, alias_id: str):
+        """Makes the pending layout of `doc_id` learnable under `alias_id` too (a duplicate upload)."""
+        with self._lock:
+            self._expire()
+            entry = self._documents.get(doc_id)
+            if entry is not None:
+                self._documents[alias_id] = (time.monotonic(), *entry[1:])
+                while len(self._documents) > self.max_documents:
+                    self._documents.popitem(last=False)
+
+    def _expire(self):
+        # Caller must hold self._lock
+        cutoff = time.monotonic() - self.ttl_seconds
+        while self._documents and next(iter(self._documents.values()))[0] < cutoff:
+            self._documents.popitem(last=False)
+
+
+template_library = TemplateLibrary()
+pending_layouts = PendingLayouts()
+
+
+def learn_from_document(doc_id: str, document_type: str | None = None, fields: dict[str, float] | None = None) -> Template | None:
+    """
+    Learns a template from a processed document. `fields` are the confirmed
+    values (default: the extraction's chips as returned); `document_type`
+    overrides the classified type. Returns None if the document is unknown or expired.
+    """
+    pending = pending_layouts.get(doc_id)
+    if pending is None:
+        return None
+    layout, extracted_type, chips = pending
+    page_hints = {chip["field_name"]: chip.get("page") for chip in chips if chip.get("field_name")}
+    if fields is None:
+        fields = {chip["field_name"]: chip["value"] for chip in chips if chip.get("field_name")}
+    return template_library.learn(layout, document_type or extracted_type, fields, page_hints)
+
+
+class TemplateLearnRequest(BaseModel):
+    """Body of POST /templates/learn."""
+    doc_id: str = Field(..., description="doc_id of a document processed by /upload-with-relevance")
+    document_type: str | None = Field(None, description="Corrected document type (default: the classified one)")
+    fields: dict[str, float] | None = Field(
+        None, description="Confirmed values by schema field name (default: the extracted chips as returned)"
+    )
@@ -0,0 +1,225 @@
+"""
+Pluggable LLM backend.
+
+`create_client()` returns the client that vision_processor and text_extractor
+call (`client.chat.completions.create(...)`), selected with LLM_BACKEND:
+
+- "openai" (default): the real AsyncOpenAI client
+- "record": the real client, saving every response under LLM_RECORDINGS_DIR
+- "replay": a local stand-in that never touches the network. It returns the
+  recorded response for the same request (model, prompt, image hash and
+  response format) or, if there is none, a synthetic response of the right
+  shape, and can simulate latency, server errors and 429s
+
+Replay makes pipeline runs deterministic and free, so benchmarks measure our
+own code separately from model latency.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from pathlib import Path
+
+import httpx
+import openai
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletion
+
+load_dotenv()
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+LLM_RECORDINGS_DIR = Path(os.getenv("LLM_RECORDINGS_DIR", str(Path(__file__).parent / ".cache" / "llm_recordings")))
+
+# Replay simulation: mean latency and jitter per call, and probabilities of failures
+LLM_FAKE_LATENCY_MS = float(os.getenv("LLM_FAKE_LATENCY_MS", "0"))
+LLM_FAKE_LATENCY_JITTER_MS = float(os.getenv("LLM_FAKE_LATENCY_JITTER_MS", "0"))
+LLM_FAKE_ERROR_RATE = float(os.getenv("LLM_FAKE_ERROR_RATE", "0"))
+LLM_FAKE_RATE_LIMIT_RATE = float(os.getenv("LLM_FAKE_RATE_LIMIT_RATE", "0"))
+LLM_FAKE_RETRY_AFTER_SECONDS = float(os.getenv("LLM_FAKE_RETRY_AFTER_SECONDS", "1"))
+LLM_FAKE_SEED = os.getenv("LLM_FAKE_SEED")
+
+
+def _strip_images(value):
+    """Replaces image data URLs with their hash so request keys stay small."""
+    if isinstance(value, dict):
+        if value.get("type") == "image_url":
+            image_url = dict(value["image_url"])
+            image_url["url"] = "sha256:" + hashlib.sha256(image_url["url"].encode("ascii")).hexdigest()
+            return {**value, "image_url": image_url}
+        return {key: _strip_images(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_strip_images(item) for item in value]
+    return value
+
+
+def request_key(request: dict) -> str:
+    """Hash identifying a chat completion request (model, messages, images, response format)."""
+    relevant = {key: request.get(key) for key in ("model", "messages", "response_format", "temperature")}
+    blob = json.dumps(_strip_images(relevant), sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def make_completion(model: str, content: str, usage: dict | None = None, finish_reason: str = "stop") -> ChatCompletion:
+    usage = usage or {"prompt_tokens": 0, "completion_tokens": 0}
+    return ChatCompletion.model_validate({
+        "id": "chatcmpl-replay",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "finish_reason": finish_reason,
+            "message": {"role": "assistant", "content": content},
+        }],
+        "usage": {
+            "prompt_tokens": usage["prompt_tokens"],
+            "completion_tokens": usage["completion_tokens"],
+            "total_tokens": usage["prompt_tokens"] + usage["completion_tokens"],
+        },
+    })
+
+
+def _synthetic_content(request: dict) -> str:
+    """A well-formed reply for requests that were never recorded."""
+    response_format = request.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        properties = response_format["json_schema"]["schema"].get("properties", {})
+        return json.dumps({name: None for name in properties})
+    # One object that satisfies the classification, markdown and chip prompts
+    return json.dumps({"document_type": "otro", "confidence": "baja", "markdown": "", "chips": []})
+
+
+class RecordingStore:
+    """Recorded responses as one JSON file per request key."""
+
+    def __init__(self, directory: Path = LLM_RECORDINGS_DIR):
+        self.directory = Path(directory)
+
+    def _path_for(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> dict | None:
+        try:
+            with open(self._path_for(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, response: ChatCompletion) -> None:
+        path = self._path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        usage = response.usage
+        recording = {
+            "model": getattr(response, "model", None),
+            "content": response.choices[0].message.content,
+            "finish_reason": response.choices[0].finish_reason,
+            "usage": {
+                "prompt_tokens": usage.prompt_tokens if usage else 0,
+                "completion_tokens": usage.completion_tokens if usage else 0,
+            },
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(recording, f, ensure_ascii=False)
+
+
+class _Completions:
+    def __init__(self, create):
+        self.create = create
+
+
+class _Chat:
+    def __init__(self, create):
+        self.completions = _Completions(create)
+
+
+class ReplayClient:
+    """
+    Offline stand-in for AsyncOpenAI (only `chat.completions.create`).
+
+    Failures are raised as the same openai exceptions the real client raises,
+    so llm_scheduler's retry and 429 handling run exactly as in production.
+    """
+
+    def __init__(
+        self,
+        store: RecordingStore | None = None,
+        latency_ms: float = LLM_FAKE_LATENCY_MS,
+        latency_jitter_ms: float = LLM_FAKE_LATENCY_JITTER_MS,
+        error_rate: float = LLM_FAKE_ERROR_RATE,
+        rate_limit_rate: float = LLM_FAKE_RATE_LIMIT_RATE,
+        retry_after_seconds: float = LLM_FAKE_RETRY_AFTER_SECONDS,
+        seed: int | str | None = LLM_FAKE_SEED,
+    ):
+        self.store = store or RecordingStore()
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after_seconds = retry_after_seconds
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.misses = 0
+        self.chat = _Chat(self._create)
+
+    def _fake_response(self, status_code: int, headers: dict | None = None) -> httpx.Response:
+        request = httpx.Request("POST", "http://replay.local/v1/chat/completions")
+        return httpx.Response(status_code, headers=headers, request=request)
+
+    async def _create(self, **request) -> ChatCompletion:
+        self.calls += 1
+        latency = self.latency_ms + self.random.uniform(-self.latency_jitter_ms, self.latency_jitter_ms)
+        if latency > 0:
+            await asyncio.sleep(latency / 1000)
+
+        roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            raise openai.RateLimitError(
+                "Simulated rate limit",
+                response=self._fake_response(429, {"retry-after": str(self.retry_after_seconds)}),
+                body=None,
+            )
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise openai.InternalServerError("Simulated server error", response=self._fake_response(500), body=None)
+
+        model = request.get("model", "")
+        recording = await asyncio.to_thread(self.store.get, request_key(request))
+        if recording is None:
+            self.misses += 1
+            return make_completion(model, _synthetic_content(request))
+        return make_completion(
+            recording.get("model") or model,
+            recording["content"],
+            recording.get("usage"),
+            recording.get("finish_reason", "stop"),
+        )
+
+
+class RecordingClient:
+    """The real client, saving each response for later replay."""
+
+    def __init__(self, client: AsyncOpenAI, store: RecordingStore | None = None):
+        self.client = client
+        self.store = store or RecordingStore()
+        self.chat = _Chat(self._create)
+
+    async def _create(self, **request) -> ChatCompletion:
+        response = await self.client.chat.completions.create(**request)
+        await asyncio.to_thread(self.store.put, request_key(request), response)
+        return response
+
+
+def create_client(backend: str = LLM_BACKEND):
+    """Creates the chat client for the configured backend."""
+    if backend == "replay":
+        return ReplayClient()
+    # Retries are handled by llm_scheduler, which also honors rate limits
+    client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+    if backend == "record":
+        return RecordingClient(client)
+    if backend != "openai":
+        raise ValueError(f"Unknown LLM_BACKEND: {backend}")
+    return client
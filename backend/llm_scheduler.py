@@ -0,0 +1,318 @@
+"""
+Rate-limit-aware scheduler for OpenAI calls.
+
+Every model call goes through `scheduler.call`, which:
+- enforces per-model requests-per-minute and tokens-per-minute budgets with
+  token buckets (from the account's usage tier, LLM_ACCOUNT_TIER, tier 1 by
+  default, and LLM_RATE_LIMITS), plus a global cap on in-flight requests;
+- serves interactive uploads before batch work (see `batch_priority`);
+- retries 429/5xx/connection errors with jittered exponential backoff,
+  honoring Retry-After, and pauses the whole model after a 429 so other
+  callers don't keep hammering it.
+
+Calls that still fail after all retries raise `LLMCallError`.
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable
+
+import metrics
+import tracing
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+# Published requests/tokens per minute of each OpenAI usage tier
+TIER_RATE_LIMITS = {
+    "1": {"gpt-4o": {"rpm": 500, "tpm": 30_000}, "gpt-4o-mini": {"rpm": 500, "tpm": 200_000}},
+    "2": {"gpt-4o": {"rpm": 5_000, "tpm": 450_000}, "gpt-4o-mini": {"rpm": 5_000, "tpm": 2_000_000}},
+    "3": {"gpt-4o": {"rpm": 5_000, "tpm": 800_000}, "gpt-4o-mini": {"rpm": 5_000, "tpm": 4_000_000}},
+    "4": {"gpt-4o": {"rpm": 10_000, "tpm": 2_000_000}, "gpt-4o-mini": {"rpm": 10_000, "tpm": 10_000_000}},
+    "5": {"gpt-4o": {"rpm": 10_000, "tpm": 30_000_000}, "gpt-4o-mini": {"rpm": 30_000, "tpm": 150_000_000}},
+}
+# Unset, calls are budgeted for the lowest tier, which no account can exceed
+DEFAULT_ACCOUNT_TIER = "1"
+LLM_ACCOUNT_TIER = os.getenv("LLM_ACCOUNT_TIER") or DEFAULT_ACCOUNT_TIER
+# Per-model overrides, e.g. LLM_RATE_LIMITS='{"gpt-4o": {"rpm": 5000, "tpm": 800000}}';
+# a missing "rpm" or "tpm" (or null) is not capped
+LLM_RATE_LIMITS = os.getenv("LLM_RATE_LIMITS", "{}")
+
+
+def resolve_rate_limits(tier: str, overrides: str = "{}") -> tuple[dict, dict]:
+    """
+    Per-model budgets of an account tier with the LLM_RATE_LIMITS overrides,
+    and the budget of models without one of their own (the tier's gpt-4o).
+
+    Raises:
+        ValueError: If the tier is not one of TIER_RATE_LIMITS
+    """
+    if tier not in TIER_RATE_LIMITS:
+        raise ValueError(f"LLM_ACCOUNT_TIER must be one of {', '.join(TIER_RATE_LIMITS)}, not {tier!r}")
+    return {**TIER_RATE_LIMITS[tier], **json.loads(overrides)}, TIER_RATE_LIMITS[tier]["gpt-4o"]
+
+
+RATE_LIMITS, FALLBACK_RATE_LIMIT = resolve_rate_limits(LLM_ACCOUNT_TIER, LLM_RATE_LIMITS)
+
+
+def log_rate_limits():
+    """Logs the budgets in effect at startup, with a warning when the tier was left to its default."""
+    if os.getenv("LLM_ACCOUNT_TIER"):
+        tracing.log("LLM rate limits", tier=LLM_ACCOUNT_TIER, limits=RATE_LIMITS)
+    else:
+        tracing.log(
+            "LLM rate limits: LLM_ACCOUNT_TIER is not set, budgeting for tier 1",
+            level="warning", tier=LLM_ACCOUNT_TIER, limits=RATE_LIMITS,
+        )
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "1"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "60"))
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+_priority = contextvars.ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+
+
+class LLMCallError(Exception):
+    """A model call failed after exhausting retries (or with a non-retryable error)."""
+
+
+@contextmanager
+def batch_priority():
+    """Runs the enclosed calls (and tasks spawned from them) at batch priority."""
+    token = _priority.set(PRIORITY_BATCH)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """
+    Classic token bucket refilled continuously at `capacity` per minute.
+    A capacity of None never makes callers wait.
+    """
+
+    def __init__(self, capacity_per_minute: float | None):
+        self.capacity = float(capacity_per_minute) if capacity_per_minute else None
+        self.rate = self.capacity / 60.0 if self.capacity else None
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available (0 if available now)."""
+        if self.capacity is None:
+            return 0.0
+        self._refill()
+        # Requests larger than the bucket are let through once it is full
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        if self.capacity is None:
+            return
+        self._refill()
+        self.tokens -= amount
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for budgeting (~4 characters per token)."""
+    return len(text) // 4 + 1
+
+
+def retry_after_seconds(error: Exception) -> float | None:
+    """Reads Retry-After (or retry-after-ms) from an OpenAI error response."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+def is_retryable(error: Exception) -> bool:
+    # Imported here so modules that only need `estimate_tokens` don't load the SDK
+    import openai
+
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return False
+
+
+class LLMScheduler:
+    def __init__(
+        self,
+        rate_limits: dict = RATE_LIMITS,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        max_retries: int = LLM_MAX_RETRIES,
+        backoff_base: float = LLM_BACKOFF_BASE_SECONDS,
+        backoff_max: float = LLM_BACKOFF_MAX_SECONDS,
+    ):
+        self.rate_limits = rate_limits
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._request_buckets: dict[str, TokenBucket] = {}
+        self._token_buckets: dict[str, TokenBucket] = {}
+        self._paused_until: dict[str, float] = {}
+        self._waiting: dict[str, list] = {}
+        self._in_flight = 0
+        self._sequence = itertools.count()
+        self._condition = None
+
+    def _buckets(self, model: str) -> tuple[TokenBucket, TokenBucket]:
+        if model not in self._request_buckets:
+            limits = self.rate_limits.get(model, FALLBACK_RATE_LIMIT)
+            self._request_buckets[model] = TokenBucket(limits.get("rpm"))
+            self._token_buckets[model] = TokenBucket(limits.get("tpm"))
+        return self._request_buckets[model], self._token_buckets[model]
+
+    def _get_condition(self) -> asyncio.Condition:
+        # Created lazily so it binds to the running event loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def _acquire(self, model: str, tokens: int, priority: int):
+        condition = self._get_condition()
+        requests_bucket, tokens_bucket = self._buckets(model)
+        entry = (priority, next(self._sequence))
+        waiting = self._waiting.setdefault(model, [])
+
+        async with condition:
+            heapq.heappush(waiting, entry)
+            try:
+                while True:
+                    timeout = None
+                    if waiting[0] == entry and self._in_flight < self.max_concurrency:
+                        timeout = max(
+                            self._paused_until.get(model, 0) - time.monotonic(),
+                            requests_bucket.wait_time(1),
+                            tokens_bucket.wait_time(tokens),
+                        )
+                        if timeout <= 0:
+                            requests_bucket.consume(1)
+                            tokens_bucket.consume(tokens)
+                            self._in_flight += 1
+                            return
+                    try:
+                        await asyncio.wait_for(condition.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                waiting.remove(entry)
+                heapq.heapify(waiting)
+                condition.notify_all()
+
+    async def _release(self):
+        condition = self._get_condition()
+        async with condition:
+            self._in_flight -= 1
+            condition.notify_all()
+
+    def _pause(self, model: str, seconds: float):
+        """Stops dispatching to `model` for `seconds` (after a 429)."""
+        self._paused_until[model] = max(self._paused_until.get(model, 0), time.monotonic() + seconds)
+
+    def _backoff(self, attempt: int, retry_after: float | None) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        delay = random.uniform(delay / 2, delay)  # Jitter spreads out synchronized retries
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    async def call(
+        self,
+        model: str,
+        request: Callable[[], Awaitable],
+        estimated_tokens: int = 1000,
+        priority: int | None = None,
+    ):
+        """
+        Runs `request()` (an OpenAI call for `model`) within the model's budgets,
+        retrying transient failures.
+
+        Args:
+            model: Model name, used to select the rate limits
+            request: Zero-argument callable returning the awaitable API call
+            estimated_tokens: Prompt + completion tokens to reserve up front
+            priority: PRIORITY_INTERACTIVE or PRIORITY_BATCH (defaults to the current context)
+
+        Raises:
+            LLMCallError: If the call fails after all retries or with a non-retryable error
+        """
+        priority = _priority.get() if priority is None else priority
+
+        for attempt in range(self.max_retries + 1):
+            queued = time.perf_counter()
+            await self._acquire(model, estimated_tokens, priority)
+            start = time.perf_counter()
+            with tracing.span(
+                "llm.call", model=model, attempt=attempt + 1, queued_seconds=round(start - queued, 4)
+            ) as call_span:
+                try:
+                    response = await request()
+                except Exception as e:
+                    error = e
+                    call_span.fail(e)
+                    call_span.set(status_code=getattr(e, "status_code", None))
+                else:
+                    usage = getattr(response, "usage", None)
+                    metrics.record_llm_call(model, time.perf_counter() - start, usage)
+                    call_span.set(
+                        prompt_tokens=getattr(usage, "prompt_tokens", None),
+                        completion_tokens=getattr(usage, "completion_tokens", None),
+                    )
+                    # Correct the token reservation with the actual usage
+                    total_tokens = getattr(usage, "total_tokens", None)
+                    if isinstance(total_tokens, int):
+                        self._buckets(model)[1].consume(total_tokens - estimated_tokens)
+                    return response
+                finally:
+                    await self._release()
+
+            if not is_retryable(error) or attempt == self.max_retries:
+                metrics.record_llm_call(model, None, error=True)
+            if not is_retryable(error):
+                raise LLMCallError(f"{model} call failed: {error}") from error
+            if attempt == self.max_retries:
+                raise LLMCallError(f"{model} call failed after {attempt + 1} attempts: {error}") from error
+
+            metrics.record_llm_retry(model, str(getattr(error, "status_code", None) or type(error).__name__))
+
+            delay = self._backoff(attempt, retry_after_seconds(error))
+            if getattr(error, "status_code", None) == 429:
+                self._pause(model, delay)
+            tracing.log(
+                "LLM retry", level="warning", model=model, attempt=attempt + 1,
+                max_retries=self.max_retries, delay_seconds=round(delay, 2), error=str(error),
+            )
+            await asyncio.sleep(delay)
+
+
+scheduler = LLMScheduler()
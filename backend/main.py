@@ -1,30 +1,47 @@
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, UploadFile, File, Depends, Header, Response, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import uvicorn
+import asyncio
 import json
 import os
-import shutil
 import uuid
-import asyncio
-import base64
-from pathlib import Path
+from dataclasses import dataclass, replace
 from dotenv import load_dotenv
+import form210
+import ingestion
+import layout_templates
+import llm_scheduler
+import metrics
 import pdf_utils
-import vision_processor
+import pipeline
+import tracing
+from page_store import PAGE_SIZES, page_store
+import session_store
+from session_store import session_store as sessions
+from prompt_registry import PROMPT_REGISTRY_WATCH, prompt_registry
+from jobs import QueueFullError, job_queue
+from temp_janitor import TEMP_DIR, temp_janitor
 
 # Load environment variables
 load_dotenv()
 
 # Create temp directory if it doesn't exist
-temp_dir = Path(__file__).parent / "temp"
-temp_dir.mkdir(exist_ok=True)
+temp_dir = TEMP_DIR
+temp_dir.mkdir(parents=True, exist_ok=True)
 
 app = FastAPI(title="TaxWorkbench API")
 
 # Configuration
 API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000")
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "http://localhost:5173,http://localhost:3000").split(",")
+# Import the model and PDF modules in the background once the server is up,
+# so the first request doesn't pay for them
+WARM_UP_ON_STARTUP = os.getenv("WARM_UP_ON_STARTUP", "true").lower() == "true"
+
+# Requests over MAX_REQUEST_BYTES get 413, whether or not they declare their size
+app.add_middleware(ingestion.RequestSizeLimitMiddleware)
 
 # Enable CORS for frontend communication
 app.add_middleware(
@@ -33,21 +50,119 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Extraction-Cache"],
 )
 
 # Mount temp directory to serve images
 app.mount("/temp", StaticFiles(directory=str(temp_dir)), name="temp")
 
+def warm_up():
+    """Imports the modules startup leaves out (PyMuPDF, the OpenAI SDK and the model modules)."""
+    import fitz  # noqa: F401
+    import text_extractor  # noqa: F401
+    import vision_processor  # noqa: F401
+
+
+async def deferred_startup():
+    """Startup work that doesn't have to finish before the server accepts traffic."""
+    try:
+        await asyncio.to_thread(sessions.purge_expired)
+        if WARM_UP_ON_STARTUP:
+            await asyncio.to_thread(warm_up)
+    except Exception as e:
+        tracing.log("Deferred startup error", level="error", error=str(e))
+
+
+deferred_startup_task: asyncio.Task | None = None
+
+
 @app.on_event("startup")
 async def startup_event():
-    # Clean up old temp files on startup to ensure privacy from previous runs
-    if temp_dir.exists():
-        for item in temp_dir.iterdir():
-            if item.is_dir():
-                try:
-                    shutil.rmtree(item)
-                except Exception:
-                    pass
+    global deferred_startup_task
+
+    llm_scheduler.log_rate_limits()
+    # Build every prompt and guide once, off the event loop
+    await asyncio.to_thread(prompt_registry.load)
+    if PROMPT_REGISTRY_WATCH:
+        prompt_registry.start_watching()
+
+    await job_queue.start()
+    # Removes files left by previous runs (and, later, expired ones) in the background
+    temp_janitor.start()
+    deferred_startup_task = asyncio.create_task(deferred_startup(), name="deferred-startup")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if deferred_startup_task is not None:
+        deferred_startup_task.cancel()
+        await asyncio.gather(deferred_startup_task, return_exceptions=True)
+    await temp_janitor.stop()
+    await prompt_registry.stop_watching()
+    await job_queue.stop()
+    pdf_utils.shutdown_render_pool()
+
+
+async def ndjson(events):
+    """Serializes pipeline events as newline-delimited JSON."""
+    async for event in events:
+        yield json.dumps(event, ensure_ascii=False) + "\n"
+
+
+async def read_upload(file: UploadFile) -> ingestion.Upload:
+    try:
+        return await ingestion.read_upload(file)
+    except ingestion.UploadRejectedError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+
+def resolve_render_profile(render_profile: str | None, document_type: str | None) -> pdf_utils.RenderProfile | None:
+    # Neither given: the pipeline picks the profile from the document's first page
+    if not render_profile and not document_type:
+        return None
+    try:
+        return pdf_utils.get_render_profile(render_profile, document_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@dataclass(frozen=True)
+class UploadOptions:
+    """Query parameters of the upload endpoints, with the server defaults applied."""
+    profile: pdf_utils.RenderProfile | None
+    inline_images: bool
+    timings: bool
+    use_text_layer: bool = False
+
+
+def upload_options(
+    render_profile: str | None = None,
+    document_type: str | None = None,
+    inline_images: bool | None = None,
+    timings: bool | None = None
+) -> UploadOptions:
+    """
+    Dependency resolving the options every upload endpoint takes:
+    `render_profile` (or a known `document_type`) selects how pages are
+    rasterized, `inline_images=true` returns pages as base64 data URLs instead
+    of image URLs and `timings=true` adds a per-stage timing, token and cost
+    breakdown.
+    """
+    return UploadOptions(
+        profile=resolve_render_profile(render_profile, document_type),
+        inline_images=inline_images if inline_images is not None else pipeline.INLINE_PAGE_IMAGES,
+        timings=timings if timings is not None else pipeline.INCLUDE_TIMINGS,
+    )
+
+
+def relevance_options(
+    options: UploadOptions = Depends(upload_options),
+    text_layer: bool | None = None
+) -> UploadOptions:
+    """upload_options plus `text_layer` (false forces the vision model), for the two-stage endpoints."""
+    use_text_layer = text_layer if text_layer is not None else pipeline.TEXT_LAYER_MODE == "auto"
+    return replace(options, use_text_layer=use_text_layer)
+
 
 @app.get("/")
 async def root():
@@ -57,148 +172,386 @@ async def root():
 async def health_check():
     return {"status": "healthy", "service": "TaxWorkbench API"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Pipeline stage durations, model calls, tokens, cost, retries and cache hits (Prometheus format)."""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/upload")
-async def upload_document(file: UploadFile = File(...)):
-    """Original upload endpoint - extracts numeric chips only."""
-    doc_id = str(uuid.uuid4())
-    temp_dir_path = temp_dir / doc_id
-    temp_dir_path.mkdir(parents=True, exist_ok=True)
-    
-    pdf_path = temp_dir_path / file.filename
-    with open(pdf_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-        
-    # Convert PDF to images (async, non-blocking)
-    pages_dir = temp_dir_path / "pages"
-    image_paths = await pdf_utils.pdf_to_images_async(str(pdf_path), str(pages_dir))
-    
-    # Process all pages in parallel using asyncio.gather
-    page_tasks = [
-        vision_processor.extract_chips_from_page(path, i + 1, pdf_path=str(pdf_path))
-        for i, path in enumerate(image_paths)
-    ]
-    
-    # Wait for all pages to be processed concurrently
-    page_results = await asyncio.gather(*page_tasks)
-    
-    # Encode images to Base64 and delete them
-    b64_images = []
-    for path in image_paths:
-        with open(path, "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-            b64_images.append(f"data:image/png;base64,{encoded_string}")
-            
-    # CRITICAL: Clean up disk immediately after processing/encoding
-    try:
-        shutil.rmtree(temp_dir_path)
-    except Exception as e:
-        print(f"Cleanup error for {doc_id}: {e}")
-    
-    # Flatten results and add metadata
-    all_chips = []
-    for page_result in page_results:
-        chips = page_result.get("chips", [])  # Extract chips from dict
-        for chip in chips:
-            chip["id"] = str(uuid.uuid4())
-            chip["doc_id"] = doc_id
-        all_chips.extend(chips)
-        
-    return {
-        "doc_id": doc_id,
-        "filename": file.filename,
-        "status": "processed",
-        "chips": all_chips,
-        "image_urls": b64_images # Now contains Base64 Data URLs instead of server paths
-    }
+async def upload_document(
+    response: Response,
+    file: UploadFile = File(...),
+    options: UploadOptions = Depends(upload_options)
+):
+    """
+    Original upload endpoint - extracts numeric chips only.
+    `render_profile` (or a known `document_type`) selects how pages are rasterized.
+    `image_urls` point to GET /documents/{doc_id}/pages/{n}; set `inline_images=true`
+    to get base64 data URLs instead.
+    `timings=true` adds a per-stage timing, token and cost breakdown.
+    """
+    upload = await read_upload(file)
+
+    result = await pipeline.run_upload(upload, options.profile, options.inline_images, options.timings)
+    response.headers["X-Extraction-Cache"] = "hit" if result["cached"] else "miss"
+    return result
+
+
+@app.post("/upload/stream")
+async def upload_document_stream(
+    file: UploadFile = File(...),
+    options: UploadOptions = Depends(upload_options)
+):
+    """
+    Streaming variant of /upload (NDJSON): a `start` event, one `page` event
+    (image and chips) per page as soon as its vision call finishes, then `done`.
+    """
+    upload = await read_upload(file)
+
+    events = pipeline.iter_upload_events(upload, options.profile, options.inline_images, options.timings)
+    return StreamingResponse(ndjson(events), media_type="application/x-ndjson")
 
 
 @app.post("/upload-with-relevance")
-async def upload_document_with_relevance(file: UploadFile = File(...)):
+async def upload_document_with_relevance(
+    response: Response,
+    file: UploadFile = File(...),
+    options: UploadOptions = Depends(relevance_options)
+):
     """
     Upload endpoint with field relevance classification.
     
     Two-stage flow:
-    1. Vision model converts images to structured markdown
+    1. Pages are converted to structured markdown, from the PDF text layer when
+       usable (set `text_layer=false` to force the vision model) or by the vision model
     2. Text model extracts and classifies fields from markdown
+
+    `render_profile` (or a known `document_type`) selects how pages are rasterized;
+    `inline_images=true` returns pages as base64 data URLs instead of image URLs.
+    `timings=true` adds a per-stage timing, token and cost breakdown (`timings`).
+    """
+    upload = await read_upload(file)
+
+    result = await pipeline.run_upload_with_relevance(
+        upload, options.profile, options.use_text_layer, options.inline_images, options.timings
+    )
+    if "cached" in result:
+        response.headers["X-Extraction-Cache"] = "hit" if result["cached"] else "miss"
+    return result
+
+
+@app.post("/upload-with-relevance/stream")
+async def upload_document_with_relevance_stream(
+    file: UploadFile = File(...),
+    options: UploadOptions = Depends(relevance_options)
+):
+    """
+    Streaming variant of /upload-with-relevance (NDJSON): a `start` event, one
+    `page` event (image and markdown source) per page as soon as it is converted,
+    then a `done` event with the document type and stage-2 chips.
+    """
+    upload = await read_upload(file)
+
+    events = pipeline.iter_relevance_events(
+        upload, options.profile, options.use_text_layer, options.inline_images, options.timings
+    )
+    return StreamingResponse(ndjson(events), media_type="application/x-ndjson")
+
+@app.post("/upload-batch")
+async def upload_batch(
+    files: list[UploadFile] = File(...),
+    options: UploadOptions = Depends(relevance_options)
+):
+    """
+    Processes a folder of documents through /upload-with-relevance in one request.
+    Identical files (same bytes) are extracted once; all documents share the model
+    concurrency budget. Returns one result per file, in upload order.
+    """
+    uploads = [await read_upload(file) for file in files]
+
+    return await pipeline.run_batch(uploads, options.profile, options.use_text_layer, options.inline_images, options.timings)
+
+
+@app.post("/upload-batch/stream")
+async def upload_batch_stream(
+    files: list[UploadFile] = File(...),
+    options: UploadOptions = Depends(relevance_options)
+):
+    """
+    Streaming variant of /upload-batch (NDJSON). Events of every document are
+    interleaved as they happen and tagged with the file's `index` in the batch.
+    """
+    uploads = [await read_upload(file) for file in files]
+
+    events = pipeline.iter_batch_events(uploads, options.profile, options.use_text_layer, options.inline_images, options.timings)
+    return StreamingResponse(ndjson(events), media_type="application/x-ndjson")
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(
+    file: UploadFile = File(...),
+    options: UploadOptions = Depends(relevance_options)
+):
+    """
+    Queues a document for /upload-with-relevance processing and returns its job id
+    immediately. Poll GET /jobs/{job_id} for status and results.
+    Responds 503 with Retry-After when the queue is full.
+    """
+    upload = await read_upload(file)
+
+    try:
+        job = job_queue.submit(
+            lambda: pipeline.run_upload_with_relevance(
+                upload, options.profile, options.use_text_layer, options.inline_images, options.timings
+            ),
+            upload.filename
+        )
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+
+    return {"job_id": job.id, "status": job.status, "status_url": f"{API_BASE_URL}/jobs/{job.id}"}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Returns the status of a job, with its result once completed."""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@app.get("/documents/{doc_id}/pages/{page_num}")
+async def get_page_image(
+    doc_id: str,
+    page_num: int,
+    size: str = "full",
+    if_none_match: str | None = Header(None)
+):
+    """
+    Serves a rendered page of an uploaded document. `size` is one of
+    "full", "preview" or "thumb". Pages expire with the document's session.
+    """
+    if size not in PAGE_SIZES:
+        raise HTTPException(status_code=400, detail=f"Unknown size: {size}")
+
+    page = await asyncio.to_thread(page_store.get, doc_id, page_num, size)
+    if page is None:
+        raise HTTPException(status_code=404, detail="Page not found or expired")
+
+    data, mime_type, etag = page
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={page_store.ttl_seconds}"}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type=mime_type, headers=headers)
+
+
+@app.delete("/documents/{doc_id}", status_code=204)
+async def delete_document(doc_id: str):
+    """Forgets a document's page images (e.g. when the user closes it)."""
+    if not page_store.delete(doc_id):
+        raise HTTPException(status_code=404, detail="Document not found")
+    return Response(status_code=204)
+
+
+@app.post("/templates/learn")
+async def learn_layout_template(request: layout_templates.TemplateLearnRequest):
+    """
+    Confirms a processed document's extraction as a layout template, so later
+    documents with the same layout are read from the text layer without model calls.
     """
-    import text_extractor
-    
-    doc_id = str(uuid.uuid4())
-    temp_dir_path = temp_dir / doc_id
-    temp_dir_path.mkdir(parents=True, exist_ok=True)
-    
-    pdf_path = temp_dir_path / file.filename
-    with open(pdf_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-        
-    # Convert PDF to images
-    pages_dir = temp_dir_path / "pages"
-    image_paths = await pdf_utils.pdf_to_images_async(str(pdf_path), str(pages_dir))
-    
     try:
-        # STAGE 1: Vision model converts to markdown
-        markdown_tasks = [
-            vision_processor.convert_to_markdown(path, i + 1)
-            for i, path in enumerate(image_paths)
-        ]
-        markdown_results = await asyncio.gather(*markdown_tasks)
-        
-        if not markdown_results:
-            return {"error": "No pages were processed"}
-
-        # Get document type from first page
-        document_type = markdown_results[0].get("document_type")
-        confidence = markdown_results[0].get("confidence")
-        
-        # Combine all markdown pages into one document
-        full_markdown = ""
-        for i, md_result in enumerate(markdown_results):
-            markdown_content = md_result.get("markdown", "")
-            full_markdown += f"\n\n--- PAGE {i+1} ---\n\n" + markdown_content
-        
-        # STAGE 2: Text model extracts from ENTIRE document (not per page)
-        all_chips = await text_extractor.extract_from_markdown(
-            full_markdown,
-            document_type,
-            page_num=1,  # Not used anymore, but kept for compatibility
-            model="gpt-4o-mini"
+        template = await asyncio.to_thread(
+            layout_templates.learn_from_document, request.doc_id, request.document_type, request.fields
         )
-        
-        # Encode images to Base64
-        b64_images = []
-        for path in image_paths:
-            with open(path, "rb") as image_file:
-                encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-                b64_images.append(f"data:image/png;base64,{encoded_string}")
-        
-        # Clean up disk
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if template is None:
+        raise HTTPException(status_code=404, detail="Document not found or expired")
+    return template.describe()
+
+
+@app.get("/templates")
+async def list_layout_templates():
+    templates = await asyncio.to_thread(layout_templates.template_library.templates)
+    return {"templates": [template.describe() for template in templates]}
+
+
+@app.delete("/templates/{template_id}", status_code=204)
+async def delete_layout_template(template_id: str):
+    if not await asyncio.to_thread(layout_templates.template_library.delete, template_id):
+        raise HTTPException(status_code=404, detail="Template not found")
+    return Response(status_code=204)
+
+
+@app.post("/sessions", status_code=201)
+async def create_session(request: session_store.SessionCreateRequest):
+    """Creates a workbench session; documents, chips and buckets are then saved one by one."""
+    session_id = await asyncio.to_thread(sessions.create, request.taxpayer, request.state)
+    return {"session_id": session_id}
+
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    """Taxpayer info, UI state, modified buckets and the document list (without chips or pages)."""
+    session = await asyncio.to_thread(sessions.get, session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session
+
+
+@app.patch("/sessions/{session_id}", status_code=204)
+async def update_session(session_id: str, request: session_store.SessionUpdateRequest):
+    if not await asyncio.to_thread(sessions.update, session_id, request.taxpayer, request.state):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return Response(status_code=204)
+
+
+@app.delete("/sessions/{session_id}", status_code=204)
+async def delete_session(session_id: str):
+    if not await asyncio.to_thread(sessions.delete, session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return Response(status_code=204)
+
+
+@app.post("/sessions/{session_id}/documents", status_code=201)
+async def add_session_document(session_id: str, request: session_store.SessionDocumentRequest):
+    """
+    Saves a document with its chips and page images. Pass the upload's
+    `source_doc_id` to save the pages the server rendered (while they are still
+    in the page store), or the pages as data URLs in `images`.
+    """
+    if request.source_doc_id:
+        pages = await asyncio.to_thread(page_store.pages, request.source_doc_id)
+        if pages is None:
+            raise HTTPException(status_code=404, detail="Source document not found or expired")
+        images = [(data, mime_type) for _, data, mime_type in pages]
+    else:
         try:
-            shutil.rmtree(temp_dir_path)
-        except Exception:
-            pass
-        
-        # Add metadata to chips
-        for chip in all_chips:
-            chip["id"] = str(uuid.uuid4())
-            chip["doc_id"] = doc_id
-        
-        return {
-            "doc_id": doc_id,
-            "filename": file.filename,
-            "status": "processed",
-            "document_type": document_type,
-            "classification_confidence": confidence,
-            "chips": all_chips,
-            "image_urls": b64_images,
-            "total_fields": len(all_chips),
-            "markdown": full_markdown,
-            "markdown_preview": full_markdown[:500]
+            images = [session_store.decode_data_url(data_url) for data_url in request.images]
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    document_id = request.id or str(uuid.uuid4())
+    added = await asyncio.to_thread(
+        sessions.add_document, session_id, document_id, request.name, request.chips, images, request.metadata
+    )
+    if added is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    if not added:
+        raise HTTPException(status_code=409, detail=f"Document {document_id} already exists")
+    return await asyncio.to_thread(sessions.get_document, session_id, document_id)
+
+
+@app.get("/sessions/{session_id}/documents/{document_id}")
+async def get_session_document(session_id: str, document_id: str):
+    """A saved document's chips and page image URLs."""
+    document = await asyncio.to_thread(sessions.get_document, session_id, document_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return document
+
+
+@app.patch("/sessions/{session_id}/documents/{document_id}", status_code=204)
+async def update_session_document(session_id: str, document_id: str, request: session_store.DocumentUpdateRequest):
+    if not await asyncio.to_thread(sessions.update_document, session_id, document_id, request.name, request.metadata):
+        raise HTTPException(status_code=404, detail="Document not found")
+    return Response(status_code=204)
+
+
+@app.delete("/sessions/{session_id}/documents/{document_id}", status_code=204)
+async def delete_session_document(session_id: str, document_id: str):
+    if not await asyncio.to_thread(sessions.delete_document, session_id, document_id):
+        raise HTTPException(status_code=404, detail="Document not found")
+    return Response(status_code=204)
+
+
+@app.post("/sessions/{session_id}/documents/{document_id}/chips", status_code=204)
+async def add_session_chips(session_id: str, document_id: str, request: session_store.ChipsRequest):
+    """Appends chips to a saved document; a chip with an existing id replaces it."""
+    if not await asyncio.to_thread(sessions.add_chips, session_id, document_id, request.chips):
+        raise HTTPException(status_code=404, detail="Document not found")
+    return Response(status_code=204)
+
+
+@app.patch("/sessions/{session_id}/buckets/{bucket_id}", status_code=204)
+async def update_session_bucket(session_id: str, bucket_id: str, request: session_store.BucketUpdateRequest):
+    """Saves one bucket's value and sources."""
+    if not await asyncio.to_thread(sessions.set_bucket, session_id, bucket_id, request.value, request.sources):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return Response(status_code=204)
+
+
+@app.get("/sessions/{session_id}/images/{image_hash}")
+async def get_session_image(session_id: str, image_hash: str, if_none_match: str | None = Header(None)):
+    """A saved page image. Images are addressed by content hash, so they never change."""
+    image = await asyncio.to_thread(sessions.get_image, session_id, image_hash)
+    if image is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    data, mime_type = image
+    etag = f'"{image_hash}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=31536000, immutable"}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type=mime_type, headers=headers)
+
+
+@app.get("/form210/casillas")
+async def get_form210_casillas():
+    """Form 210 casillas with their section, formula and the casillas they depend on."""
+    engine = await asyncio.to_thread(form210.get_engine)
+    return {"casillas": engine.describe()}
+
+
+@app.post("/form210/calculate")
+async def calculate_form210(request: form210.CalculationRequest):
+    """
+    Computes the calculated casillas of a Form 210 declaration from its inputs.
+
+    Send `values` alone for a full calculation. To recalculate after editing,
+    send the previous response's `values` plus the edited inputs in `changes`:
+    only the casillas downstream of them are recomputed. `updated` lists the
+    casillas whose value changed.
+    """
+    engine = await asyncio.to_thread(form210.get_engine)
+    unknown = sorted((set(request.values) | set(request.changes or {})) - set(engine.casillas))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown casillas: {', '.join(unknown)}")
+
+    if request.changes is None:
+        values = engine.compute(request.values)
+        updated = {
+            casilla_id: values[casilla_id] for casilla_id in engine.order
+            if request.values.get(casilla_id) != values[casilla_id]
         }
-    except Exception as e:
-        print(f"Global Endpoint Error: {e}")
-        import traceback
-        traceback.print_exc()
-        return {"error": str(e), "status": "failed"}
+    else:
+        try:
+            values, updated = engine.update(request.values, request.changes)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return {"values": values, "updated": updated}
+
+
+@app.post("/form210/calculate-batch")
+async def calculate_form210_batch(request: form210.BatchCalculationRequest):
+    """
+    Computes Form 210 for many taxpayers at once (vectorized). Takes a table with
+    one row of input casillas per taxpayer and returns the full computed table:
+    the input columns followed by every calculated casilla.
+    """
+    engine = await asyncio.to_thread(form210.get_engine)
+    unknown = sorted(set(request.columns) - set(engine.casillas))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown casillas: {', '.join(unknown)}")
+    if len(request.rows) > form210.FORM_210_BATCH_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {form210.FORM_210_BATCH_MAX_ROWS} rows per request")
+    if any(len(row) != len(request.columns) for row in request.rows):
+        raise HTTPException(status_code=400, detail="Every row must have one value per column")
+
+    columns, table = await asyncio.to_thread(engine.compute_table, request.columns, request.rows)
+    return {"columns": columns, "rows": table.tolist()}
+
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,147 @@
+"""
+Deterministic pruning of document markdown before stage 2 (text model).
+
+The text model only needs headers, summary lists and totals, but the stage 1
+markdown also carries every transaction row. Pruning keeps headers, lists,
+paragraphs and total rows, and collapses large detail tables (and runs of
+date-led transaction lines from the text layer) to a one-line stub, following
+per-document-type rules. The markdown returned to the client is not pruned.
+"""
+
+import os
+import re
+import unicodedata
+from dataclasses import dataclass
+
+import tracing
+from llm_scheduler import estimate_tokens
+
+# "auto": prune before stage 2; "off": send the whole markdown
+MARKDOWN_PRUNING_MODE = os.getenv("MARKDOWN_PRUNING_MODE", "auto")
+# Print token counts before/after pruning for every document
+MARKDOWN_PRUNING_LOG = os.getenv("MARKDOWN_PRUNING_LOG", "false").lower() == "true"
+# Bump when rules change (part of the extraction cache key)
+MARKDOWN_PRUNING_VERSION = "2"
+
+# A transaction line: starts with a day/month date such as "01/07" or "2024-07-01"
+DATE_LINE_PATTERN = re.compile(r"^[\s\-*|]*(\d{1,2}[/\-.]\d{1,2}|\d{4}-\d{2}-\d{2})\b")
+
+
+@dataclass(frozen=True)
+class PruningRules:
+    """How one document type's markdown is pruned."""
+    # Tables (or runs of date-led lines) with more body rows than this are collapsed
+    max_table_rows: int = 40
+    # Tables under a header containing one of these words are collapsed at any size
+    detail_sections: tuple = ()
+    # Rows of collapsed tables containing one of these phrases are kept
+    total_keywords: tuple = ("total", "subtotal", "saldo final", "neto")
+
+
+PRUNING_RULES = {
+    "extracto_bancario": PruningRules(
+        max_table_rows=4,
+        detail_sections=("detalle", "movimientos", "transacciones"),
+        total_keywords=("total", "saldo final", "saldo actual", "saldo al cierre", "rendimientos causados"),
+    ),
+    "factura": PruningRules(max_table_rows=8, total_keywords=("total", "subtotal", "iva", "descuento")),
+    "saldos_cesantias": PruningRules(
+        max_table_rows=8,
+        detail_sections=("movimientos", "detalle"),
+        total_keywords=("total", "saldo", "intereses"),
+    ),
+}
+DEFAULT_RULES = PruningRules()
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def _contains_any(text: str, phrases: tuple) -> bool:
+    text = _normalize(text)
+    return any(re.search(rf"\b{re.escape(phrase)}\b", text) for phrase in phrases)
+
+
+def _split_blocks(lines: list[str]) -> list[tuple[str, list[str]]]:
+    """Groups lines into ("table", rows), ("dated", lines) and ("line", [line]) blocks."""
+    blocks = []
+    # Text-layer markdown separates lines with blank lines; they don't end a run of dated lines
+    blanks = []
+    for line in lines:
+        stripped = line.strip()
+        if not stripped and blocks and blocks[-1][0] == "dated":
+            blanks.append(line)
+            continue
+        if stripped.startswith("|"):
+            kind = "table"
+        elif DATE_LINE_PATTERN.match(stripped):
+            kind = "dated"
+        else:
+            kind = "line"
+        if kind == "dated" and blocks and blocks[-1][0] == kind:
+            blocks[-1][1].extend(blanks + [line])
+        else:
+            blocks.extend(("line", [blank]) for blank in blanks)
+            if kind == "table" and blocks and blocks[-1][0] == kind:
+                blocks[-1][1].append(line)
+            else:
+                blocks.append((kind, [line]))
+        blanks = []
+    blocks.extend(("line", [blank]) for blank in blanks)
+    return blocks
+
+
+def _prune_rows(kind: str, rows: list[str], in_detail_section: bool, rules: PruningRules) -> list[str]:
+    if kind == "table":
+        # Header row and its |---| separator are always kept
+        head = rows[:2] if len(rows) > 1 and set(rows[1].strip()) <= set("|-: ") else rows[:1]
+        body = rows[len(head):]
+    else:
+        head, body = [], [row for row in rows if row.strip()]
+
+    if not in_detail_section and len(body) <= rules.max_table_rows:
+        return rows
+
+    kept = [row for row in body if _contains_any(row, rules.total_keywords)]
+    omitted = len(body) - len(kept)
+    if not omitted:
+        return rows
+    if kind == "table":
+        columns = max(1, head[0].count("|") - 1) if head else 1
+        stub = "| " + " | ".join([f"… {omitted} filas de detalle omitidas …"] + [""] * (columns - 1)) + " |"
+    else:
+        stub = f"… {omitted} líneas de detalle omitidas …"
+    return head + [stub] + kept
+
+
+def prune_markdown(markdown: str, document_type: str | None) -> str:
+    """
+    Returns `markdown` with detail tables collapsed per the document type's rules.
+    Headers, lists, paragraphs and page separators are always kept.
+    """
+    if MARKDOWN_PRUNING_MODE == "off" or not markdown:
+        return markdown
+
+    rules = PRUNING_RULES.get(document_type, DEFAULT_RULES)
+    output = []
+    in_detail_section = False
+    for kind, rows in _split_blocks(markdown.split("\n")):
+        if kind == "line":
+            line = rows[0].strip()
+            # A detail section runs until the next header, across page breaks
+            if line.startswith("#"):
+                in_detail_section = _contains_any(line, rules.detail_sections)
+            output.extend(rows)
+        else:
+            output.extend(_prune_rows(kind, rows, in_detail_section, rules))
+    pruned = "\n".join(output)
+
+    if MARKDOWN_PRUNING_LOG:
+        before, after = estimate_tokens(markdown), estimate_tokens(pruned)
+        tracing.log(
+            "Markdown pruned", document_type=document_type, tokens_before=before, tokens_after=after,
+            reduction_percent=100 * (before - after) // max(before, 1),
+        )
+    return pruned
@@ -0,0 +1,266 @@
+"""
+In-process metrics for the extraction pipeline.
+
+Records how long each stage takes (render, encode, template, text_layer,
+vision, classification, pruning, extraction, value_check, refine_chips,
+response), model calls with their token usage, estimated cost and retries,
+extraction cache hits and layout template hits. Totals are exposed in the
+Prometheus text format at GET /metrics.
+
+Each pipeline run also gets a `RequestMetrics` (held in a context variable,
+so tasks and threads spawned by the run record into it) whose `breakdown()`
+can be attached to the response. Stages run concurrently across pages, so
+stage seconds are summed over pages and can add up to more than the total.
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+import tracing
+
+# USD per million tokens; override with LLM_PRICES='{"gpt-4o": {"prompt": 2.5, "completion": 10}}'
+DEFAULT_LLM_PRICES = {
+    "gpt-4o": {"prompt": 2.50, "completion": 10.00},
+    "gpt-4o-mini": {"prompt": 0.15, "completion": 0.60},
+}
+LLM_PRICES = {**DEFAULT_LLM_PRICES, **json.loads(os.getenv("LLM_PRICES", "{}"))}
+
+# Histogram buckets (seconds)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_current = contextvars.ContextVar("request_metrics", default=None)
+
+
+def llm_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Estimated cost in USD of a call (0 for models without a price)."""
+    prices = LLM_PRICES.get(model)
+    if not prices:
+        return 0.0
+    return (prompt_tokens * prices["prompt"] + completion_tokens * prices["completion"]) / 1_000_000
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Counters and histograms keyed by metric name and label values."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[str, dict[tuple, float]] = {}
+        self._histograms: dict[str, dict[tuple, Histogram]] = {}
+        self._help: dict[str, str] = {}
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def inc(self, name: str, labels: dict, value: float = 1):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, labels: dict, value: float):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            series.setdefault(key, Histogram()).observe(value)
+
+    @staticmethod
+    def _labels(key: tuple, extra: tuple = ()) -> str:
+        pairs = key + extra
+        if not pairs:
+            return ""
+        escaped = (f'{name}="{_escape(value)}"' for name, value in pairs)
+        return "{" + ",".join(escaped) + "}"
+
+    def render(self) -> str:
+        """The Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# HELP {name} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{self._labels(key)} {value:g}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# HELP {name} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{self._labels(key, (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_sum{self._labels(key)} {histogram.sum:g}")
+                    lines.append(f"{name}_count{self._labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+registry.describe("pipeline_stage_duration_seconds", "Duration of each pipeline stage (per page for page stages)")
+registry.describe("pipeline_request_duration_seconds", "Wall time of a document through the pipeline")
+registry.describe("pipeline_requests_total", "Documents processed by endpoint and final status")
+registry.describe("llm_requests_total", "Model calls by model and outcome")
+registry.describe("llm_request_duration_seconds", "Duration of successful model calls, excluding queueing")
+registry.describe("llm_retries_total", "Retried model calls by model and reason")
+registry.describe("llm_tokens_total", "Tokens reported by the model API, by model and kind")
+registry.describe("llm_cost_usd_total", "Estimated model cost in USD (see LLM_PRICES)")
+registry.describe("extraction_cache_requests_total", "Extraction cache lookups by endpoint and result")
+registry.describe("layout_template_requests_total", "Layout template lookups by result")
+registry.describe("temp_files_removed_total", "Entries removed from the temp directory by the janitor, by reason")
+registry.describe("temp_bytes_removed_total", "Bytes freed in the temp directory by the janitor, by reason")
+
+
+class RequestMetrics:
+    """Stage timings, model usage and cache result of one pipeline run."""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages: dict[str, dict] = {}
+        self.models: dict[str, dict] = {}
+        self.cache = None
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage: str, seconds: float):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {"seconds": 0.0, "count": 0})
+            entry["seconds"] += seconds
+            entry["count"] += 1
+
+    def model_entry(self, model: str) -> dict:
+        return self.models.setdefault(model, {
+            "calls": 0, "errors": 0, "retries": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0,
+        })
+
+    def breakdown(self) -> dict:
+        """JSON-serializable summary for the response's `timings` field."""
+        with self._lock:
+            return {
+                "total_seconds": round(time.perf_counter() - self.started, 4),
+                "cache": self.cache,
+                "stages": {
+                    stage: {"seconds": round(entry["seconds"], 4), "count": entry["count"]}
+                    for stage, entry in self.stages.items()
+                },
+                "models": {
+                    model: {**entry, "cost_usd": round(entry["cost_usd"], 6)}
+                    for model, entry in self.models.items()
+                },
+            }
+
+
+def start_request(endpoint: str) -> RequestMetrics:
+    """
+    Starts recording a pipeline run in the current context. Called at the top of
+    the pipeline's event generators, so it applies to the task consuming them
+    and every task and thread it spawns afterwards.
+    """
+    request_metrics = RequestMetrics(endpoint)
+    _current.set(request_metrics)
+    return request_metrics
+
+
+def current_request() -> RequestMetrics | None:
+    return _current.get()
+
+
+def finish_request(request_metrics: RequestMetrics, status: str):
+    registry.inc("pipeline_requests_total", {"endpoint": request_metrics.endpoint, "status": status})
+    registry.observe(
+        "pipeline_request_duration_seconds",
+        {"endpoint": request_metrics.endpoint},
+        time.perf_counter() - request_metrics.started,
+    )
+
+
+def _observe_stage(stage: str, seconds: float):
+    registry.observe("pipeline_stage_duration_seconds", {"stage": stage}, seconds)
+    request_metrics = _current.get()
+    if request_metrics is not None:
+        request_metrics.add_stage(stage, seconds)
+
+
+def record_stage(stage: str, seconds: float, **attributes):
+    """Records a stage that just finished after `seconds` (measured elsewhere, e.g. in a worker process)."""
+    _observe_stage(stage, seconds)
+    tracing.record_span(stage, seconds, **attributes)
+
+
+@contextmanager
+def stage(name: str, **attributes):
+    """Times the enclosed block (sync or across awaits) as pipeline stage `name`, also traced as a span."""
+    start = time.perf_counter()
+    try:
+        with tracing.span(name, **attributes):
+            yield
+    finally:
+        _observe_stage(name, time.perf_counter() - start)
+
+
+def record_cache(endpoint: str, hit: bool):
+    registry.inc("extraction_cache_requests_total", {"endpoint": endpoint, "result": "hit" if hit else "miss"})
+    request_metrics = _current.get()
+    if request_metrics is not None:
+        request_metrics.cache = "hit" if hit else "miss"
+
+
+def record_template(hit: bool):
+    registry.inc("layout_template_requests_total", {"result": "hit" if hit else "miss"})
+
+
+def record_temp_removal(reason: str, nbytes: int):
+    registry.inc("temp_files_removed_total", {"reason": reason})
+    registry.inc("temp_bytes_removed_total", {"reason": reason}, nbytes)
+
+
+def record_llm_call(model: str, seconds: float | None, usage=None, error: bool = False):
+    """Records a finished model call; `usage` is the OpenAI response's usage field."""
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+    completion_tokens = getattr(usage, "completion_tokens", None) or 0
+    cost = llm_cost(model, prompt_tokens, completion_tokens)
+
+    registry.inc("llm_requests_total", {"model": model, "outcome": "error" if error else "success"})
+    if not error:
+        registry.observe("llm_request_duration_seconds", {"model": model}, seconds)
+        registry.inc("llm_tokens_total", {"model": model, "kind": "prompt"}, prompt_tokens)
+        registry.inc("llm_tokens_total", {"model": model, "kind": "completion"}, completion_tokens)
+        registry.inc("llm_cost_usd_total", {"model": model}, cost)
+
+    request_metrics = _current.get()
+    if request_metrics is not None:
+        with request_metrics._lock:
+            entry = request_metrics.model_entry(model)
+            entry["calls"] += 1
+            if error:
+                entry["errors"] += 1
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["cost_usd"] += cost
+
+
+def record_llm_retry(model: str, reason: str):
+    registry.inc("llm_retries_total", {"model": model, "reason": reason})
+    request_metrics = _current.get()
+    if request_metrics is not None:
+        with request_metrics._lock:
+            request_metrics.model_entry(model)["retries"] += 1
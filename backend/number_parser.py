@@ -0,0 +1,212 @@
+"""
+Colombian number parsing and cross-validation of extracted values.
+
+Colombian documents print "1.234.567,89" (period for thousands, comma for
+decimals), but US-formatted amounts ("1,234,567.89") show up too, and the
+models are only told about the convention in their prompts: a misread
+period turns "54.822" (fifty-four thousand) into 54.822. `parse_number`
+reads either format deterministically and is applied to every value the
+models return.
+
+`check_chip_values` then looks each chip's value up among the numbers
+actually printed on the page (the `NumberIndex` of its PageWordIndex: every
+number of the page, parsed once, in a sorted NumPy array, so a page of
+thousands of numbers is checked with binary searches). A value that is not
+on the page but is there scaled by a power of 1000 or 100 (a misread
+separator) is corrected (VALUE_CHECK_MODE=correct, the default) or only
+flagged (flag). Each checked chip gets `value_check`: "confirmed",
+"corrected" (with `original_value`), "mismatch" (with `suggested_value`) or
+"not_found". Pages without a text layer can't be checked and are left alone.
+"""
+
+import os
+import re
+
+import numpy as np
+
+# "correct": fix values found on the page at another scale; "flag": only mark them; "off"
+VALUE_CHECK_MODE = os.getenv("VALUE_CHECK_MODE", "correct")
+# Bump whenever parsing or checking changes so cached extractions are invalidated
+VALUE_CHECK_VERSION = "1"
+
+# Scales a misread thousands/decimal separator produces, most likely first
+CORRECTION_FACTORS = (1000, 0.001, 100, 0.01, 1_000_000, 0.000_001)
+# Amounts closer than this are equal
+TOLERANCE = 0.005
+# Smaller values are never corrected: small numbers (days, rates, counts) are everywhere on a page
+MIN_CORRECTED_VALUE = 1000
+
+NON_NUMERIC = re.compile(r"[^\d.,]")
+# Everything around an amount but its digits, separators and sign marks
+SIGN_NOISE = re.compile(r"[^\d.,()\-]")
+
+
+def parse_number(value) -> float | None:
+    """
+    Parses an amount as printed or as returned by a model: numbers pass
+    through; strings may carry a currency sign, spaces, a percent sign and a
+    sign or parentheses for negatives (also after a currency symbol or code,
+    as in "$ -1.234").
+
+    Separators: when both "." and "," appear, the last one is the decimal
+    mark ("1.234.567,89", "1,234,567.89"); a separator repeated is a
+    thousands separator ("1.234.567"); a single one followed by exactly three
+    digits groups thousands ("54.822", "1,500"), otherwise it is the decimal
+    mark ("26,15", "3.5", "0.125").
+
+    Returns None if there is no number.
+    """
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    text = str(value).strip()
+    core = NON_NUMERIC.sub("", text).rstrip(".,")
+    if not core:
+        return None
+
+    decimal = None
+    last = max(core.rfind("."), core.rfind(","))
+    if last >= 0:
+        separator = core[last]
+        integer, fraction = core[:last], core[last + 1:]
+        integer_digits = re.sub(r"\D", "", integer)
+        if "." in core and "," in core:
+            decimal = fraction
+        elif core.count(separator) == 1 and (len(fraction) != 3 or integer_digits in ("", "0")):
+            decimal = fraction
+        core = integer_digits if decimal is not None else re.sub(r"\D", "", core)
+    if not core and not decimal:
+        return None
+
+    number = float(f"{core or '0'}.{decimal}" if decimal else core)
+    # The sign may follow a currency symbol or code ("$ -1.234", "COP -54.822")
+    signed = SIGN_NOISE.sub("", text)
+    negative = signed.startswith("-") or signed.endswith("-") or (signed.startswith("(") and signed.endswith(")"))
+    return -number if negative else number
+
+
+def normalize_chip_values(chips: list[dict]) -> list[dict]:
+    """Parses every chip's `value` in place; chips without a number are dropped."""
+    normalized = []
+    for chip in chips:
+        value = parse_number(chip.get("value"))
+        if value is None:
+            continue
+        chip["value"] = value
+        normalized.append(chip)
+    return normalized
+
+
+class NumberIndex:
+    """Sorted absolute values of the numbers printed on a page."""
+
+    def __init__(self, values):
+        self.values = np.unique(np.abs(np.fromiter(values, dtype=np.float64)))
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def _ranges(self, values) -> tuple[np.ndarray, np.ndarray]:
+        values = np.abs(np.asarray(values, dtype=np.float64))
+        whole = values == np.floor(values)
+        low = np.searchsorted(self.values, values - TOLERANCE, side="left")
+        high = np.searchsorted(self.values, np.where(whole, values + 1, values + TOLERANCE), side="left")
+        return low, high
+
+    def contains(self, values) -> np.ndarray:
+        """
+        Whether each of `values` is on the page. Whole numbers also match a
+        printed amount with decimals (54822 matches 54.822,21), since the
+        models are told to drop them.
+        """
+        low, high = self._ranges(values)
+        return high > low
+
+    def matches(self, value: float) -> np.ndarray:
+        """The printed numbers `value` matches (see `contains`)."""
+        low, high = self._ranges([value])
+        return self.values[low[0]:high[0]]
+
+
+def significant_digits(value: float) -> str:
+    """54.822 -> "54822", 7500102.22 -> "750010222", 1500 -> "15"."""
+    return f"{abs(value):.6f}".replace(".", "").strip("0")
+
+
+def _is_rescaled(value: float, candidate: float, number_index: NumberIndex) -> bool:
+    """
+    Whether `candidate` (value times a factor) is printed with the same digits
+    as `value`, i.e. only the separators were misread (54.822 -> "54.822,21").
+    """
+    if abs(candidate) < MIN_CORRECTED_VALUE:
+        return False
+    digits = significant_digits(value)
+    return any(significant_digits(printed).startswith(digits) for printed in number_index.matches(candidate))
+
+
+def check_chip_values(indexes: list, chips: list[dict], search_all_pages: bool = False, mode: str = VALUE_CHECK_MODE) -> list[dict]:
+    """
+    Cross-checks chip values against the numbers of the text layer (see the
+    module docstring) and corrects or flags them in place. The chips of a
+    page (or document) are looked up together, with every correction factor,
+    in one vectorized search.
+
+    Args:
+        indexes: Per-page word indexes from `pdf_utils.build_word_indexes`
+        chips: Chips to check; `page` (1-based) selects the page
+        search_all_pages: Look on every page (for document-level chips)
+        mode: "correct", "flag" or "off"
+
+    Returns:
+        The same chips.
+    """
+    if mode == "off":
+        return chips
+
+    # Number index -> the chips checked against it
+    groups: dict[int, tuple[NumberIndex, list[dict]]] = {}
+    if search_all_pages:
+        page_values = [index.number_index.values for index in indexes if index is not None]
+        document_index = NumberIndex(np.concatenate(page_values) if page_values else ())
+    for chip in chips:
+        value = chip.get("value")
+        if not isinstance(value, (int, float)) or value == 0:
+            continue
+        if search_all_pages:
+            number_index = document_index
+        else:
+            page_num = chip.get("page", 1)
+            index = indexes[page_num - 1] if 1 <= page_num <= len(indexes) else None
+            number_index = index.number_index if index is not None else None
+        # Pages without a text layer can't be checked
+        if number_index is None or not len(number_index):
+            continue
+        groups.setdefault(id(number_index), (number_index, []))[1].append(chip)
+
+    factors = np.array((1, *CORRECTION_FACTORS))
+    for number_index, group in groups.values():
+        candidates = np.array([chip["value"] for chip in group], dtype=np.float64)[:, None] * factors
+        found = number_index.contains(candidates.ravel()).reshape(candidates.shape)
+        for chip, chip_candidates, chip_found in zip(group, candidates, found):
+            if chip_found[0]:
+                chip["value_check"] = "confirmed"
+                continue
+            corrected = next(
+                (
+                    round(float(candidate), 2) for candidate, is_found in zip(chip_candidates[1:], chip_found[1:])
+                    if is_found and _is_rescaled(chip["value"], candidate, number_index)
+                ),
+                None,
+            )
+            if corrected is None:
+                chip["value_check"] = "not_found"
+            elif mode == "correct":
+                chip["original_value"] = chip["value"]
+                chip["value"] = corrected
+                chip["value_check"] = "corrected"
+            else:
+                chip["suggested_value"] = corrected
+                chip["value_check"] = "mismatch"
+    return chips
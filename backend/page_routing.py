@@ -0,0 +1,153 @@
+"""
+Cheap document classification and page routing for /upload-with-relevance.
+
+The document type is guessed from keywords in the text layer of page 1 (no
+model call); only when that is inconclusive does page 1 go to a model. Once
+the type is known, a per-type policy selects the pages worth converting to
+markdown: for bank statements, that is the first and last pages plus any page
+mentioning summaries or totals, skipping the transaction detail that the tax
+guide says to ignore anyway. Scanned pages have no text layer to check: the
+first and last ones are converted like any other, and the pages in between
+only when an OCR pre-pass (Tesseract, if installed) finds the policy's keywords
+on them. Without Tesseract, scanned middle pages are skipped.
+"""
+
+import os
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import Callable
+
+# "auto": convert only the pages selected by the document type's policy; "off": convert every page
+PAGE_ROUTING_MODE = os.getenv("PAGE_ROUTING_MODE", "auto")
+# "auto": OCR scanned pages (when Tesseract is installed) to look for the policy's keywords; "off": skip them
+PAGE_ROUTING_OCR = os.getenv("PAGE_ROUTING_OCR", "auto")
+# Bump when keywords or policies change (part of the extraction cache key)
+PAGE_ROUTING_VERSION = "3"
+
+# Keyword score needed to classify without a model, and margin over the runner-up
+MIN_KEYWORD_SCORE = 3
+MIN_KEYWORD_MARGIN = 2
+
+# Accent-free, lowercase phrases found on page 1 of each document type, with weights
+CLASSIFICATION_KEYWORDS = {
+    "extracto_bancario": {
+        "extracto": 2, "estado de cuenta": 2, "detalle de movimientos": 3, "saldo anterior": 2,
+        "cuenta de ahorros": 2, "cuenta corriente": 2, "4x1000": 1, "gmf": 1,
+    },
+    "nomina": {
+        "nomina": 3, "desprendible": 3, "comprobante de pago": 2, "total devengado": 3,
+        "neto pagado": 2, "total deducciones": 1,
+    },
+    "factura": {
+        "factura electronica": 3, "factura de venta": 3, "cufe": 2, "subtotal": 1, "iva": 1,
+    },
+    "certificado_ingresos": {
+        "certificado de ingresos y retenciones": 5, "formulario 220": 4, "pagos laborales": 2,
+    },
+    "certificado_dividendos": {"dividendos": 3, "participaciones": 2, "accionista": 2},
+    "certificado_predial": {"impuesto predial": 4, "avaluo catastral": 3, "predio": 1},
+    "certificado_vehiculo": {"impuesto vehicular": 4, "impuesto sobre vehiculos": 4, "placa": 1, "avaluo": 1},
+    "retencion_fuente": {"certificado de retencion en la fuente": 5, "agente retenedor": 2},
+    "aportes_obligatorios_independiente": {"planilla integrada": 4, "pila": 2, "independiente": 2, "ibc": 1},
+    "aportes_voluntarios_afc": {"afc": 3, "fomento a la construccion": 3, "pensiones voluntarias": 3},
+    "certificado_medicina_prepagada": {"medicina prepagada": 5, "plan complementario": 3},
+    "saldos_cesantias": {"cesantias": 4, "fondo de cesantias": 2, "intereses sobre cesantias": 2},
+}
+
+
+@dataclass(frozen=True)
+class PagePolicy:
+    """Which pages of a document type are converted to markdown."""
+    first_pages: int = 1
+    last_pages: int = 1
+    # A page mentioning any of these (accent-free, lowercase) phrases is converted
+    keywords: tuple = ()
+    # Convert every page without a text layer, instead of only those where OCR finds a keyword
+    include_scanned: bool = False
+
+
+PAGE_POLICIES = {
+    "extracto_bancario": PagePolicy(
+        keywords=(
+            "resumen", "saldo final", "saldo actual", "saldo al cierre", "total rendimientos",
+            "total intereses", "total gmf", "total comisiones", "total cargos", "retencion en la fuente",
+        ),
+    ),
+    "factura": PagePolicy(keywords=("subtotal", "total a pagar", "valor total", "total factura")),
+}
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, accent-free, single-spaced text for keyword matching."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(text.split())
+
+
+def _contains(text: str, phrase: str) -> bool:
+    return re.search(rf"\b{re.escape(phrase)}\b", text) is not None
+
+
+def classify_by_keywords(page_text: str) -> dict | None:
+    """
+    Classifies a document from the text layer of its first page.
+
+    Returns:
+        {"document_type", "confidence"} when one type clearly wins, else None
+    """
+    text = normalize_text(page_text or "")
+    if not text:
+        return None
+
+    scores = {
+        document_type: sum(weight for phrase, weight in keywords.items() if _contains(text, phrase))
+        for document_type, keywords in CLASSIFICATION_KEYWORDS.items()
+    }
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    (best_type, best_score), (_, runner_up) = ranked[0], ranked[1]
+    if best_score < MIN_KEYWORD_SCORE or best_score - runner_up < MIN_KEYWORD_MARGIN:
+        return None
+    return {
+        "document_type": best_type,
+        "confidence": "alta" if best_score >= 2 * MIN_KEYWORD_SCORE else "media",
+    }
+
+
+def select_pages(
+    document_type: str | None,
+    page_texts: list[str],
+    ocr: Callable[[list[int]], dict[int, str]] | None = None,
+) -> set[int]:
+    """
+    Returns the 1-based numbers of the pages to convert for a document type.
+    Types without a policy (and unknown types) convert every page.
+
+    `ocr(page_nums)` returns the text of scanned pages ({page number: text},
+    empty if OCR is unavailable); it is only called for scanned pages the
+    policy would otherwise skip.
+    """
+    total_pages = len(page_texts)
+    policy = PAGE_POLICIES.get(document_type)
+    if PAGE_ROUTING_MODE == "off" or policy is None:
+        return set(range(1, total_pages + 1))
+
+    selected = set(range(1, min(policy.first_pages, total_pages) + 1))
+    selected.update(range(max(1, total_pages - policy.last_pages + 1), total_pages + 1))
+    scanned = []
+    for page_num, page_text in enumerate(page_texts, start=1):
+        text = normalize_text(page_text)
+        if not text:
+            scanned.append(page_num)
+        elif any(_contains(text, keyword) for keyword in policy.keywords):
+            selected.add(page_num)
+
+    if policy.include_scanned:
+        selected.update(scanned)
+    elif ocr is not None:
+        unselected = [page_num for page_num in scanned if page_num not in selected]
+        for page_num, page_text in (ocr(unselected) if unselected else {}).items():
+            text = normalize_text(page_text)
+            if any(_contains(text, keyword) for keyword in policy.keywords):
+                selected.add(page_num)
+    return selected
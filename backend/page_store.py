@@ -0,0 +1,277 @@
+"""
+Short-lived store of rendered page images.
+
+Upload responses reference pages by URL (`GET /documents/{doc_id}/pages/{n}`)
+instead of inlining them as base64 data URLs, so the JSON stays small and the
+browser fetches (and caches) images on its own. Pages are kept in memory
+only: the store is bounded in bytes (least recently used documents are
+dropped first) and a document expires after PAGE_STORE_TTL_SECONDS without
+being accessed, or when the client deletes it, so uploaded documents are not
+retained beyond the session.
+
+Results served from the extraction cache store the PDF instead of rendered
+pages, so a cache hit doesn't rasterize the whole document: each page is
+rendered when the browser first requests it.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import pdf_utils
+
+PAGE_STORE_MAX_BYTES = int(os.getenv("PAGE_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+PAGE_STORE_TTL_SECONDS = int(os.getenv("PAGE_STORE_TTL_SECONDS", "3600"))
+PAGE_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000")
+
+# Size variants: maximum long edge in pixels (None = the rendered image)
+PAGE_SIZES = {
+    "full": None,
+    "preview": 1024,
+    "thumb": 256,
+}
+
+
+def page_url(doc_id: str, page_num: int, size: str = "full") -> str:
+    url = f"{PAGE_BASE_URL}/documents/{doc_id}/pages/{page_num}"
+    return url if size == "full" else f"{url}?size={size}"
+
+
+class StoredPage:
+    def __init__(self, image: pdf_utils.PageImage):
+        self.image = image
+        # size name -> (bytes, mime type, etag)
+        self.variants = {"full": (image.data, image.mime_type, self._etag(image.data))}
+
+    @staticmethod
+    def _etag(data: bytes) -> str:
+        return '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(data) for data, _, _ in self.variants.values())
+
+    def copy(self) -> "StoredPage":
+        """The same image and variants, with variants of its own from now on."""
+        stored = StoredPage.__new__(StoredPage)
+        stored.image = self.image
+        stored.variants = dict(self.variants)
+        return stored
+
+    def render_variant(self, size: str) -> tuple[bytes, str, str]:
+        """Produces a size variant without storing it (slow; no lock needed)."""
+        data = self._downscale(PAGE_SIZES[size])
+        return data, "image/png", self._etag(data)
+
+    def _downscale(self, max_long_edge: int) -> bytes:
+        import fitz  # PyMuPDF
+
+        pix = fitz.Pixmap(self.image.data)
+        if pix.alpha:
+            pix = fitz.Pixmap(pix, 0)
+        long_edge = max(pix.width, pix.height)
+        if long_edge > max_long_edge:
+            scale = max_long_edge / long_edge
+            pix = fitz.Pixmap(pix, max(1, round(pix.width * scale)), max(1, round(pix.height * scale)), None)
+        return pix.tobytes("png")
+
+
+@dataclass
+class PageSource:
+    """A document's PDF, kept so that pages not rendered yet are rendered when first requested."""
+    pdf: bytes
+    profile: pdf_utils.RenderProfile
+    page_count: int
+
+
+class PageStore:
+    """
+    Bounded, TTL'd in-memory store of PageImages grouped by document.
+    Thread-safe, so variants can be produced in `asyncio.to_thread`
+    (downscaled variants are generated on first request, outside the lock,
+    and kept). A document can also be stored as its PDF (`put_source`), whose
+    pages are rendered one by one as they are requested.
+    """
+
+    def __init__(self, max_bytes: int = PAGE_STORE_MAX_BYTES, ttl_seconds: int = PAGE_STORE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        # doc_id -> (last access time, {page number: StoredPage})
+        self._documents: OrderedDict[str, tuple[float, dict[int, StoredPage]]] = OrderedDict()
+        # doc_id -> PDF of documents whose pages are rendered on request
+        self._sources: dict[str, PageSource] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, doc_id: str, image: pdf_utils.PageImage) -> None:
+        """Stores a rendered page of `doc_id`."""
+        stored = StoredPage(image)
+        with self._lock:
+            self._expire()
+            _, pages = self._documents.pop(doc_id, (None, {}))
+            previous = pages.get(image.page_num)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            pages[image.page_num] = stored
+            self._bytes += stored.nbytes
+            self._documents[doc_id] = (time.monotonic(), pages)
+            self._evict()
+
+    def put_source(self, doc_id: str, pdf: bytes, profile: pdf_utils.RenderProfile, page_count: int) -> None:
+        """
+        Stores the PDF of `doc_id` instead of its rendered pages: each page is
+        rendered with `profile` when it is first requested, then kept.
+        """
+        with self._lock:
+            self._expire()
+            _, pages = self._documents.pop(doc_id, (None, {}))
+            previous = self._sources.pop(doc_id, None)
+            if previous is not None:
+                self._bytes -= len(previous.pdf)
+            self._sources[doc_id] = PageSource(pdf, profile, page_count)
+            self._bytes += len(pdf)
+            self._documents[doc_id] = (time.monotonic(), pages)
+            self._evict()
+
+    def get(self, doc_id: str, page_num: int, size: str = "full") -> tuple[bytes, str, str] | None:
+        """
+        Returns (bytes, mime type, etag) of a page in the given size variant,
+        or None if the document/page is unknown or expired.
+        """
+        with self._lock:
+            document = self._access(doc_id)
+            if document is None:
+                return None
+            pages, source = document
+            stored = pages.get(page_num)
+            if stored is None and (source is None or not 1 <= page_num <= source.page_count):
+                return None
+            variant = stored.variants.get(size) if stored is not None else None
+        if variant is not None:
+            return variant
+
+        if stored is None:
+            stored = self._render(doc_id, source, page_num)
+            if size in stored.variants:
+                return stored.variants[size]
+
+        # Downscaling takes tens of milliseconds; other pages are served meanwhile
+        variant = stored.render_variant(size)
+        with self._lock:
+            # Another request may have produced it first; keep that one
+            kept = stored.variants.setdefault(size, variant)
+            entry = self._documents.get(doc_id)
+            if kept is variant and entry is not None and entry[1].get(page_num) is stored:
+                self._bytes += len(variant[0])
+                self._evict()
+            return kept
+
+    def pages(self, doc_id: str) -> list[tuple[int, bytes, str]] | None:
+        """
+        Returns (page number, bytes, mime type) of every page of `doc_id` at
+        full size, in page order (rendering those not rendered yet), or None if
+        the document is unknown or expired.
+        """
+        with self._lock:
+            document = self._access(doc_id)
+            if document is None:
+                return None
+            pages, source = document
+            pages = dict(pages)
+        if source is not None:
+            for page_num in range(1, source.page_count + 1):
+                if page_num not in pages:
+                    pages[page_num] = self._render(doc_id, source, page_num)
+        return [
+            (page_num, stored.image.data, stored.image.mime_type)
+            for page_num, stored in sorted(pages.items())
+        ]
+
+    def alias(self, doc_id: str, alias_id: str) -> bool:
+        """
+        Makes the pages of `doc_id` available under `alias_id` too (a duplicate
+        upload). The images are shared, but each id is accessed, expired and
+        deleted on its own and keeps its own size variants, so they are counted
+        once per id. Returns False if `doc_id` is unknown or expired.
+        """
+        with self._lock:
+            self._expire()
+            entry = self._documents.get(doc_id)
+            if entry is None:
+                return False
+            pages = {page_num: stored.copy() for page_num, stored in entry[1].items()}
+            self._bytes += sum(stored.nbytes for stored in pages.values())
+            source = self._sources.get(doc_id)
+            if source is not None:
+                self._sources[alias_id] = source
+                self._bytes += len(source.pdf)
+            self._documents[alias_id] = (time.monotonic(), pages)
+            self._evict()
+            return True
+
+    def delete(self, doc_id: str) -> bool:
+        """Drops every page of `doc_id`. Returns False if it was not stored."""
+        with self._lock:
+            entry = self._documents.pop(doc_id, None)
+            if entry is None:
+                return False
+            self._drop(doc_id, entry[1])
+            return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"documents": len(self._documents), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+    def _render(self, doc_id: str, source: PageSource, page_num: int) -> StoredPage:
+        """Renders a page of a stored PDF outside the lock, then keeps it (or the copy rendered first)."""
+        image = pdf_utils.render_page_range(source.pdf, source.profile, page_num - 1, page_num)[0]
+        stored = StoredPage(image)
+        with self._lock:
+            entry = self._documents.get(doc_id)
+            if entry is None or self._sources.get(doc_id) is not source:
+                # Deleted or replaced meanwhile: serve this request, keep nothing
+                return stored
+            kept = entry[1].setdefault(page_num, stored)
+            if kept is stored:
+                self._bytes += stored.nbytes
+                self._evict()
+            return kept
+
+    def _access(self, doc_id: str) -> tuple[dict[int, StoredPage], PageSource | None] | None:
+        # Caller must hold self._lock. Accessing a document keeps it alive (sliding expiration)
+        self._expire()
+        entry = self._documents.get(doc_id)
+        if entry is None:
+            return None
+        self._documents[doc_id] = (time.monotonic(), entry[1])
+        self._documents.move_to_end(doc_id)
+        return entry[1], self._sources.get(doc_id)
+
+    def _drop(self, doc_id: str, pages: dict[int, StoredPage]):
+        # Caller must hold self._lock and have removed doc_id from self._documents
+        self._bytes -= sum(stored.nbytes for stored in pages.values())
+        source = self._sources.pop(doc_id, None)
+        if source is not None:
+            self._bytes -= len(source.pdf)
+
+    def _expire(self):
+        # Caller must hold self._lock
+        cutoff = time.monotonic() - self.ttl_seconds
+        while self._documents:
+            doc_id, (accessed_at, pages) = next(iter(self._documents.items()))
+            if accessed_at >= cutoff:
+                break
+            del self._documents[doc_id]
+            self._drop(doc_id, pages)
+
+    def _evict(self):
+        # Caller must hold self._lock; the most recent document is always kept
+        while self._bytes > self.max_bytes and len(self._documents) > 1:
+            doc_id, (_, pages) = self._documents.popitem(last=False)
+            self._drop(doc_id, pages)
+
+
+page_store = PageStore()
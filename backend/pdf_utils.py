@@ -1,128 +1,808 @@
 import os
-from pathlib import Path
-import fitz  # PyMuPDF
+import numpy as np
 from PIL import Image
 import base64
 import io
+import math
+import re
+import time
 import asyncio
+import multiprocessing
+import unicodedata
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import cached_property
+from typing import TYPE_CHECKING, AsyncIterator
 
-def pdf_to_images(pdf_path: str, output_folder: str):
+import metrics
+import number_parser
+import tracing
+
+if TYPE_CHECKING:
+    import fitz
+
+# PyMuPDF is imported where it is first used (`import fitz` in the functions
+# below), so importing this module at startup stays cheap.
+
+# Minimum amount of non-whitespace text for a page's text layer to be trusted
+MIN_TEXT_LAYER_CHARS = int(os.getenv("MIN_TEXT_LAYER_CHARS", "40"))
+# Maximum share of unreadable characters (broken font encodings) in a usable text layer
+MAX_GARBLED_RATIO = 0.05
+
+# Worker processes for rendering large documents (0 = render in a thread)
+RENDER_PROCESSES = int(os.getenv("RENDER_PROCESSES", "0"))
+# Documents with fewer pages are rendered in a thread even when the pool is enabled
+RENDER_PROCESS_MIN_PAGES = int(os.getenv("RENDER_PROCESS_MIN_PAGES", "8"))
+# Pages rendered per unit of work; smaller chunks deliver the first pages sooner
+RENDER_CHUNK_PAGES = int(os.getenv("RENDER_CHUNK_PAGES", "4"))
+
+_render_pool = None
+
+AMOUNT_PATTERN = re.compile(r"^[\$\s(+-]*\d[\d.,\s]*\)?%?$")
+
+IMAGE_MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+
+@dataclass(frozen=True)
+class RenderProfile:
+    """
+    How pages are rasterized for the vision model.
+
+    Attributes:
+        name: Profile identifier (part of the extraction cache key)
+        dpi: Render resolution (PyMuPDF's default is 72)
+        grayscale: Render a single gray channel instead of RGB
+        image_format: "png", "jpeg" or "webp"
+        quality: JPEG/WebP quality (ignored for PNG)
+        max_long_edge: Upper bound in pixels for the longest side, or None
+        crop_margin: Crop to the drawn content plus this margin in points, or None to keep the full page
+        detail: OpenAI image detail level ("low", "high" or "auto")
+    """
+    name: str
+    dpi: int = 72
+    grayscale: bool = False
+    image_format: str = "png"
+    quality: int = 85
+    max_long_edge: int | None = None
+    crop_margin: float | None = None
+    detail: str = "auto"
+
+
+RENDER_PROFILES = {
+    # Original behaviour: full page, 72 DPI, RGB PNG
+    "legacy": RenderProfile("legacy"),
+    # Born-digital certificates with a few large figures; grayscale PNG compresses text best
+    "compact": RenderProfile(
+        "compact", dpi=100, grayscale=True, max_long_edge=1536, crop_margin=18
+    ),
+    # Statements and payroll slips with small, dense tables
+    "dense_tables": RenderProfile(
+        "dense_tables", dpi=150, grayscale=True, max_long_edge=2048, crop_margin=12, detail="high"
+    ),
+    # Scanned/photographed documents, where JPEG beats PNG by a wide margin
+    "scanned": RenderProfile(
+        "scanned", dpi=150, grayscale=True, image_format="jpeg", quality=75,
+        max_long_edge=2048, crop_margin=12
+    ),
+}
+
+DOCUMENT_TYPE_RENDER_PROFILE = {
+    "extracto_bancario": "dense_tables",
+    "nomina": "dense_tables",
+    "factura": "dense_tables",
+    "saldos_cesantias": "dense_tables",
+}
+
+DEFAULT_RENDER_PROFILE = os.getenv("DEFAULT_RENDER_PROFILE", "compact")
+
+
+def get_render_profile(name: str = None, document_type: str = None) -> RenderProfile:
+    """
+    Resolves the render profile: an explicit profile name wins, then the
+    profile mapped to the document type, then DEFAULT_RENDER_PROFILE.
+
+    Raises:
+        ValueError: If an explicit profile name is not recognized
+    """
+    if name:
+        if name not in RENDER_PROFILES:
+            raise ValueError(f"Unknown render profile: {name}")
+        return RENDER_PROFILES[name]
+    name = DOCUMENT_TYPE_RENDER_PROFILE.get(document_type, DEFAULT_RENDER_PROFILE)
+    return RENDER_PROFILES.get(name, RENDER_PROFILES["legacy"])
+
+
+class PageImage:
+    """
+    A rendered page held in memory.
+    The base64 encoding is computed once, on first use, and shared by the
+    LLM request and (with inline images) the `image_urls` returned to the client.
+    """
+
+    def __init__(
+        self,
+        page_num: int,
+        data: bytes,
+        mime_type: str = "image/png",
+        detail: str = "auto",
+        clip: tuple = None,
+        size: tuple = None
+    ):
+        self.page_num = page_num
+        self.data = data
+        self.mime_type = mime_type
+        self.detail = detail
+        # Pixel dimensions as (width, height)
+        self.size = size
+        # Visible region as (x0, y0, x1, y1) fractions of the page, when cropped to content
+        self.clip = clip
+
+    @cached_property
+    def base64(self) -> str:
+        with metrics.stage("encode"):
+            return base64.b64encode(self.data).decode("ascii")
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{self.base64}"
+
+
+def estimate_image_tokens(image) -> int:
+    """
+    OpenAI's published gpt-4o image token estimate for a PageImage
+    (85 base tokens + 170 per 512px tile after downscaling).
+    """
+    if not isinstance(image, PageImage) or image.size is None:
+        return 765  # A full letter page at 72 DPI
+    if image.detail == "low":
+        return 85
+    width, height = image.size
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def open_pdf(pdf) -> "fitz.Document":
+    """
+    Opens a PDF from a path or directly from in-memory bytes.
+    """
+    import fitz  # PyMuPDF
+
+    if isinstance(pdf, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=pdf, filetype="pdf")
+    return fitz.open(pdf)
+
+
+def content_rect(page, margin: float) -> "fitz.Rect":
+    """
+    Returns the bounding box of everything drawn on the page (text, images,
+    vector graphics), grown by `margin` points and clipped to the page.
+    """
+    import fitz  # PyMuPDF
+
+    rect = fitz.Rect()
+    for _, bbox in page.get_bboxlog():
+        bbox = fitz.Rect(bbox)
+        if not bbox.is_empty and not bbox.is_infinite:
+            rect |= bbox
+    if rect.is_empty:
+        return page.rect
+    rect = fitz.Rect(rect.x0 - margin, rect.y0 - margin, rect.x1 + margin, rect.y1 + margin)
+    return rect & page.rect
+
+
+def render_page(page, profile: RenderProfile) -> PageImage:
+    """
+    Rasterizes a single page according to a render profile.
+    """
+    import fitz  # PyMuPDF
+
+    clip = content_rect(page, profile.crop_margin) if profile.crop_margin is not None else page.rect
+    zoom = profile.dpi / 72
+    if profile.max_long_edge:
+        zoom = min(zoom, profile.max_long_edge / max(clip.width, clip.height, 1))
+
+    pix = page.get_pixmap(
+        matrix=fitz.Matrix(zoom, zoom),
+        clip=clip,
+        colorspace=fitz.csGRAY if profile.grayscale else fitz.csRGB,
+        alpha=False
+    )
+
+    if profile.image_format == "png":
+        data = pix.tobytes("png")
+    elif profile.image_format == "jpeg":
+        data = pix.tobytes("jpeg", jpg_quality=profile.quality)
+    else:
+        mode = "L" if profile.grayscale else "RGB"
+        image = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+        buffer = io.BytesIO()
+        image.save(buffer, format=profile.image_format.upper(), quality=profile.quality)
+        data = buffer.getvalue()
+
+    clip_fractions = None
+    if clip != page.rect:
+        width, height = page.rect.width, page.rect.height
+        clip_fractions = (clip.x0 / width, clip.y0 / height, clip.x1 / width, clip.y1 / height)
+
+    return PageImage(
+        page.number + 1, data, IMAGE_MIME_TYPES[profile.image_format], profile.detail,
+        clip_fractions, (pix.width, pix.height)
+    )
+
+
+def count_pages(pdf) -> int:
+    doc = open_pdf(pdf)
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+
+def render_page_range(pdf, profile: RenderProfile, start: int, stop: int) -> list[PageImage]:
+    """
+    Renders pages [start, stop) (0-based). Opens the PDF itself, so it can run
+    in a worker process.
+    """
+    doc = open_pdf(pdf)
+    try:
+        return [render_page(doc[i], profile) for i in range(start, min(stop, len(doc)))]
+    finally:
+        doc.close()
+
+
+def _timed_render_page_range(pdf, profile: RenderProfile, start: int, stop: int) -> tuple[list[PageImage], float]:
+    """render_page_range plus its duration, measured where it runs (thread or worker process)."""
+    started = time.perf_counter()
+    images = render_page_range(pdf, profile, start, stop)
+    return images, time.perf_counter() - started
+
+
+def render_pages(pdf, profile: RenderProfile = None) -> list[PageImage]:
+    """
+    Renders each page of a PDF (path or bytes) to an in-memory image.
+    Nothing is written to disk. Uses the legacy profile (72 DPI PNG) by default.
+    """
+    profile = profile or RENDER_PROFILES["legacy"]
+    return render_page_range(pdf, profile, 0, count_pages(pdf))
+
+
+def get_render_pool() -> ProcessPoolExecutor | None:
+    """Returns the shared rendering process pool, or None when RENDER_PROCESSES is 0."""
+    global _render_pool
+    if RENDER_PROCESSES <= 0:
+        return None
+    if _render_pool is None:
+        # spawn: forking a process that runs an event loop and threads is unsafe
+        _render_pool = ProcessPoolExecutor(
+            max_workers=RENDER_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _render_pool
+
+
+def shutdown_render_pool():
+    global _render_pool
+    if _render_pool is not None:
+        _render_pool.shutdown(cancel_futures=True)
+        _render_pool = None
+
+
+async def iter_render_pages(pdf, profile: RenderProfile = None, page_count: int = None) -> AsyncIterator[PageImage]:
     """
-    Converts each page of a PDF to an image and returns the paths.
-    Uses PyMuPDF (fitz).
+    Renders a PDF (path or bytes) in chunks of RENDER_CHUNK_PAGES pages and yields
+    each page as soon as its chunk is done, so downstream work can start early.
+
+    Large documents (RENDER_PROCESS_MIN_PAGES or more) are split across the
+    process pool when RENDER_PROCESSES > 0, each worker opening the PDF
+    independently; pages are then yielded in completion order. Otherwise chunks
+    are rendered one after another in a thread. The event loop never blocks.
     """
-    Path(output_folder).mkdir(parents=True, exist_ok=True)
-    doc = fitz.open(pdf_path)
-    image_paths = []
-    
-    for page_num in range(len(doc)):
-        page = doc.load_page(page_num)
-        pix = page.get_pixmap()
-        image_path = os.path.join(output_folder, f"page_{page_num+1}.png")
-        pix.save(image_path)
-        image_paths.append(image_path)
-        
-    doc.close()
-    return image_paths
+    profile = profile or RENDER_PROFILES["legacy"]
+    if isinstance(pdf, (bytearray, memoryview)):
+        pdf = bytes(pdf)
+    if page_count is None:
+        page_count = await asyncio.to_thread(count_pages, pdf)
 
-async def pdf_to_images_async(pdf_path: str, output_folder: str):
+    chunks = [
+        (start, min(start + RENDER_CHUNK_PAGES, page_count))
+        for start in range(0, page_count, RENDER_CHUNK_PAGES)
+    ]
+
+    pool = get_render_pool() if page_count >= RENDER_PROCESS_MIN_PAGES else None
+    if pool is None:
+        for start, stop in chunks:
+            images, seconds = await asyncio.to_thread(_timed_render_page_range, pdf, profile, start, stop)
+            metrics.record_stage("render", seconds, pages=f"{start + 1}-{stop}")
+            for image in images:
+                yield image
+        return
+
+    loop = asyncio.get_running_loop()
+    futures = [
+        loop.run_in_executor(pool, _timed_render_page_range, pdf, profile, start, stop)
+        for start, stop in chunks
+    ]
+    try:
+        for next_done in asyncio.as_completed(futures):
+            images, seconds = await next_done
+            metrics.record_stage("render", seconds, pages=f"{images[0].page_num}-{images[-1].page_num}" if images else "")
+            for image in images:
+                yield image
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+async def render_pages_async(pdf, profile: RenderProfile = None) -> list[PageImage]:
     """
-    Async wrapper for pdf_to_images to enable non-blocking PDF conversion.
+    Renders all pages without blocking the event loop (see iter_render_pages),
+    returned in page order.
     """
-    return await asyncio.to_thread(pdf_to_images, pdf_path, output_folder)
+    images = [image async for image in iter_render_pages(pdf, profile)]
+    return sorted(images, key=lambda image: image.page_num)
+
 
-def encode_image(image_path: str):
+def has_usable_text_layer(page) -> bool:
+    """
+    Returns True if the page carries enough readable text to skip the vision model.
+    Scanned pages have no text layer; some digital PDFs have garbled font encodings.
+    """
+    chars = [c for c in page.get_text("text") if not c.isspace()]
+    if len(chars) < MIN_TEXT_LAYER_CHARS:
+        return False
+    garbled = sum(1 for c in chars if c == "\ufffd" or not c.isprintable())
+    return garbled / len(chars) <= MAX_GARBLED_RATIO
+
+
+def _table_to_markdown(rows: list) -> str:
+    """Formats extracted table rows (first row as header) as a markdown table."""
+    rows = [["" if cell is None else " ".join(str(cell).split()) for cell in row] for row in rows]
+    rows = [row for row in rows if any(row)]
+    if not rows:
+        return ""
+    header, body = rows[0], rows[1:]
+    lines = ["| " + " | ".join(header) + " |", "|" + "|".join("---" for _ in header) + "|"]
+    lines.extend("| " + " | ".join(row) + " |" for row in body)
+    return "\n".join(lines)
+
+
+def page_to_markdown(page) -> str:
+    """
+    Builds structured markdown from a page's text layer, mirroring the structure the
+    vision model is asked to produce (headers, bold label/value bullets, tables).
+    """
+    import fitz  # PyMuPDF
+
+    items = []  # (y, x, markdown)
+
+    try:
+        tables = page.find_tables().tables
+    except Exception:
+        tables = []
+    table_rects = [fitz.Rect(table.bbox) for table in tables]
+    for table in tables:
+        table_md = _table_to_markdown(table.extract())
+        if table_md:
+            items.append((table.bbox[1], table.bbox[0], table_md))
+
+    # Collect text lines outside tables with their font size and weight
+    lines = []
+    for block in page.get_text("dict", sort=True)["blocks"]:
+        if block.get("type") != 0:
+            continue
+        for line in block["lines"]:
+            spans = [span for span in line["spans"] if span["text"].strip()]
+            if not spans:
+                continue
+            x0, y0, x1, y1 = line["bbox"]
+            center = fitz.Point((x0 + x1) / 2, (y0 + y1) / 2)
+            if any(rect.contains(center) for rect in table_rects):
+                continue
+            lines.append({
+                "x": x0,
+                "y": (y0 + y1) / 2,
+                "text": " ".join(" ".join(span["text"] for span in spans).split()),
+                "size": max(span["size"] for span in spans),
+                "bold": any(span["flags"] & 16 for span in spans),
+            })
+
+    if lines:
+        # Body size is the most common font size, weighted by text length
+        sizes = Counter()
+        for line in lines:
+            sizes[round(line["size"])] += len(line["text"])
+        body_size = sizes.most_common(1)[0][0]
+
+        # Merge lines sharing a baseline into rows, so "Label .... 1.234,56"
+        # laid out in separate blocks becomes a single label/value pair
+        lines.sort(key=lambda line: (line["y"], line["x"]))
+        rows = []
+        for line in lines:
+            if rows and abs(rows[-1][-1]["y"] - line["y"]) <= 3:
+                rows[-1].append(line)
+            else:
+                rows.append([line])
+
+        for row in rows:
+            row.sort(key=lambda line: line["x"])
+            parts = [line["text"] for line in row]
+            size = max(line["size"] for line in row)
+            has_digits = any(c.isdigit() for c in "".join(parts))
+
+            if size >= body_size * 1.5:
+                row_md = "# " + " ".join(parts)
+            elif not has_digits and (size >= body_size * 1.2 or all(line["bold"] for line in row)):
+                row_md = "## " + " ".join(parts)
+            elif len(parts) >= 2 and AMOUNT_PATTERN.match(parts[-1]):
+                label = " ".join(parts[:-1]).rstrip(" :.$")
+                row_md = f"- **{label}**: {parts[-1]}"
+            elif ":" in parts[0] and len(parts) == 1:
+                label, _, value = parts[0].partition(":")
+                row_md = f"- **{label.strip()}**: {value.strip()}" if value.strip() else f"**{label.strip()}**"
+            else:
+                row_md = " ".join(parts)
+            items.append((row[0]["y"], row[0]["x"], row_md))
+
+    items.sort(key=lambda item: (item[0], item[1]))
+    return "\n\n".join(item[2] for item in items)
+
+
+def extract_text_layer_markdown(pdf) -> list:
+    """
+    Returns, for each page of a PDF (path or bytes), markdown built from the text
+    layer, or None when the page has no usable text layer (scanned/image-only)
+    and needs the vision model.
+    """
+    results = []
+    with open_pdf(pdf) as doc:
+        for page in doc:
+            try:
+                results.append(page_to_markdown(page) if has_usable_text_layer(page) else None)
+            except Exception as e:
+                tracing.log("Text layer extraction error", level="error", page=page.number + 1, error=str(e))
+                results.append(None)
+    return results
+
+
+async def extract_text_layer_markdown_async(pdf) -> list:
+    """
+    Async wrapper for extract_text_layer_markdown.
+    """
+    return await asyncio.to_thread(extract_text_layer_markdown, pdf)
+
+
+def extract_page_text(pdf, page_num: int) -> str:
+    """The plain text layer of one (1-based) page; empty if it is scanned or out of range."""
+    with open_pdf(pdf) as doc:
+        return doc[page_num - 1].get_text("text") if 0 < page_num <= len(doc) else ""
+
+
+def extract_page_texts(pdf) -> list[str]:
+    """
+    Returns the plain text layer of every page of a PDF (path or bytes);
+    empty strings for scanned/image-only pages.
+    """
+    with open_pdf(pdf) as doc:
+        return [page.get_text("text") for page in doc]
+
+
+# OCR pre-pass over scanned pages (see page_routing): Tesseract language and a low
+# resolution, since it only looks for keywords
+OCR_LANGUAGE = os.getenv("OCR_LANGUAGE", "spa")
+OCR_DPI = int(os.getenv("OCR_DPI", "100"))
+_ocr_available = None
+
+
+def ocr_available() -> bool:
+    """Whether PyMuPDF can OCR pages (Tesseract and OCR_LANGUAGE's data are installed)."""
+    global _ocr_available
+    if _ocr_available is None:
+        import fitz  # PyMuPDF
+
+        try:
+            with fitz.open() as doc:
+                doc.new_page(width=72, height=72).get_textpage_ocr(language=OCR_LANGUAGE, dpi=72, full=True)
+            _ocr_available = True
+        except Exception:
+            _ocr_available = False
+    return _ocr_available
+
+
+def ocr_page_texts(pdf, page_nums: list[int], dpi: int = OCR_DPI) -> dict[int, str]:
+    """
+    Text of the given (1-based) pages of a PDF, read by Tesseract from a
+    low-resolution render. Empty when OCR is unavailable.
+    """
+    if not page_nums or not ocr_available():
+        return {}
+    texts = {}
+    with open_pdf(pdf) as doc:
+        for page_num in page_nums:
+            page = doc[page_num - 1]
+            try:
+                textpage = page.get_textpage_ocr(language=OCR_LANGUAGE, dpi=dpi, full=True)
+                texts[page_num] = page.get_text("text", textpage=textpage)
+            except Exception as e:
+                tracing.log("OCR error", level="warning", page=page_num, error=str(e))
+    return texts
+
+
+def encode_image(image) -> str:
     """
     Encodes an image to a base64 string for LLM processing.
+    Accepts a PageImage (encoded once and reused) or a path to an image file.
     """
-    with open(image_path, "rb") as image_file:
+    if isinstance(image, PageImage):
+        return image.base64
+    with open(image, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode('utf-8')
 
-def refine_chip_coordinates(pdf_path: str, page_num: int, chips: list):
+
+def image_url_content(image) -> dict:
     """
-    Refines the coordinates of chips by searching for their values in the PDF text layer using PyMuPDF.
-    Normalizes coordinates to 0-100 percentages.
+    Builds the OpenAI `image_url` content part for a PageImage or an image path.
     """
+    if isinstance(image, PageImage):
+        return {"url": image.data_url, "detail": image.detail}
+    return {"url": f"data:image/png;base64,{encode_image(image)}"}
+
+
+# Tokens that can be part of a number split across words, e.g. "4." "300" or "1 234 567"
+NUMBER_TOKEN_PATTERN = re.compile(r"[$(\-]?\d[\d.,]*\)?%?")
+# A trailing decimal part (",21" or ".5") after the integer part
+DECIMAL_SUFFIX_PATTERN = re.compile(r"^(.*\d)[.,](\d{1,2})$")
+# Adjacent number tokens merged into one candidate
+MAX_MERGED_TOKENS = 4
+# Vertical distance counts this much more than horizontal when anchoring on a label
+LABEL_ROW_WEIGHT = 4.0
+
+
+def _digits(text: str) -> str:
+    return re.sub(r"\D", "", text).lstrip("0")
+
+
+def _split_number(text: str) -> tuple[str, str | None]:
+    """Returns (all digits, digits of the integer part if there is a decimal part)."""
+    numeric = re.sub(r"[^\d.,]", "", text)
+    match = DECIMAL_SUFFIX_PATTERN.match(numeric)
+    return re.sub(r"\D", "", numeric), re.sub(r"\D", "", match.group(1)) if match else None
+
+
+def number_keys(text: str) -> set[str]:
+    """
+    Digit strings a numeric token can match: all of its digits, plus its
+    integer part when it ends in a decimal part ("54.822,21" -> 5482221, 54822).
+    """
+    digits, integer = _split_number(text)
+    keys = {digits.lstrip("0"), (integer or "").lstrip("0")}
+    keys.discard("")
+    return keys
+
+
+def value_keys(value) -> list[str]:
+    """Digit strings to look for for a chip value, most specific first."""
     try:
-        doc = fitz.open(pdf_path)
-        # page_num is 1-based, PyMuPDF is 0-based
-        if page_num > len(doc):
-            return chips
-        
-        page = doc[page_num - 1]
+        number = abs(float(value))
+    except (TypeError, ValueError):
+        digits = _digits(str(value))
+        return [digits] if digits else []
+    integer = _digits(str(int(number)))
+    if not integer:
+        return []
+    if number != int(number):
+        return [integer + f"{number:.2f}".split(".")[1], integer]
+    return [integer]
+
+
+def _normalize_word(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(ch for ch in text if ch.isalnum() and not unicodedata.combining(ch))
+
+
+class PageWordIndex:
+    """
+    Word boxes of one page, indexed for chip lookup.
+
+    Numbers are indexed by digit string (see `number_keys`), including runs of
+    adjacent numeric tokens on the same line so segmented numbers ("4." "300")
+    are found too. Boxes are kept as page fractions in a NumPy array so
+    candidates are scored in one vectorized pass. The parsed values of the
+    same tokens and runs make up `number_index`, for checking chip values.
+    """
+
+    def __init__(self, page: "fitz.Page"):
         width, height = page.rect.width, page.rect.height
-        
-        # Get all words from the page with their bounding boxes
-        # words structure: (x0, y0, x1, y1, "word", block_no, line_no, word_no)
+        # (x0, y0, x1, y1, "word", block_no, line_no, word_no)
         words = page.get_text("words")
-        
-        for chip in chips:
-            target_val = str(chip.get('value', ''))
-            if not target_val:
+
+        self.numbers: dict[str, list[int]] = {}
+        self.words: dict[str, list[int]] = {}
+
+        def add(keys, box_index):
+            for key in keys:
+                key = key.lstrip("0")
+                if key:
+                    self.numbers.setdefault(key, []).append(box_index)
+
+        # Runs of 2+ adjacent numeric tokens get extra boxes after the words
+        merged = []
+        run = []
+        values = []
+        for i, word in enumerate(words):
+            text = word[4]
+            if not NUMBER_TOKEN_PATTERN.fullmatch(text):
+                run = []
+                normalized = _normalize_word(text)
+                if len(normalized) >= 4:
+                    self.words.setdefault(normalized, []).append(i)
                 continue
-                
-            # Find all potential matches on the page
-            matches = []
-            
-            # Helper to clean string for comparison (digits only)
-            def clean_str(s): 
-                return ''.join(filter(str.isdigit, s))
-            
-            target_digits = clean_str(target_val)
-            if not target_digits:
+
+            digits, integer = _split_number(text)
+            add((digits, integer or ""), i)
+            values.append(number_parser.parse_number(text))
+            if run and not self._continues(words[run[-1][0]], word):
+                run = []
+            run.append((i, digits, integer))
+            # Every run ending here: all digits, or the earlier tokens plus this one's integer part
+            for start in range(max(0, len(run) - MAX_MERGED_TOKENS), len(run) - 1):
+                prefix = "".join(token[1] for token in run[start:-1])
+                merged.append((run[start][0], i))
+                add((prefix + digits, prefix + integer if integer else ""), len(words) + len(merged) - 1)
+                values.append(number_parser.parse_number("".join(words[token[0]][4] for token in run[start:])))
+
+        boxes = np.array([word[:4] for word in words], dtype=float).reshape(-1, 4)
+        if merged:
+            spans = np.array(merged)
+            merged_boxes = boxes[spans[:, 0]].copy()
+            # Union with each following token of the span (spans are at most MAX_MERGED_TOKENS long)
+            for offset in range(1, MAX_MERGED_TOKENS):
+                inside = spans[:, 0] + offset <= spans[:, 1]
+                following = boxes[np.minimum(spans[:, 0] + offset, spans[:, 1])]
+                merged_boxes[:, :2] = np.where(inside[:, None], np.minimum(merged_boxes[:, :2], following[:, :2]), merged_boxes[:, :2])
+                merged_boxes[:, 2:] = np.where(inside[:, None], np.maximum(merged_boxes[:, 2:], following[:, 2:]), merged_boxes[:, 2:])
+            boxes = np.vstack((boxes, merged_boxes))
+
+        self.number_index = number_parser.NumberIndex(value for value in values if value is not None)
+        self.boxes = boxes / [width, height, width, height]
+        self.centers = np.column_stack((
+            (self.boxes[:, 0] + self.boxes[:, 2]) / 2,
+            (self.boxes[:, 1] + self.boxes[:, 3]) / 2,
+        ))
+
+    @staticmethod
+    def _continues(previous: tuple, word: tuple) -> bool:
+        same_line = previous[5:7] == word[5:7] and word[7] == previous[7] + 1
+        gap = word[0] - previous[2]
+        return same_line and gap <= 0.5 * (word[3] - word[1])
+
+    def find(self, value) -> np.ndarray:
+        """Indices (into `boxes`) of the candidates matching `value`."""
+        for key in value_keys(value):
+            if key in self.numbers:
+                return np.array(self.numbers[key])
+        return np.array([], dtype=int)
+
+    def label_anchors(self, label: str) -> np.ndarray:
+        """Indices of the words of `label` found on the page."""
+        indices = []
+        for token in re.findall(r"\w+", label or ""):
+            indices.extend(self.words.get(_normalize_word(token), []))
+        return np.array(indices, dtype=int)
+
+    def score(self, candidates: np.ndarray, hint: tuple | None, label: str) -> np.ndarray:
+        """
+        Lower is better. Distance to the model's guess when there is one,
+        otherwise to the nearest word of the chip's label (favouring the same
+        row), otherwise reading order offset by 10 so anchored matches win.
+        """
+        centers = self.centers[candidates]
+        if hint is not None:
+            return (centers[:, 0] - hint[0]) ** 2 + (centers[:, 1] - hint[1]) ** 2
+
+        anchors = self.label_anchors(label)
+        if len(anchors):
+            anchor_centers = self.centers[anchors]
+            dx = centers[:, 0, None] - anchor_centers[None, :, 0]
+            dy = centers[:, 1, None] - anchor_centers[None, :, 1]
+            return ((LABEL_ROW_WEIGHT * dy) ** 2 + dx ** 2).min(axis=1)
+
+        return 10 + centers[:, 1] + 0.01 * centers[:, 0]
+
+
+def build_word_indexes(pdf) -> list[PageWordIndex | None]:
+    """
+    Builds a PageWordIndex for every page of a PDF (bytes or path), opening it once.
+    Returns an empty list if the PDF can't be read.
+    """
+    try:
+        with open_pdf(pdf) as doc:
+            return [PageWordIndex(page) for page in doc]
+    except Exception as e:
+        tracing.log("Word index error", level="error", error=str(e))
+        return []
+
+
+def _to_page_fraction(value: float, start: float, end: float) -> float:
+    return start + value / 100 * (end - start)
+
+
+def _to_display_percent(value: float, start: float, end: float) -> float:
+    return (value - start) / (end - start) * 100
+
+
+def refine_chip_coordinates(
+    indexes: list[PageWordIndex],
+    chips: list,
+    clips: dict[int, tuple] | None = None,
+    search_all_pages: bool = False
+) -> list:
+    """
+    Locates each chip's value in the PDF text layer and sets its bounding box
+    (`x`, `y`, `width`, `height`, percentages of the displayed page image).
+
+    Args:
+        indexes: Per-page word indexes from `build_word_indexes`
+        chips: Chips to refine in place; `page` (1-based) selects the page to
+            search, and an existing box is used as a hint among several matches
+        clips: Page number -> PageImage.clip, to map page coordinates onto
+            images that were cropped to content
+        search_all_pages: Search every page (for document-level chips) and set
+            `page` to where the value was found
+
+    Returns:
+        The same chips. Chips whose value isn't in the text layer are left unchanged.
+    """
+    clips = clips or {}
+    for chip in chips:
+        if search_all_pages:
+            page_nums = range(1, len(indexes) + 1)
+        else:
+            page_nums = [chip.get("page", 1)]
+
+        best = None
+        for page_num in page_nums:
+            if not 1 <= page_num <= len(indexes):
+                continue
+            index = indexes[page_num - 1]
+            candidates = index.find(chip.get("value"))
+            if not len(candidates):
                 continue
 
-            for w in words:
-                w_text = w[4]
-                w_digits = clean_str(w_text)
-                
-                # Check for exact match or if the word contains the value (e.g. $4,300)
-                if target_digits == w_digits and len(target_digits) > 0:
-                    matches.append(w)
-                # Handle segmented numbers (e.g., "4." "300") - simplified for now:
-                # If word is a partial match, we might need logic to combine neighbor words, 
-                # but often PDFs group numbers well or "words" captures them okay.
-                # Use strict single-word match for now to be safe.
-
-            if matches:
-                 # If multiple matches, find the one closest to the extensive LLM guess
-                best_match = None
-                min_dist = float('inf')
-                
-                # LLM center coordinates (0-100 scale)
-                llm_cx = chip['x'] + (chip['width'] / 2)
-                llm_cy = chip['y'] + (chip['height'] / 2)
-                
-                for m in matches:
-                    # PDF coordinates (points)
-                    x0, y0, x1, y1 = m[0], m[1], m[2], m[3]
-                    
-                    # Convert to percentages
-                    pct_x = (x0 / width) * 100
-                    pct_y = (y0 / height) * 100
-                    pct_w = ((x1 - x0) / width) * 100
-                    pct_h = ((y1 - y0) / height) * 100
-                    
-                    pct_cx = pct_x + (pct_w / 2)
-                    pct_cy = pct_y + (pct_h / 2)
-                    
-                    # Euclidean distance squared
-                    dist = (pct_cx - llm_cx)**2 + (pct_cy - llm_cy)**2
-                    
-                    if dist < min_dist:
-                        min_dist = dist
-                        best_match = (pct_x, pct_y, pct_w, pct_h)
-                
-                # Update chip with precise coordinates if a good match was found
-                # Threshold: if the closest match is radically far away (>20% screen distance), keep LLM guess?
-                # For now, trust the text search if fairly close or unique.
-                if best_match:
-                    chip['x'] = round(best_match[0], 2)
-                    chip['y'] = round(best_match[1], 2)
-                    chip['width'] = round(best_match[2], 2)
-                    chip['height'] = round(best_match[3], 2)
-                    
-        doc.close()
-        return chips
-    except Exception:
-        return chips
+            clip = clips.get(page_num) or (0, 0, 1, 1)
+            hint = None
+            if page_num == chip.get("page") and all(key in chip for key in ("x", "y", "width", "height")):
+                hint = (
+                    _to_page_fraction(chip["x"] + chip["width"] / 2, clip[0], clip[2]),
+                    _to_page_fraction(chip["y"] + chip["height"] / 2, clip[1], clip[3]),
+                )
+            scores = index.score(candidates, hint, chip.get("label", ""))
+            i = int(np.argmin(scores))
+            if best is None or scores[i] < best[0]:
+                best = (scores[i], page_num, index.boxes[candidates[i]], clip)
+
+        if best is None:
+            continue
+        _, page_num, box, clip = best
+        chip["page"] = page_num
+        set_chip_box(chip, box, clip)
+    return chips
+
+
+def set_chip_box(chip: dict, box, clip: tuple | None = None) -> dict:
+    """
+    Sets a chip's `x`, `y`, `width`, `height` (percentages of the displayed
+    page image) from a box in page fractions, for an image cropped to `clip`.
+    """
+    x0, y0, x1, y1 = box
+    clip = clip or (0, 0, 1, 1)
+    x = _to_display_percent(x0, clip[0], clip[2])
+    y = _to_display_percent(y0, clip[1], clip[3])
+    chip["x"] = round(float(x), 2)
+    chip["y"] = round(float(y), 2)
+    chip["width"] = round(float(_to_display_percent(x1, clip[0], clip[2]) - x), 2)
+    chip["height"] = round(float(_to_display_percent(y1, clip[1], clip[3]) - y), 2)
+    return chip
@@ -0,0 +1,827 @@
+"""
+Extraction pipeline shared by the upload endpoints.
+
+Each pipeline is an async generator of events, so the same code serves the
+streaming endpoints (one NDJSON line per event) and the classic endpoints
+(events collected into a single JSON response):
+
+- `start`: doc_id, filename, total_pages, cached
+- `page`: one per page, as soon as that page is ready (image and chips/source)
+- `done`: final document-level results
+- `error`: the pipeline failed; no further events follow
+"""
+
+import asyncio
+import functools
+import os
+import traceback
+import uuid
+from typing import AsyncIterator
+
+import layout_templates
+import llm_scheduler
+import markdown_pruning
+import metrics
+import number_parser
+import page_routing
+import pdf_utils
+import tracing
+from extraction_cache import CACHE_ENABLED, extraction_cache, make_cache_key
+from ingestion import Upload
+from page_store import page_store, page_url
+from prompt_registry import prompt_registry
+from schemas.document_specific_schemas import SCHEMA_VERSION
+
+# "auto": build markdown from the PDF text layer where usable, vision model otherwise; "off": always vision
+TEXT_LAYER_MODE = os.getenv("TEXT_LAYER_MODE", "auto")
+# Documents of one batch processed at the same time (their model calls also share llm_scheduler's budget)
+BATCH_MAX_CONCURRENT_DOCUMENTS = int(os.getenv("BATCH_MAX_CONCURRENT_DOCUMENTS", "4"))
+# "true": page images are inlined as base64 data URLs instead of /documents/{doc_id}/pages/{n} URLs
+INLINE_PAGE_IMAGES = os.getenv("INLINE_PAGE_IMAGES", "false").lower() == "true"
+# "true": responses carry a `timings` breakdown (stage durations, tokens, cost, retries, cache)
+INCLUDE_TIMINGS = os.getenv("INCLUDE_TIMINGS", "false").lower() == "true"
+
+
+def pipeline_config(
+    endpoint: str,
+    render_profile: pdf_utils.RenderProfile,
+    use_text_layer: bool = False
+) -> dict:
+    """
+    Describes everything that affects an endpoint's extraction output.
+    Used as part of the extraction cache key.
+    """
+    # The model modules (and the OpenAI SDK behind them) load on the first request, not at startup
+    import vision_processor
+
+    config = {
+        "endpoint": endpoint,
+        "vision_model": vision_processor.VISION_MODEL,
+        "vision_prompt_version": vision_processor.PROMPT_VERSION,
+        "render_profile": render_profile.name,
+        "value_check": (
+            f"{number_parser.VALUE_CHECK_VERSION}-{number_parser.VALUE_CHECK_MODE}"
+            if number_parser.VALUE_CHECK_MODE != "off" else "off"
+        ),
+    }
+    if endpoint == "upload-with-relevance":
+        import text_extractor
+        config.update({
+            "text_model": text_extractor.TEXT_MODEL,
+            "text_prompt_version": text_extractor.PROMPT_VERSION,
+            "schema_version": SCHEMA_VERSION,
+            "guides": prompt_registry.fingerprint,
+            "text_layer": use_text_layer,
+            "page_routing": page_routing_config(),
+            "markdown_pruning": (
+                markdown_pruning.MARKDOWN_PRUNING_VERSION if markdown_pruning.MARKDOWN_PRUNING_MODE != "off" else "off"
+            ),
+        })
+    return config
+
+
+def page_routing_config() -> str:
+    """Page routing part of the cache key: what decides which pages are converted."""
+    if page_routing.PAGE_ROUTING_MODE == "off":
+        return "off"
+    ocr = page_routing.PAGE_ROUTING_OCR != "off" and pdf_utils.ocr_available()
+    return page_routing.PAGE_ROUTING_VERSION + ("-ocr" if ocr else "")
+
+
+async def document_render_profile(pdf_bytes: bytes) -> pdf_utils.RenderProfile:
+    """
+    Render profile for a document whose type the client didn't give, picked
+    from page 1 before anything is rendered: the profile of the type its text
+    layer's keywords point to (see page_routing), "scanned" if it has no text
+    layer, DEFAULT_RENDER_PROFILE if the keywords are inconclusive.
+    """
+    with metrics.stage("render_profile"):
+        page_text = await asyncio.to_thread(pdf_utils.extract_page_text, pdf_bytes, 1)
+    if not page_routing.normalize_text(page_text):
+        return pdf_utils.RENDER_PROFILES["scanned"]
+    classification = page_routing.classify_by_keywords(page_text)
+    return pdf_utils.get_render_profile(None, classification["document_type"] if classification else None)
+
+
+async def cache_lookup(cache_key: str, endpoint: str) -> dict | None:
+    if not CACHE_ENABLED:
+        return None
+    cached = await asyncio.to_thread(extraction_cache.get, cache_key)
+    metrics.record_cache(endpoint, cached is not None)
+    return cached
+
+
+async def cache_store(cache_key: str, payload: dict):
+    if CACHE_ENABLED:
+        await asyncio.to_thread(extraction_cache.put, cache_key, payload)
+
+
+async def iter_processed_pages(
+    page_images: AsyncIterator[pdf_utils.PageImage],
+    total_pages: int,
+    process
+) -> AsyncIterator[tuple[pdf_utils.PageImage, object]]:
+    """
+    Starts `process(image)` as soon as each page is rendered and yields
+    (image, result) pairs in completion order, so model calls overlap rendering.
+    Rendering errors propagate; pending work is cancelled if the consumer stops
+    early (e.g. client disconnect).
+    """
+    queue = asyncio.Queue()
+    tasks = []
+
+    async def run(image):
+        try:
+            await queue.put((image, await process(image), None))
+        except Exception as e:
+            await queue.put((image, None, e))
+
+    async def feed():
+        try:
+            async for image in page_images:
+                tasks.append(asyncio.create_task(run(image)))
+        except Exception as e:
+            await queue.put((None, None, e))
+
+    feeder = asyncio.create_task(feed())
+    try:
+        for _ in range(total_pages):
+            image, result, error = await queue.get()
+            if error is not None:
+                raise error
+            yield image, result
+    finally:
+        feeder.cancel()
+        for task in tasks:
+            task.cancel()
+
+
+async def iter_pages_as_markdown(
+    pdf_bytes: bytes,
+    page_images: AsyncIterator[pdf_utils.PageImage],
+    total_pages: int,
+    use_text_layer: bool
+) -> AsyncIterator[tuple[pdf_utils.PageImage, dict]]:
+    """
+    STAGE 1: Converts pages to markdown, yielding (image, result) as pages finish.
+
+    The document is classified first, from page 1's text layer keywords when
+    they are conclusive, otherwise by a model along with page 1's conversion.
+    Later pages wait for the type and are converted only if its page policy
+    selects them (see page_routing); the others get `source` "skipped".
+
+    Pages with a usable text layer are converted locally; only scanned/image-only
+    pages go to the vision model. Each result carries a `source` key
+    ("text_layer", "vision" or "skipped").
+    """
+    import text_extractor
+    import vision_processor
+
+    with metrics.stage("text_layer"):
+        page_texts = await asyncio.to_thread(pdf_utils.extract_page_texts, pdf_bytes)
+        if use_text_layer:
+            text_layer_pages = await pdf_utils.extract_text_layer_markdown_async(pdf_bytes)
+        else:
+            text_layer_pages = [None] * total_pages
+
+    # Resolved with {"document_type", "confidence"} once page 1 is classified
+    classification = asyncio.get_running_loop().create_future()
+    keyword_classification = page_routing.classify_by_keywords(page_texts[0] if page_texts else "")
+    if keyword_classification is not None:
+        classification.set_result(keyword_classification)
+    selection = None
+
+    async def select_pages() -> set[int]:
+        document_type = (await asyncio.shield(classification))["document_type"]
+        ocr = functools.partial(pdf_utils.ocr_page_texts, pdf_bytes) if page_routing.PAGE_ROUTING_OCR != "off" else None
+        with metrics.stage("page_routing"):
+            return await asyncio.to_thread(page_routing.select_pages, document_type, page_texts, ocr)
+
+    async def is_selected(page_num: int) -> bool:
+        # Pages ask concurrently; the selection (and its OCR pre-pass) runs once
+        nonlocal selection
+        if selection is None:
+            selection = asyncio.ensure_future(select_pages())
+        return page_num in await asyncio.shield(selection)
+
+    async def convert(i: int, image: pdf_utils.PageImage) -> dict:
+        page_markdown = text_layer_pages[i] if i < len(text_layer_pages) else None
+        if page_markdown is None:
+            with metrics.stage("vision"):
+                result = await vision_processor.convert_to_markdown(image, image.page_num)
+            result["source"] = "vision"
+            return result
+
+        result = {"markdown": page_markdown, "document_type": None, "confidence": None, "source": "text_layer"}
+        if i == 0 and not classification.done():
+            # Text layer without conclusive keywords: classify with the (cheaper) text model
+            with metrics.stage("classification"):
+                result.update(await text_extractor.classify_markdown(page_markdown))
+        return result
+
+    async def convert_page(image: pdf_utils.PageImage) -> dict:
+        with tracing.span("page", page=image.page_num) as page_span:
+            result = await convert_page_routed(image)
+            page_span.set(source=result["source"])
+            if "error" in result:
+                page_span.status = "error"
+            return result
+
+    async def convert_page_routed(image: pdf_utils.PageImage) -> dict:
+        i = image.page_num - 1
+        if i > 0:
+            if not await is_selected(image.page_num):
+                return {"markdown": "", "document_type": None, "confidence": None, "source": "skipped"}
+            return await convert(i, image)
+
+        try:
+            result = await convert(i, image)
+            if classification.done():
+                result.update(classification.result())
+            else:
+                classification.set_result({
+                    "document_type": result.get("document_type"),
+                    "confidence": result.get("confidence"),
+                })
+            return result
+        finally:
+            # A failed page 1 leaves the type unknown, so every page is converted
+            if not classification.done():
+                classification.set_result({"document_type": None, "confidence": None})
+
+    async for image, result in iter_processed_pages(page_images, total_pages, convert_page):
+        yield image, result
+
+
+def page_image_url(doc_id: str, image: pdf_utils.PageImage, inline_images: bool) -> str:
+    """Returns the page's base64 data URL, or keeps it in the page store and returns its URL."""
+    if inline_images:
+        return image.data_url
+    page_store.put(doc_id, image)
+    return page_url(doc_id, image.page_num)
+
+
+async def iter_cached_page_urls(
+    doc_id: str,
+    upload: Upload,
+    profile: pdf_utils.RenderProfile,
+    inline_images: bool
+) -> AsyncIterator[tuple[int, str]]:
+    """
+    (page number, image URL) of every page of a result served from the
+    extraction cache. Pages are not rendered to answer it: the page store keeps
+    the PDF and renders each page when the client first requests it. Only
+    inline images (data URLs) need rendering up front.
+    """
+    if inline_images:
+        async for image in pdf_utils.iter_render_pages(upload.data, profile, upload.page_count):
+            yield image.page_num, image.data_url
+        return
+    page_store.put_source(doc_id, upload.data, profile, upload.page_count)
+    for page_num in range(1, upload.page_count + 1):
+        yield page_num, page_url(doc_id, page_num)
+
+
+def tag_chips(chips: list, doc_id: str) -> list:
+    """Copies chips (so cached ones stay untouched) and adds per-response metadata."""
+    tagged = []
+    for chip in chips:
+        chip = dict(chip)
+        chip["id"] = str(uuid.uuid4())
+        chip["doc_id"] = doc_id
+        tagged.append(chip)
+    return tagged
+
+
+def request_finisher(request_metrics: metrics.RequestMetrics, trace: tracing.Trace):
+    """
+    Returns `finish(status)`, which records the request's metrics and ends its
+    trace the first time it is called and does nothing afterwards, so a
+    pipeline can call it again from `finally` (e.g. when the client
+    disconnects mid-stream) without counting the request twice.
+    """
+    finished = False
+
+    async def finish(status: str):
+        nonlocal finished
+        if finished:
+            return
+        finished = True
+        metrics.finish_request(request_metrics, status)
+        await tracing.finish_trace(trace, status)
+
+    return finish
+
+
+async def iter_upload_events(
+    upload: Upload,
+    profile: pdf_utils.RenderProfile | None,
+    inline_images: bool = False,
+    include_timings: bool = False
+) -> AsyncIterator[dict]:
+    """Events for /upload: per-page numeric chips from the vision model."""
+    import vision_processor
+
+    pdf_bytes, filename, total_pages = upload.data, upload.filename, upload.page_count
+    doc_id = str(uuid.uuid4())
+    request_metrics = metrics.start_request("upload")
+    trace = tracing.start_trace("upload", doc_id=doc_id, filename=filename)
+    profile = profile or await document_render_profile(pdf_bytes)
+
+    cache_key = make_cache_key(upload.content_hash, pipeline_config("upload", profile))
+    cached = await cache_lookup(cache_key, "upload")
+
+    yield {
+        "event": "start",
+        "doc_id": doc_id,
+        "filename": filename,
+        "total_pages": total_pages,
+        "cached": cached is not None,
+    }
+
+    finish = request_finisher(request_metrics, trace)
+    try:
+        page_chips = [None] * total_pages
+        errors = []
+
+        if cached is not None:
+            async for page_num, image_url in iter_cached_page_urls(doc_id, upload, profile, inline_images):
+                page_chips[page_num - 1] = cached["page_chips"][page_num - 1]
+                yield {
+                    "event": "page",
+                    "page": page_num,
+                    "image_url": image_url,
+                    "chips": tag_chips(page_chips[page_num - 1], doc_id),
+                }
+        else:
+            # Render PDF pages in memory (async, non-blocking), streaming them to the vision calls
+            page_images = pdf_utils.iter_render_pages(pdf_bytes, profile, total_pages)
+            # Text-layer word boxes, used to give chips exact coordinates
+            word_indexes = asyncio.create_task(asyncio.to_thread(pdf_utils.build_word_indexes, pdf_bytes))
+
+            # Process pages concurrently as they are rendered, emitting each one as soon as it finishes
+            async def extract(image):
+                with tracing.span("page", page=image.page_num) as page_span:
+                    with metrics.stage("vision"):
+                        page_result = await vision_processor.extract_chips_from_page(image, image.page_num)
+                    indexes = await word_indexes
+                    with metrics.stage("value_check"):
+                        number_parser.check_chip_values(indexes, page_result.get("chips", []))
+                    with metrics.stage("refine_chips"):
+                        pdf_utils.refine_chip_coordinates(indexes, page_result.get("chips", []), {image.page_num: image.clip})
+                    page_span.set(chips=len(page_result.get("chips", [])))
+                    if "error" in page_result:
+                        page_span.status = "error"
+                    return page_result
+
+            async for image, page_result in iter_processed_pages(page_images, total_pages, extract):
+                i = image.page_num - 1
+                page_chips[i] = page_result.get("chips", [])
+                page_event = {
+                    "event": "page",
+                    "page": i + 1,
+                    "image_url": page_image_url(doc_id, image, inline_images),
+                    "chips": tag_chips(page_chips[i], doc_id),
+                }
+                if "error" in page_result:
+                    page_event["error"] = page_result["error"]
+                    errors.append({"page": i + 1, "error": page_result["error"]})
+                yield page_event
+
+            # Only cache complete runs; failed pages or chips on no page at all should be retried
+            if not errors and any(page_chips):
+                await cache_store(cache_key, {"page_chips": page_chips})
+
+        done_event = {
+            "event": "done",
+            "doc_id": doc_id,
+            "status": "partial" if errors else "processed",
+            "cached": cached is not None,
+        }
+        if errors:
+            done_event["errors"] = sorted(errors, key=lambda error: error["page"])
+        await finish(done_event["status"])
+        done_event["trace_id"] = trace.trace_id
+        if include_timings:
+            done_event["timings"] = request_metrics.breakdown()
+        yield done_event
+    except Exception as e:
+        tracing.log("Pipeline error", level="error", error=str(e), traceback=traceback.format_exc())
+        await finish("failed")
+        yield {"event": "error", "error": str(e), "status": "failed", "trace_id": trace.trace_id}
+    finally:
+        # No-op unless the client went away mid-stream
+        await finish("failed")
+
+
+async def iter_relevance_events(
+    upload: Upload,
+    profile: pdf_utils.RenderProfile | None,
+    use_text_layer: bool,
+    inline_images: bool = False,
+    include_timings: bool = False
+) -> AsyncIterator[dict]:
+    """
+    Events for /upload-with-relevance.
+
+    Two-stage flow:
+    1. Pages are converted to structured markdown (text layer or vision model);
+       a `page` event is emitted as each page finishes
+    2. Text model extracts and classifies fields from the whole markdown document;
+       the resulting chips are in the `done` event
+    """
+    import text_extractor
+
+    pdf_bytes, filename, total_pages = upload.data, upload.filename, upload.page_count
+    doc_id = str(uuid.uuid4())
+    request_metrics = metrics.start_request("upload-with-relevance")
+    trace = tracing.start_trace("upload-with-relevance", doc_id=doc_id, filename=filename)
+    profile = profile or await document_render_profile(pdf_bytes)
+
+    cache_key = make_cache_key(
+        upload.content_hash,
+        pipeline_config("upload-with-relevance", profile, use_text_layer=use_text_layer)
+    )
+    cached = await cache_lookup(cache_key, "upload-with-relevance")
+
+    yield {
+        "event": "start",
+        "doc_id": doc_id,
+        "filename": filename,
+        "total_pages": total_pages,
+        "cached": cached is not None,
+    }
+
+    # Render PDF pages in memory, streaming them to stage 1 (not for cache hits, see iter_cached_page_urls)
+    page_images = pdf_utils.iter_render_pages(pdf_bytes, profile, total_pages) if cached is None else None
+    errors = []
+    finish = request_finisher(request_metrics, trace)
+    try:
+        # Known issuer layouts are read straight from the text layer (see layout_templates)
+        layout = template_match = None
+        if use_text_layer and total_pages and layout_templates.LAYOUT_TEMPLATES_MODE != "off":
+            with metrics.stage("template"):
+                layout = await asyncio.to_thread(layout_templates.extract_layout, pdf_bytes)
+                if cached is None:
+                    template_match = await asyncio.to_thread(layout_templates.template_library.match, layout)
+            if cached is None:
+                metrics.record_template(template_match is not None)
+
+        if cached is not None:
+            document_type = cached["document_type"]
+            confidence = cached["classification_confidence"]
+            full_markdown = cached["markdown"]
+            all_chips = cached["chips"]
+            pages = cached["pages"]
+            async for page_num, image_url in iter_cached_page_urls(doc_id, upload, profile, inline_images):
+                yield {"event": "page", "image_url": image_url, **pages[page_num - 1]}
+        elif template_match is not None:
+            document_type = template_match.template.document_type
+            confidence = "alta"
+            text_layer_pages = await pdf_utils.extract_text_layer_markdown_async(pdf_bytes)
+            full_markdown = "".join(
+                f"\n\n--- PAGE {i+1} ---\n\n" + page_markdown
+                for i, page_markdown in enumerate(text_layer_pages) if page_markdown is not None
+            )
+            all_chips = template_match.chips()
+            pages = []
+            async for image in page_images:
+                for chip in all_chips:
+                    if chip["page"] == image.page_num:
+                        pdf_utils.set_chip_box(chip, chip.pop("box"), image.clip)
+                page = {"page": image.page_num, "source": "template"}
+                pages.append(page)
+                yield {"event": "page", "image_url": page_image_url(doc_id, image, inline_images), **page}
+            pages.sort(key=lambda page: page["page"])
+        else:
+            if not total_pages:
+                await finish("failed")
+                yield {"event": "error", "error": "No pages were processed", "trace_id": trace.trace_id}
+                return
+
+            word_indexes = asyncio.create_task(asyncio.to_thread(pdf_utils.build_word_indexes, pdf_bytes))
+
+            # STAGE 1: Text layer or vision model converts to markdown
+            markdown_results = [None] * total_pages
+            clips = {}
+            async for image, md_result in iter_pages_as_markdown(pdf_bytes, page_images, total_pages, use_text_layer):
+                i = image.page_num - 1
+                markdown_results[i] = md_result
+                clips[image.page_num] = image.clip
+                page_event = {
+                    "event": "page",
+                    "page": i + 1,
+                    "source": md_result["source"],
+                    "image_url": page_image_url(doc_id, image, inline_images),
+                }
+                if "error" in md_result:
+                    page_event["error"] = md_result["error"]
+                    errors.append({"page": i + 1, "error": md_result["error"]})
+                yield page_event
+
+            # Get document type from first page
+            document_type = markdown_results[0].get("document_type")
+            confidence = markdown_results[0].get("confidence")
+
+            # Combine all markdown pages into one document
+            full_markdown = ""
+            for i, md_result in enumerate(markdown_results):
+                if md_result["source"] == "skipped":
+                    continue
+                markdown_content = md_result.get("markdown", "")
+                full_markdown += f"\n\n--- PAGE {i+1} ---\n\n" + markdown_content
+
+            pages = [
+                {"page": i + 1, "source": md_result["source"]}
+                for i, md_result in enumerate(markdown_results)
+            ]
+
+            # STAGE 2: Text model extracts from ENTIRE document (not per page),
+            # with detail tables collapsed to keep the prompt small
+            with metrics.stage("pruning"):
+                pruned_markdown = await asyncio.to_thread(markdown_pruning.prune_markdown, full_markdown, document_type)
+            with metrics.stage("extraction", document_type=document_type):
+                all_chips = await text_extractor.extract_from_markdown(
+                    pruned_markdown,
+                    document_type,
+                    page_num=1,  # Not used anymore, but kept for compatibility
+                    model=text_extractor.TEXT_MODEL
+                )
+
+            # Check each value against the numbers of the text layer (fixing misread separators),
+            # then locate it there: sets its page and bounding box
+            indexes = await word_indexes
+            with metrics.stage("value_check"):
+                await asyncio.to_thread(number_parser.check_chip_values, indexes, all_chips, True)
+            with metrics.stage("refine_chips"):
+                await asyncio.to_thread(pdf_utils.refine_chip_coordinates, indexes, all_chips, clips, True)
+
+            # Only cache complete runs; failed pages, an empty stage 2 or no converted page should be retried
+            if all_chips and not errors and any(page["source"] != "skipped" for page in pages):
+                await cache_store(cache_key, {
+                    "document_type": document_type,
+                    "classification_confidence": confidence,
+                    "markdown": full_markdown,
+                    "pages": pages,
+                    "chips": all_chips,
+                })
+
+        # Until it expires, the extraction can be confirmed into a layout template
+        if layout is not None and template_match is None:
+            layout_templates.pending_layouts.put(doc_id, layout, document_type, all_chips)
+
+        with metrics.stage("response"):
+            chips = tag_chips(all_chips, doc_id)
+            done_event = {
+                "event": "done",
+                "doc_id": doc_id,
+                "status": "partial" if errors else "processed",
+                "cached": cached is not None,
+                "document_type": document_type,
+                "classification_confidence": confidence,
+                "chips": chips,
+                "total_fields": len(chips),
+                "pages": pages,
+                "template_id": template_match.template.id if template_match is not None else None,
+                "markdown": full_markdown,
+                "markdown_preview": full_markdown[:500]
+            }
+            if errors:
+                done_event["errors"] = sorted(errors, key=lambda error: error["page"])
+        await finish(done_event["status"])
+        done_event["trace_id"] = trace.trace_id
+        if include_timings:
+            done_event["timings"] = request_metrics.breakdown()
+        yield done_event
+    except Exception as e:
+        tracing.log("Pipeline error", level="error", error=str(e), traceback=traceback.format_exc())
+        await finish("failed")
+        yield {"event": "error", "error": str(e), "status": "failed", "trace_id": trace.trace_id}
+    finally:
+        # No-op unless the client went away mid-stream
+        await finish("failed")
+
+
+async def run_upload(
+    upload: Upload,
+    profile: pdf_utils.RenderProfile | None,
+    inline_images: bool = False,
+    include_timings: bool = False
+) -> dict:
+    """Runs /upload to completion and returns its JSON response."""
+    image_urls = {}
+    all_chips = {}
+    result = {}
+    async for event in iter_upload_events(upload, profile, inline_images, include_timings):
+        if event["event"] == "start":
+            result = {"doc_id": event["doc_id"], "filename": upload.filename}
+        elif event["event"] == "page":
+            image_urls[event["page"]] = event["image_url"]
+            all_chips[event["page"]] = event["chips"]
+        elif event["event"] == "done":
+            result.update({"status": event["status"], "cached": event["cached"]})
+            for key in ("errors", "trace_id", "timings"):
+                if key in event:
+                    result[key] = event[key]
+        elif event["event"] == "error":
+            result.update({key: value for key, value in event.items() if key != "event"})
+            result["cached"] = False
+
+    pages = sorted(image_urls)
+    result["chips"] = [chip for page in pages for chip in all_chips[page]]
+    result["image_urls"] = [image_urls[page] for page in pages]
+    return result
+
+
+async def run_upload_with_relevance(
+    upload: Upload,
+    profile: pdf_utils.RenderProfile | None,
+    use_text_layer: bool,
+    inline_images: bool = False,
+    include_timings: bool = False
+) -> dict:
+    """Runs /upload-with-relevance to completion and returns its JSON response."""
+    image_urls = {}
+    async for event in iter_relevance_events(
+        upload, profile, use_text_layer, inline_images, include_timings
+    ):
+        if event["event"] == "page":
+            image_urls[event["page"]] = event["image_url"]
+        elif event["event"] == "error":
+            return {key: value for key, value in event.items() if key != "event"}
+        elif event["event"] == "done":
+            result = {
+                "doc_id": event["doc_id"],
+                "filename": upload.filename,
+                "status": event["status"],
+                "cached": event["cached"],
+                "document_type": event["document_type"],
+                "classification_confidence": event["classification_confidence"],
+                "chips": event["chips"],
+                "image_urls": [image_urls[page] for page in sorted(image_urls)],
+                "total_fields": event["total_fields"],
+                "pages": event["pages"],
+                "template_id": event["template_id"],
+                "markdown": event["markdown"],
+                "markdown_preview": event["markdown_preview"]
+            }
+            for key in ("errors", "trace_id", "timings"):
+                if key in event:
+                    result[key] = event[key]
+            return result
+    return {"error": "No pages were processed"}
+
+
+def group_duplicates(files: list[Upload]) -> dict[int, list[int]]:
+    """
+    Groups identical uploads by content hash.
+    Returns {index of first occurrence: [indexes of all occurrences]}.
+    """
+    first_by_hash = {}
+    groups = {}
+    for index, upload in enumerate(files):
+        first = first_by_hash.setdefault(upload.content_hash, index)
+        groups.setdefault(first, []).append(index)
+    return groups
+
+
+def duplicate_document(document: dict, duplicate_of: int, filename: str) -> dict:
+    """
+    A duplicate upload's copy of the processed document's result (or `done`
+    event). Duplicates share the extraction but are distinct uploads: they get
+    their own doc_id, and the processed copy's pages and pending layout are
+    registered under it, so its image URLs, DELETE /documents/{doc_id} and
+    POST /templates/learn work independently of the original.
+    """
+    duplicate = {**document, "filename": filename, "duplicate_of": duplicate_of}
+    if "doc_id" not in document:
+        return duplicate
+    doc_id = duplicate["doc_id"] = str(uuid.uuid4())
+    page_store.alias(document["doc_id"], doc_id)
+    layout_templates.pending_layouts.alias(document["doc_id"], doc_id)
+    duplicate["chips"] = tag_chips(document.get("chips", []), doc_id)
+    if "image_urls" in document:
+        # Data URLs (inline_images) don't name the document
+        duplicate["image_urls"] = [
+            url.replace(f"/documents/{document['doc_id']}/", f"/documents/{doc_id}/", 1)
+            for url in document["image_urls"]
+        ]
+    return duplicate
+
+
+async def iter_batch_events(
+    files: list[Upload],
+    profile: pdf_utils.RenderProfile | None,
+    use_text_layer: bool,
+    inline_images: bool = False,
+    include_timings: bool = False
+) -> AsyncIterator[dict]:
+    """
+    Events for a batch of uploads through the relevance pipeline.
+
+    Identical files are processed once. Every document's events are interleaved
+    as they happen and tagged with `index` (position of the file in the batch).
+    Model calls run at batch priority, behind interactive uploads.
+    Once the processed copy is done, each of its duplicates gets a single
+    `duplicate` event: the copy's `done` fields under its own doc_id (see
+    `duplicate_document`), with `duplicate_of` pointing at the copy and its
+    `image_urls`.
+    At most BATCH_MAX_CONCURRENT_DOCUMENTS documents run at the same time.
+    """
+    groups = group_duplicates(files)
+
+    yield {
+        "event": "batch_start",
+        "total_documents": len(files),
+        "unique_documents": len(groups),
+    }
+
+    queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENT_DOCUMENTS)
+
+    async def pump(index: int):
+        upload = files[index]
+        image_urls = {}
+        try:
+            async with semaphore:
+                events = iter_relevance_events(
+                    upload, profile, use_text_layer, inline_images, include_timings
+                )
+                async for event in events:
+                    await queue.put({**event, "index": index})
+                    if event["event"] == "page":
+                        image_urls[event["page"]] = event["image_url"]
+                    elif event["event"] in ("done", "error"):
+                        for duplicate in groups[index][1:]:
+                            document = {key: value for key, value in event.items() if key != "event"}
+                            if event["event"] == "done":
+                                document["image_urls"] = [image_urls[page] for page in sorted(image_urls)]
+                            await queue.put({
+                                **duplicate_document(document, index, files[duplicate].filename),
+                                "event": "duplicate",
+                                "index": duplicate,
+                            })
+        except Exception as e:
+            tracing.log("Batch document error", level="error", filename=upload.filename, error=str(e))
+            await queue.put({"event": "error", "index": index, "error": str(e), "status": "failed"})
+            for duplicate in groups[index][1:]:
+                await queue.put({
+                    "event": "duplicate", "index": duplicate, "filename": files[duplicate].filename,
+                    "duplicate_of": index, "error": str(e), "status": "failed",
+                })
+        finally:
+            await queue.put(None)
+
+    # A batch's model calls yield to interactive uploads, like queued jobs (tasks keep the priority)
+    with llm_scheduler.batch_priority():
+        tasks = [asyncio.create_task(pump(index)) for index in groups]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            event = await queue.get()
+            if event is None:
+                remaining -= 1
+            else:
+                yield event
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    yield {"event": "batch_done", "total_documents": len(files)}
+
+
+async def run_batch(
+    files: list[Upload],
+    profile: pdf_utils.RenderProfile | None,
+    use_text_layer: bool,
+    inline_images: bool = False,
+    include_timings: bool = False
+) -> dict:
+    """
+    Runs a batch to completion, at batch priority; one /upload-with-relevance
+    result per file, in upload order.
+    """
+    groups = group_duplicates(files)
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENT_DOCUMENTS)
+
+    async def run_one(index: int) -> dict:
+        async with semaphore:
+            return await run_upload_with_relevance(
+                files[index], profile, use_text_layer, inline_images, include_timings
+            )
+
+    with llm_scheduler.batch_priority():
+        tasks = [asyncio.create_task(run_one(index)) for index in groups]
+    unique_results = await asyncio.gather(*tasks)
+
+    documents = [None] * len(files)
+    for first, result in zip(groups, unique_results):
+        documents[first] = result
+        for index in groups[first][1:]:
+            documents[index] = duplicate_document(result, first, files[index].filename)
+
+    return {
+        "total_documents": len(files),
+        "unique_documents": len(groups),
+        "documents": documents,
+    }
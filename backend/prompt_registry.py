@@ -0,0 +1,198 @@
+"""
+Prompts, tax guides and response schemas, built once instead of per request.
+
+Modules register prompt builders at import time; `prompt_registry.load()` (run
+at startup) reads every guide in `tax_guides/`, builds each prompt for every
+document type and precomputes the structured-output JSON schemas. Prompts put
+their static instructions first and the per-document content last, so
+consecutive calls share the longest possible prefix for provider-side prompt
+caching.
+
+With PROMPT_REGISTRY_WATCH=true, guides are polled for changes and everything
+is rebuilt when one is edited, without restarting the server.
+"""
+
+import asyncio
+import hashlib
+import os
+from pathlib import Path
+from typing import Callable
+
+from pydantic import BaseModel
+
+import tracing
+from schemas.document_specific_schemas import DOCUMENT_TYPE_TO_SCHEMA
+
+TAX_GUIDES_DIR = Path(__file__).parent.parent / "tax_guides"
+PROMPT_REGISTRY_WATCH = os.getenv("PROMPT_REGISTRY_WATCH", "false").lower() == "true"
+PROMPT_REGISTRY_WATCH_INTERVAL_SECONDS = float(os.getenv("PROMPT_REGISTRY_WATCH_INTERVAL_SECONDS", "2"))
+
+
+def strict_json_schema(schema: dict, root: dict | None = None) -> dict:
+    """
+    Adapts a Pydantic JSON schema, in place, to what OpenAI's strict structured
+    outputs accept: objects get `additionalProperties: false` and list every
+    property as required, single-entry `allOf`s are inlined, `null` defaults
+    dropped and `$ref`s that carry sibling keys resolved. The same transform
+    the SDK applies in `client.beta.chat.completions.parse`.
+    """
+    root = schema if root is None else root
+    for key in ("$defs", "definitions"):
+        for definition in schema.get(key, {}).values():
+            strict_json_schema(definition, root)
+
+    if schema.get("type") == "object" and "additionalProperties" not in schema:
+        schema["additionalProperties"] = False
+    properties = schema.get("properties")
+    if isinstance(properties, dict):
+        schema["required"] = list(properties)
+        for property_schema in properties.values():
+            strict_json_schema(property_schema, root)
+
+    if isinstance(schema.get("items"), dict):
+        strict_json_schema(schema["items"], root)
+    for variant in schema.get("anyOf", []):
+        strict_json_schema(variant, root)
+    all_of = schema.get("allOf")
+    if isinstance(all_of, list):
+        if len(all_of) == 1:
+            schema.update(strict_json_schema(all_of[0], root))
+            schema.pop("allOf")
+        else:
+            for entry in all_of:
+                strict_json_schema(entry, root)
+
+    if "default" in schema and schema["default"] is None:
+        schema.pop("default")
+
+    ref = schema.get("$ref")
+    if ref and len(schema) > 1:
+        resolved = root
+        for part in ref.removeprefix("#/").split("/"):
+            resolved = resolved[part]
+        schema.update({**resolved, **schema})
+        schema.pop("$ref")
+        return strict_json_schema(schema, root)
+    return schema
+
+
+def response_format_for(schema_class: type[BaseModel]) -> dict:
+    """Strict `json_schema` response format for a Pydantic model."""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "schema": strict_json_schema(schema_class.model_json_schema()),
+            "name": schema_class.__name__,
+            "strict": True,
+        },
+    }
+
+
+class PromptRegistry:
+    def __init__(self, guides_dir: Path = TAX_GUIDES_DIR):
+        self.guides_dir = Path(guides_dir)
+        # name -> (builder, per_document_type)
+        self._builders: dict[str, tuple[Callable, bool]] = {}
+        self.guides: dict[str, str] = {}
+        self.prompts: dict[tuple[str, str | None], str] = {}
+        self.response_formats: dict[str, dict] = {}
+        self._fingerprint = ""
+        self._guide_mtimes: dict[Path, float] = {}
+        self._loaded = False
+        self._watch_task = None
+
+    def register(self, name: str, builder: Callable, per_document_type: bool = False):
+        """
+        Registers a prompt builder. Per-document-type builders are called as
+        `builder(document_type, guide)`, the others as `builder()`.
+        """
+        self._builders[name] = (builder, per_document_type)
+        if self._loaded:
+            self.prompts.update(self._build(name))
+
+    def load(self):
+        """(Re)reads the guides and rebuilds every prompt and response schema."""
+        guide_mtimes = {path: path.stat().st_mtime for path in self.guides_dir.glob("*_guide.md")}
+        guides = {
+            path.name.removesuffix("_guide.md"): path.read_text(encoding="utf-8")
+            for path in guide_mtimes
+        }
+        digest = hashlib.sha256()
+        for document_type in sorted(guides):
+            digest.update(f"{document_type}\0{guides[document_type]}\0".encode("utf-8"))
+
+        # Swap complete dicts so concurrent readers never see a half-built registry
+        self.guides = guides
+        self.response_formats = {
+            document_type: response_format_for(schema_class)
+            for document_type, schema_class in DOCUMENT_TYPE_TO_SCHEMA.items()
+        }
+        prompts = {}
+        for name in self._builders:
+            prompts.update(self._build(name))
+        self.prompts = prompts
+        self._fingerprint = digest.hexdigest()[:16]
+        self._guide_mtimes = guide_mtimes
+        self._loaded = True
+
+    def _build(self, name: str) -> dict:
+        builder, per_document_type = self._builders[name]
+        if not per_document_type:
+            return {(name, None): builder()}
+        return {
+            (name, document_type): builder(document_type, self.guides.get(document_type, ""))
+            for document_type in DOCUMENT_TYPE_TO_SCHEMA
+        }
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    @property
+    def fingerprint(self) -> str:
+        """Hash of every guide, part of the extraction cache key."""
+        self._ensure_loaded()
+        return self._fingerprint
+
+    def guide(self, document_type: str) -> str:
+        """The tax guide for a document type, or "" if there is none."""
+        self._ensure_loaded()
+        return self.guides.get(document_type, "")
+
+    def prompt(self, name: str, document_type: str | None = None) -> str:
+        """A registered prompt, for `document_type` if its builder is per document type."""
+        self._ensure_loaded()
+        return self.prompts[(name, document_type)]
+
+    def response_format(self, document_type: str) -> dict:
+        """Precomputed structured-output `response_format` for a document type's schema."""
+        self._ensure_loaded()
+        return self.response_formats[document_type]
+
+    def guides_changed(self) -> bool:
+        current = {path: path.stat().st_mtime for path in self.guides_dir.glob("*_guide.md")}
+        return current != self._guide_mtimes
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(PROMPT_REGISTRY_WATCH_INTERVAL_SECONDS)
+            try:
+                if await asyncio.to_thread(self.guides_changed):
+                    await asyncio.to_thread(self.load)
+                    tracing.log("Tax guides changed, prompts rebuilt", fingerprint=self.fingerprint)
+            except Exception as e:
+                tracing.log("Prompt registry reload error", level="error", error=str(e))
+
+    def start_watching(self):
+        """Polls the guides for changes; must be called from the running event loop."""
+        if self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch(), name="prompt-registry-watch")
+
+    async def stop_watching(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            await asyncio.gather(self._watch_task, return_exceptions=True)
+            self._watch_task = None
+
+
+prompt_registry = PromptRegistry()
@@ -17,6 +17,10 @@ from typing import Optional, Literal
 from decimal import Decimal
 
 
+# Bump whenever a schema below changes so cached extractions are invalidated
+SCHEMA_VERSION = "1"
+
+
 # ============================================================================
 # CERTIFICADO DE INGRESOS Y RETENCIONES (Annual Income Certificate)
 # ============================================================================
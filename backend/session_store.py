@@ -0,0 +1,442 @@
+"""
+Server-side store of workbench sessions.
+
+Replaces the frontend's "save session" JSON file, which held every document,
+chip and page image in one blob that had to be downloaded and re-parsed in
+full. A session is kept in a local SQLite database (WAL mode, so reads never
+wait for a write) as separate rows: taxpayer info and UI state, one row per
+document, chip and modified bucket, so each edit is a small incremental write
+and the UI fetches only what it shows (the session summary, then one
+document's chips and page URLs when it is opened).
+
+Page images are stored once by content hash (`images`) and referenced by the
+documents' pages, so a document appended twice, or the same page in several
+sessions, takes no extra space. Images are dropped when no page references
+them anymore. Sessions not updated for SESSION_TTL_SECONDS are deleted.
+"""
+
+import base64
+import binascii
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from pydantic import BaseModel, Field
+
+from page_store import PAGE_BASE_URL
+
+SESSION_DB_PATH = Path(os.getenv("SESSION_DB_PATH", str(Path(__file__).parent / ".data" / "sessions.db")))
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(90 * 24 * 3600)))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    taxpayer TEXT NOT NULL DEFAULT '{}',
+    state TEXT NOT NULL DEFAULT '{}',
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS documents (
+    session_id TEXT NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    metadata TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (session_id, id)
+);
+CREATE TABLE IF NOT EXISTS chips (
+    session_id TEXT NOT NULL,
+    document_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (session_id, document_id, id),
+    FOREIGN KEY (session_id, document_id) REFERENCES documents(session_id, id) ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS buckets (
+    session_id TEXT NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    id TEXT NOT NULL,
+    value REAL NOT NULL,
+    sources TEXT NOT NULL DEFAULT '[]',
+    PRIMARY KEY (session_id, id)
+);
+CREATE TABLE IF NOT EXISTS images (
+    hash TEXT PRIMARY KEY,
+    mime_type TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    session_id TEXT NOT NULL,
+    document_id TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    image_hash TEXT NOT NULL REFERENCES images(hash),
+    PRIMARY KEY (session_id, document_id, page),
+    FOREIGN KEY (session_id, document_id) REFERENCES documents(session_id, id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS pages_by_image ON pages(image_hash);
+CREATE INDEX IF NOT EXISTS sessions_by_update ON sessions(updated_at);
+"""
+
+
+def decode_data_url(data_url: str) -> tuple[bytes, str]:
+    """
+    Returns (bytes, mime type) of a base64 data URL.
+
+    Raises:
+        ValueError: If it is not a base64 data URL
+    """
+    header, _, payload = data_url.partition(",")
+    if not header.startswith("data:") or not header.endswith(";base64"):
+        raise ValueError("Images must be base64 data URLs")
+    try:
+        return base64.b64decode(payload, validate=True), header[5:-7] or "application/octet-stream"
+    except binascii.Error:
+        raise ValueError("Invalid base64 image data")
+
+
+def image_url(session_id: str, image_hash: str) -> str:
+    return f"{PAGE_BASE_URL}/sessions/{session_id}/images/{image_hash}"
+
+
+class SessionStore:
+    """
+    SQLite-backed sessions. Each thread gets its own connection, so methods
+    can be called from `asyncio.to_thread`; WAL lets readers run alongside
+    the (serialized) writer.
+    """
+
+    def __init__(self, path: Path = SESSION_DB_PATH, ttl_seconds: int = SESSION_TTL_SECONDS):
+        self.path = Path(path)
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            return connection
+        with self._init_lock:
+            if not self._initialized:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL only risks the last commits on power loss, never corruption
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA foreign_keys=ON")
+        with self._init_lock:
+            if not self._initialized:
+                connection.executescript(SCHEMA)
+                self._initialized = True
+        self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        """Runs the enclosed statements atomically and yields the connection."""
+        db = self._connect()
+        # IMMEDIATE takes the write lock up front, so read-then-write sequences can't deadlock
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    @staticmethod
+    def _touch(db: sqlite3.Connection, session_id: str) -> bool:
+        cursor = db.execute("UPDATE sessions SET updated_at = ? WHERE id = ?", (time.time(), session_id))
+        return cursor.rowcount > 0
+
+    @staticmethod
+    def _drop_orphan_images(db: sqlite3.Connection):
+        db.execute("DELETE FROM images WHERE NOT EXISTS (SELECT 1 FROM pages WHERE pages.image_hash = images.hash)")
+
+    def create(self, taxpayer: dict | None = None, state: dict | None = None) -> str:
+        session_id = str(uuid.uuid4())
+        now = time.time()
+        with self._transaction() as db:
+            db.execute(
+                "INSERT INTO sessions (id, taxpayer, state, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (session_id, json.dumps(taxpayer or {}), json.dumps(state or {}), now, now),
+            )
+        return session_id
+
+    def update(self, session_id: str, taxpayer: dict | None = None, state: dict | None = None) -> bool:
+        """Replaces the session's taxpayer info and/or merges keys into its UI state."""
+        with self._transaction() as db:
+            row = db.execute("SELECT state FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None:
+                return False
+            if taxpayer is not None:
+                db.execute("UPDATE sessions SET taxpayer = ? WHERE id = ?", (json.dumps(taxpayer), session_id))
+            if state is not None:
+                merged = {**json.loads(row["state"]), **state}
+                db.execute("UPDATE sessions SET state = ? WHERE id = ?", (json.dumps(merged), session_id))
+            self._touch(db, session_id)
+        return True
+
+    def get(self, session_id: str) -> dict | None:
+        """
+        What the UI needs to restore a session: taxpayer info, UI state, the
+        modified buckets and the list of documents (without chips or pages).
+        """
+        db = self._connect()
+        row = db.execute("SELECT * FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        documents = db.execute(
+            """
+            SELECT d.id, d.name, d.metadata,
+                (SELECT COUNT(*) FROM chips c WHERE c.session_id = d.session_id AND c.document_id = d.id) AS chip_count,
+                (SELECT COUNT(*) FROM pages p WHERE p.session_id = d.session_id AND p.document_id = d.id) AS page_count
+            FROM documents d WHERE d.session_id = ? ORDER BY d.position
+            """,
+            (session_id,),
+        ).fetchall()
+        buckets = db.execute("SELECT id, value, sources FROM buckets WHERE session_id = ?", (session_id,)).fetchall()
+        return {
+            "session_id": session_id,
+            "taxpayer": json.loads(row["taxpayer"]),
+            "state": json.loads(row["state"]),
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+            "buckets": {
+                bucket["id"]: {"value": bucket["value"], "sources": json.loads(bucket["sources"])}
+                for bucket in buckets
+            },
+            "documents": [
+                {
+                    "id": document["id"],
+                    "name": document["name"],
+                    "metadata": json.loads(document["metadata"]),
+                    "chip_count": document["chip_count"],
+                    "page_count": document["page_count"],
+                }
+                for document in documents
+            ],
+        }
+
+    def delete(self, session_id: str) -> bool:
+        with self._transaction() as db:
+            cursor = db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            if cursor.rowcount == 0:
+                return False
+            self._drop_orphan_images(db)
+        return True
+
+    def add_document(
+        self,
+        session_id: str,
+        document_id: str,
+        name: str,
+        chips: list[dict],
+        images: list[tuple[bytes, str]],
+        metadata: dict | None = None,
+    ) -> bool | None:
+        """
+        Appends a document with its chips and page images ((bytes, mime type)
+        per page, in order). Returns None if the session does not exist and
+        False if it already has a document with this id.
+        """
+        hashed = [(hashlib.sha256(data).hexdigest(), data, mime_type) for data, mime_type in images]
+        with self._transaction() as db:
+            if not self._touch(db, session_id):
+                return None
+            if db.execute(
+                "SELECT 1 FROM documents WHERE session_id = ? AND id = ?", (session_id, document_id)
+            ).fetchone():
+                return False
+            position = db.execute(
+                "SELECT COALESCE(MAX(position), -1) + 1 FROM documents WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+            db.execute(
+                "INSERT INTO documents (session_id, id, name, position, metadata) VALUES (?, ?, ?, ?, ?)",
+                (session_id, document_id, name, position, json.dumps(metadata or {})),
+            )
+            db.executemany(
+                "INSERT OR IGNORE INTO images (hash, mime_type, data) VALUES (?, ?, ?)",
+                [(image_hash, mime_type, data) for image_hash, data, mime_type in hashed],
+            )
+            db.executemany(
+                "INSERT INTO pages (session_id, document_id, page, image_hash) VALUES (?, ?, ?, ?)",
+                [(session_id, document_id, page, image_hash) for page, (image_hash, _, _) in enumerate(hashed, 1)],
+            )
+            self._insert_chips(db, session_id, document_id, chips)
+        return True
+
+    @staticmethod
+    def _insert_chips(db: sqlite3.Connection, session_id: str, document_id: str, chips: list[dict]):
+        # Chips keep their id; re-sending a chip replaces it in place
+        position = db.execute(
+            "SELECT COALESCE(MAX(position), -1) + 1 FROM chips WHERE session_id = ? AND document_id = ?",
+            (session_id, document_id),
+        ).fetchone()[0]
+        rows = []
+        for offset, chip in enumerate(chips):
+            chip = {**chip, "id": str(chip.get("id") or uuid.uuid4())}
+            rows.append((session_id, document_id, chip["id"], position + offset, json.dumps(chip, ensure_ascii=False)))
+        db.executemany(
+            """
+            INSERT INTO chips (session_id, document_id, id, position, data) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (session_id, document_id, id) DO UPDATE SET data = excluded.data
+            """,
+            rows,
+        )
+
+    def add_chips(self, session_id: str, document_id: str, chips: list[dict]) -> bool:
+        """Appends chips to a document (or replaces those with the same id)."""
+        with self._transaction() as db:
+            if not db.execute(
+                "SELECT 1 FROM documents WHERE session_id = ? AND id = ?", (session_id, document_id)
+            ).fetchone():
+                return False
+            self._insert_chips(db, session_id, document_id, chips)
+            self._touch(db, session_id)
+        return True
+
+    def update_document(self, session_id: str, document_id: str, name: str | None = None, metadata: dict | None = None) -> bool:
+        """Renames a document and/or merges keys into its metadata."""
+        with self._transaction() as db:
+            row = db.execute(
+                "SELECT metadata FROM documents WHERE session_id = ? AND id = ?", (session_id, document_id)
+            ).fetchone()
+            if row is None:
+                return False
+            if name is not None:
+                db.execute(
+                    "UPDATE documents SET name = ? WHERE session_id = ? AND id = ?", (name, session_id, document_id)
+                )
+            if metadata is not None:
+                merged = {**json.loads(row["metadata"]), **metadata}
+                db.execute(
+                    "UPDATE documents SET metadata = ? WHERE session_id = ? AND id = ?",
+                    (json.dumps(merged), session_id, document_id),
+                )
+            self._touch(db, session_id)
+        return True
+
+    def get_document(self, session_id: str, document_id: str) -> dict | None:
+        """A document's chips and page image URLs."""
+        db = self._connect()
+        row = db.execute(
+            "SELECT id, name, metadata FROM documents WHERE session_id = ? AND id = ?", (session_id, document_id)
+        ).fetchone()
+        if row is None:
+            return None
+        chips = db.execute(
+            "SELECT data FROM chips WHERE session_id = ? AND document_id = ? ORDER BY position",
+            (session_id, document_id),
+        ).fetchall()
+        pages = db.execute(
+            "SELECT image_hash FROM pages WHERE session_id = ? AND document_id = ? ORDER BY page",
+            (session_id, document_id),
+        ).fetchall()
+        return {
+            "id": row["id"],
+            "name": row["name"],
+            "metadata": json.loads(row["metadata"]),
+            "chips": [json.loads(chip["data"]) for chip in chips],
+            "image_urls": [image_url(session_id, page["image_hash"]) for page in pages],
+        }
+
+    def delete_document(self, session_id: str, document_id: str) -> bool:
+        with self._transaction() as db:
+            cursor = db.execute("DELETE FROM documents WHERE session_id = ? AND id = ?", (session_id, document_id))
+            if cursor.rowcount == 0:
+                return False
+            self._drop_orphan_images(db)
+            self._touch(db, session_id)
+        return True
+
+    def set_bucket(self, session_id: str, bucket_id: str, value: float, sources: list[dict]) -> bool:
+        with self._transaction() as db:
+            if not self._touch(db, session_id):
+                return False
+            db.execute(
+                """
+                INSERT INTO buckets (session_id, id, value, sources) VALUES (?, ?, ?, ?)
+                ON CONFLICT (session_id, id) DO UPDATE SET value = excluded.value, sources = excluded.sources
+                """,
+                (session_id, bucket_id, value, json.dumps(sources, ensure_ascii=False)),
+            )
+        return True
+
+    def get_image(self, session_id: str, image_hash: str) -> tuple[bytes, str] | None:
+        """(bytes, mime type) of an image, if one of the session's pages uses it."""
+        row = self._connect().execute(
+            """
+            SELECT images.data, images.mime_type FROM images
+            WHERE images.hash = ? AND EXISTS (SELECT 1 FROM pages WHERE pages.image_hash = ? AND pages.session_id = ?)
+            """,
+            (image_hash, image_hash, session_id),
+        ).fetchone()
+        return (row["data"], row["mime_type"]) if row else None
+
+    def purge_expired(self) -> int:
+        """Deletes sessions not updated for `ttl_seconds`. Returns how many."""
+        with self._transaction() as db:
+            cursor = db.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl_seconds,))
+            if cursor.rowcount:
+                self._drop_orphan_images(db)
+        return cursor.rowcount
+
+    def stats(self) -> dict:
+        db = self._connect()
+        return {
+            "sessions": db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0],
+            "images": db.execute("SELECT COUNT(*) FROM images").fetchone()[0],
+            "image_bytes": db.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM images").fetchone()[0],
+        }
+
+
+session_store = SessionStore()
+
+
+class SessionCreateRequest(BaseModel):
+    """Body of POST /sessions."""
+    taxpayer: dict = Field(default_factory=dict, description="Taxpayer info (name, idType, idNumber, city, taxYear)")
+    state: dict = Field(default_factory=dict, description="UI state to restore, e.g. activeTab and activeDocumentId")
+
+
+class SessionUpdateRequest(BaseModel):
+    """Body of PATCH /sessions/{session_id}."""
+    taxpayer: dict | None = Field(None, description="Replaces the taxpayer info")
+    state: dict | None = Field(None, description="Keys merged into the UI state")
+
+
+class SessionDocumentRequest(BaseModel):
+    """Body of POST /sessions/{session_id}/documents."""
+    id: str | None = Field(None, description="Document id (generated if omitted)")
+    name: str
+    chips: list[dict] = Field(default_factory=list)
+    source_doc_id: str | None = Field(
+        None, description="doc_id of the upload whose rendered pages (still in the page store) are saved"
+    )
+    images: list[str] = Field(default_factory=list, description="Page images as base64 data URLs, instead of source_doc_id")
+    metadata: dict = Field(default_factory=dict, description="e.g. document_type")
+
+
+class DocumentUpdateRequest(BaseModel):
+    """Body of PATCH /sessions/{session_id}/documents/{document_id}."""
+    name: str | None = None
+    metadata: dict | None = Field(None, description="Keys merged into the document's metadata")
+
+
+class ChipsRequest(BaseModel):
+    """Body of POST /sessions/{session_id}/documents/{document_id}/chips."""
+    chips: list[dict]
+
+
+class BucketUpdateRequest(BaseModel):
+    """Body of PATCH /sessions/{session_id}/buckets/{bucket_id}."""
+    value: float
+    sources: list[dict] = Field(default_factory=list)
@@ -0,0 +1,160 @@
+"""
+Background cleanup of the temp directory.
+
+Files written under `backend/temp` (and served from `/temp`) used to be
+removed only by a synchronous sweep in the startup hook, which delayed the
+server accepting traffic and left files of crashed requests behind until the
+next restart. The janitor runs as a background task instead and does its disk
+work in `asyncio.to_thread`:
+
+- its first sweep, right after startup, removes everything left over from
+  previous runs (uploaded documents must not outlive the process)
+- then, every TEMP_JANITOR_INTERVAL_SECONDS, entries not modified for
+  TEMP_TTL_SECONDS are removed, and if the directory still holds more than
+  TEMP_MAX_BYTES the least recently modified entries go first until it fits
+
+An entry is a top-level file or directory; a directory's age is that of the
+newest file inside it, so one still being written is never expired. Entries
+modified in the last TEMP_GRACE_SECONDS are never removed to meet the quota.
+"""
+
+import asyncio
+import os
+import shutil
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import metrics
+import tracing
+
+TEMP_DIR = Path(os.getenv("TEMP_DIR", str(Path(__file__).parent / "temp")))
+TEMP_TTL_SECONDS = int(os.getenv("TEMP_TTL_SECONDS", "3600"))
+TEMP_MAX_BYTES = int(os.getenv("TEMP_MAX_BYTES", str(1024 * 1024 * 1024)))
+TEMP_JANITOR_INTERVAL_SECONDS = float(os.getenv("TEMP_JANITOR_INTERVAL_SECONDS", "300"))
+# Recently modified entries may belong to a request in flight
+TEMP_GRACE_SECONDS = int(os.getenv("TEMP_GRACE_SECONDS", "60"))
+
+
+@dataclass
+class TempEntry:
+    path: Path
+    modified_at: float
+    nbytes: int
+
+
+def scan_entry(path: Path) -> TempEntry:
+    """Size and latest modification time of a file, or of everything inside a directory."""
+    stat = path.stat()
+    if not path.is_dir():
+        return TempEntry(path, stat.st_mtime, stat.st_size)
+    modified_at, nbytes = stat.st_mtime, 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                file_stat = os.stat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            modified_at = max(modified_at, file_stat.st_mtime)
+            nbytes += file_stat.st_size
+    return TempEntry(path, modified_at, nbytes)
+
+
+def remove_entry(entry: TempEntry, reason: str) -> bool:
+    try:
+        if entry.path.is_dir():
+            shutil.rmtree(entry.path)
+        else:
+            entry.path.unlink()
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        tracing.log("Temp cleanup error", level="warning", path=str(entry.path), error=str(e))
+        return False
+    metrics.record_temp_removal(reason, entry.nbytes)
+    return True
+
+
+def sweep(
+    directory: Path = TEMP_DIR,
+    ttl_seconds: int = TEMP_TTL_SECONDS,
+    max_bytes: int = TEMP_MAX_BYTES,
+    grace_seconds: int = TEMP_GRACE_SECONDS,
+    modified_before: float | None = None,
+) -> dict:
+    """
+    Removes expired entries, then the oldest ones while the directory is over
+    `max_bytes`. With `modified_before` (a timestamp), every entry last
+    modified before it is removed regardless of the TTL. Blocking; run it in
+    a thread.
+
+    Returns:
+        Counts of removed entries by reason and the bytes left.
+    """
+    if not directory.exists():
+        return {"expired": 0, "quota": 0, "bytes": 0}
+
+    entries = []
+    for path in directory.iterdir():
+        try:
+            entries.append(scan_entry(path))
+        except FileNotFoundError:
+            continue
+
+    now = time.time()
+    cutoff = now - ttl_seconds
+    if modified_before is not None:
+        cutoff = max(cutoff, modified_before)
+    removed = {"expired": 0, "quota": 0}
+    kept = []
+    for entry in entries:
+        if entry.modified_at < cutoff:
+            removed["expired"] += remove_entry(entry, "expired")
+        else:
+            kept.append(entry)
+
+    total = sum(entry.nbytes for entry in kept)
+    for entry in sorted(kept, key=lambda entry: entry.modified_at):
+        if total <= max_bytes:
+            break
+        if entry.modified_at > now - grace_seconds:
+            continue
+        if remove_entry(entry, "quota"):
+            removed["quota"] += 1
+            total -= entry.nbytes
+
+    return {**removed, "bytes": total}
+
+
+class TempJanitor:
+    def __init__(self, directory: Path = TEMP_DIR, interval_seconds: float = TEMP_JANITOR_INTERVAL_SECONDS):
+        self.directory = Path(directory)
+        self.interval_seconds = interval_seconds
+        self._task: asyncio.Task | None = None
+
+    async def _run(self, started_at: float):
+        # The first sweep also clears whatever previous runs left behind
+        modified_before = started_at
+        while True:
+            try:
+                result = await asyncio.to_thread(sweep, self.directory, modified_before=modified_before)
+                if result["expired"] or result["quota"]:
+                    tracing.log("Temp directory cleaned", directory=str(self.directory), **result)
+                modified_before = None
+            except Exception as e:
+                tracing.log("Temp cleanup error", level="error", error=str(e))
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        """Starts the cleanup task; must be called from the running event loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(time.time()), name="temp-janitor")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+temp_janitor = TempJanitor()
@@ -0,0 +1,11 @@
+import os
+import sys
+from pathlib import Path
+
+# Backend modules import each other as top-level modules (`import pdf_utils`)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# The model clients are created at import; no call is made in the tests
+os.environ.setdefault("OPENAI_API_KEY", "test")
+# Pipeline tests run offline and must not read or fill the on-disk extraction cache
+os.environ.setdefault("LLM_BACKEND", "replay")
+os.environ.setdefault("EXTRACTION_CACHE_ENABLED", "false")
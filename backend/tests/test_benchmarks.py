@@ -0,0 +1,29 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent.parent / "benchmarks"
+
+
+def run_suite(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, str(BENCHMARKS_DIR / "pipeline_suite.py"), "--sizes", "1", "--repeat", "1", *args],
+        capture_output=True, text=True, timeout=300, check=True,
+    )
+
+
+def test_pipeline_suite_runs_every_benchmark_and_compares(tmp_path):
+    results_path = tmp_path / "results.json"
+    run_suite("--json", str(results_path))
+
+    saved = json.loads(results_path.read_text())
+    assert {result["benchmark"] for result in saved["results"]} == {
+        "pdf_to_images", "render_pages", "base64", "refine_chips", "value_check",
+        "schema_to_chips", "markdown", "upload_with_relevance",
+    }
+    assert all(result["runs"] == 1 and result["p95_ms"] >= result["p50_ms"] >= 0 for result in saved["results"])
+    assert saved["settings"]["text_layer"] is True
+
+    compared = run_suite("--only", "render_pages,markdown", "--compare", str(results_path))
+    assert "render_pages" in compared.stdout and "ms (" in compared.stdout
@@ -0,0 +1,94 @@
+import fitz
+import pytest
+
+import pdf_utils
+
+WIDTH, HEIGHT = 600, 800
+
+
+def make_pdf(*pages: list[tuple[float, float, str]]) -> bytes:
+    """Pages of (x, baseline y, text) items."""
+    document = fitz.open()
+    for items in pages:
+        page = document.new_page(width=WIDTH, height=HEIGHT)
+        for x, y, text in items:
+            page.insert_text((x, y), text, fontsize=10)
+    return document.tobytes()
+
+
+def center(chip: dict) -> tuple[float, float]:
+    """The chip's box center in page points (boxes are rounded to 0.01%)."""
+    return (
+        (chip["x"] + chip["width"] / 2) / 100 * WIDTH,
+        (chip["y"] + chip["height"] / 2) / 100 * HEIGHT,
+    )
+
+
+STATEMENT = make_pdf(
+    [
+        (60, 100, "Saldo anterior"), (400, 100, "1.234.567"),
+        (60, 400, "Saldo final"), (400, 400, "2.500.000"),
+        (60, 600, "Total abonos"), (400, 600, "1.234.567"),
+    ],
+    [(60, 200, "Retenciones"), (400, 200, "4. 300")],
+)
+
+
+@pytest.fixture(scope="module")
+def indexes():
+    return pdf_utils.build_word_indexes(STATEMENT)
+
+
+def test_chip_gets_the_box_of_its_value(indexes):
+    chip = {"label": "Saldo final", "value": 2500000, "page": 1}
+    pdf_utils.refine_chip_coordinates(indexes, [chip])
+
+    x, y = center(chip)
+    assert 400 < x < 460
+    assert 390 < y < 400
+
+
+def test_repeated_values_are_placed_next_to_their_label(indexes):
+    chips = [
+        {"label": "Saldo anterior", "value": 1234567, "page": 1},
+        {"label": "Total abonos", "value": 1234567, "page": 1},
+    ]
+    pdf_utils.refine_chip_coordinates(indexes, chips)
+
+    assert center(chips[0])[1] < 110
+    assert center(chips[1])[1] > 590
+
+
+def test_model_box_hint_wins_over_the_label(indexes):
+    chip = {"label": "Saldo anterior", "value": 1234567, "page": 1, "x": 65, "y": 74, "width": 8, "height": 2}
+    pdf_utils.refine_chip_coordinates(indexes, [chip])
+    assert center(chip)[1] > 590
+
+
+def test_segmented_numbers_are_found(indexes):
+    chip = {"label": "Retenciones", "value": 4300, "page": 2}
+    pdf_utils.refine_chip_coordinates(indexes, [chip])
+    assert 190 < center(chip)[1] < 200
+
+
+def test_document_level_chips_search_every_page(indexes):
+    chip = {"label": "Retenciones", "value": 4300}
+    pdf_utils.refine_chip_coordinates(indexes, [chip], search_all_pages=True)
+    assert chip["page"] == 2
+
+
+def test_values_missing_from_the_text_layer_are_left_unchanged(indexes):
+    chip = {"label": "Intereses", "value": 987654, "page": 1}
+    pdf_utils.refine_chip_coordinates(indexes, [chip])
+    assert chip == {"label": "Intereses", "value": 987654, "page": 1}
+
+
+def test_boxes_are_relative_to_cropped_images(indexes):
+    full = {"label": "Saldo final", "value": 2500000, "page": 1}
+    cropped = dict(full)
+    pdf_utils.refine_chip_coordinates(indexes, [full])
+    pdf_utils.refine_chip_coordinates(indexes, [cropped], {1: (0.5, 0.25, 1.0, 0.75)})
+
+    assert cropped["x"] == pytest.approx((full["x"] - 50) * 2, abs=0.05)
+    assert cropped["y"] == pytest.approx((full["y"] - 25) * 2, abs=0.05)
+    assert cropped["width"] == pytest.approx(full["width"] * 2, abs=0.05)
@@ -0,0 +1,73 @@
+import json
+import os
+import time
+
+import pytest
+
+import extraction_cache
+from extraction_cache import ExtractionCache, make_cache_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(extraction_cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_entries_survive_a_restart_on_disk(tmp_path):
+    ExtractionCache(tmp_path).put("ab12", {"chips": [1, 2]})
+    assert ExtractionCache(tmp_path).get("ab12") == {"chips": [1, 2]}
+    assert ExtractionCache(tmp_path).get("cd34") is None
+
+
+def test_memory_keeps_the_most_recently_used_entries(tmp_path):
+    cache = ExtractionCache(tmp_path, max_entries=2)
+    cache.put("a1", {"n": 1})
+    cache.put("b2", {"n": 2})
+    cache.get("a1")
+    cache.put("c3", {"n": 3})
+
+    assert list(cache._memory) == ["a1", "c3"]
+    # The evicted entry is still read back from disk
+    assert cache.get("b2") == {"n": 2}
+
+
+def test_entries_expire_after_the_ttl(tmp_path, clock):
+    cache = ExtractionCache(tmp_path, ttl_seconds=60)
+    cache.put("a1", {"n": 1})
+    clock[0] += 30
+    assert cache.get("a1") == {"n": 1}
+
+    clock[0] += 31
+    assert cache.get("a1") is None
+    # Expired on disk too: the file is removed when read
+    assert ExtractionCache(tmp_path, ttl_seconds=60).get("a1") is None
+    assert not list(tmp_path.glob("*/*.json"))
+
+
+def test_disk_quota_drops_the_oldest_files(tmp_path):
+    payload = {"text": "x" * 100}
+    entry_bytes = len(json.dumps({"created_at": time.time(), "payload": payload}))
+    cache = ExtractionCache(tmp_path, max_disk_bytes=int(entry_bytes * 2.5))
+    for age, key in ((30, "a1"), (20, "b2"), (10, "c3")):
+        cache.put(key, payload)
+        written_at = time.time() - age
+        os.utime(cache._path_for(key), (written_at, written_at))
+    cache.put("d4", payload)
+
+    assert sorted(path.stem for path in tmp_path.glob("*/*.json")) == ["c3", "d4"]
+
+
+def test_clear_removes_memory_and_disk_entries(tmp_path):
+    cache = ExtractionCache(tmp_path)
+    cache.put("a1", {"n": 1})
+    cache.clear()
+    assert cache.get("a1") is None
+
+
+def test_cache_key_depends_on_content_and_config():
+    key = make_cache_key("hash", {"model": "a", "version": 1})
+    assert key == make_cache_key("hash", {"version": 1, "model": "a"})
+    assert key != make_cache_key("other", {"model": "a", "version": 1})
+    assert key != make_cache_key("hash", {"model": "b", "version": 1})
@@ -0,0 +1,101 @@
+import graphlib
+
+import numpy as np
+import pytest
+
+import form210
+from form210 import Casilla, Form210Engine, Term, parse_formula
+
+
+def casilla(casilla_id: str, formula: str | None = None) -> Casilla:
+    return Casilla(casilla_id, f"Casilla {casilla_id}", "test", formula, (parse_formula(formula) or ()) if formula else ())
+
+
+@pytest.fixture
+def engine():
+    # 3 = 1 - 2; 5 = Mayor(3, 4) + 1; 6 = 5 - 10
+    return Form210Engine({
+        "1": casilla("1"),
+        "2": casilla("2"),
+        "3": casilla("3", "Casilla 1 - Casilla 2"),
+        "4": casilla("4"),
+        "5": casilla("5", "Mayor(3,4) + 1"),
+        "6": casilla("6", "5 - 10"),
+        "10": casilla("10"),
+    })
+
+
+def test_parse_formula():
+    assert parse_formula("Casilla 29 - Casilla 30") == (Term(1, ("29",)), Term(-1, ("30",)))
+    assert parse_formula("Mayor(97,98) + 103") == (Term(1, ("97", "98")), Term(1, ("103",)))
+    assert parse_formula("-5 + 6") == (Term(-1, ("5",)), Term(1, ("6",)))
+
+
+@pytest.mark.parametrize("formula", ["", "Ver instrucciones", "29 30", "29 * 30"])
+def test_parse_formula_rejects_prose(formula):
+    assert parse_formula(formula) is None
+
+
+def test_compute_treats_missing_as_zero_and_clamps_at_zero(engine):
+    result = engine.compute({"1": 100, "2": 30, "10": 500})
+    assert result["3"] == 70
+    assert result["5"] == 170
+    # 170 - 500 is negative: calculated casillas are never negative
+    assert result["6"] == 0
+
+    assert engine.compute({})["5"] == 0
+
+
+def test_mayor_takes_the_largest_operand(engine):
+    assert engine.compute({"1": 10, "4": 50})["5"] == 60
+
+
+def test_update_recomputes_only_downstream(engine):
+    values = engine.compute({"1": 100, "2": 30, "4": 10})
+    result, changed = engine.update(values, {"2": 40})
+    assert changed == {"2": 40, "3": 60, "5": 160, "6": 160}
+    assert result == engine.compute({**values, "2": 40})
+
+
+def test_update_stops_where_values_do_not_change(engine):
+    values = engine.compute({"1": 100, "2": 30, "4": 500})
+    # 3 changes, but Mayor(3, 4) is still 4
+    result, changed = engine.update(values, {"2": 40})
+    assert changed == {"2": 40, "3": 60}
+    assert result["5"] == values["5"]
+
+
+def test_update_rejects_calculated_casillas(engine):
+    with pytest.raises(ValueError):
+        engine.update(engine.compute({}), {"3": 1})
+
+
+def test_cycles_are_rejected():
+    with pytest.raises(graphlib.CycleError):
+        Form210Engine({"1": casilla("1", "2"), "2": casilla("2", "1")})
+
+
+def test_compute_batch_matches_compute(engine):
+    rng = np.random.default_rng(0)
+    columns = {casilla_id: rng.integers(0, 1000, 50).astype(float) for casilla_id in ("1", "2", "4", "10")}
+    columns["2"][0] = np.nan
+
+    computed = engine.compute_batch(columns)
+    for row in range(50):
+        values = {casilla_id: float(np.nan_to_num(column[row])) for casilla_id, column in columns.items()}
+        expected = engine.compute(values)
+        for casilla_id in engine.order:
+            assert computed[casilla_id][row] == expected[casilla_id]
+
+
+def test_compute_table(engine):
+    output_ids, table = engine.compute_table(["1", "2"], [[100, 30], [5, None]])
+    assert output_ids == ["1", "2", "3", "5", "6"]
+    assert table[:, output_ids.index("3")].tolist() == [70, 5]
+
+
+def test_bundled_instructions_load():
+    engine = form210.get_engine()
+    assert engine.order
+    result = engine.compute({})
+    assert all(result[casilla_id] == 0 for casilla_id in engine.order)
@@ -0,0 +1,78 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import form210
+import main
+
+
+@pytest.fixture(scope="module")
+def client() -> TestClient:
+    return TestClient(main.app)
+
+
+@pytest.fixture(scope="module")
+def engine() -> form210.Form210Engine:
+    return form210.get_engine()
+
+
+def test_casillas_are_listed_with_their_formulas(client):
+    casillas = {casilla["id"]: casilla for casilla in client.get("/form210/casillas").json()["casillas"]}
+    # Casilla 31 = Casilla 29 - Casilla 30 (rentas de trabajo)
+    assert casillas["31"]["calculated"] is True
+    assert casillas["31"]["inputs"] == ["29", "30"]
+    assert casillas["29"]["calculated"] is False
+
+
+def test_full_calculation(client, engine):
+    result = client.post("/form210/calculate", json={"values": {"29": 5_000_000, "30": 1_200_000}}).json()
+
+    assert result["values"]["31"] == 3_800_000
+    assert result["values"] == engine.compute({"29": 5_000_000, "30": 1_200_000})
+    assert result["updated"]["31"] == 3_800_000
+    assert "29" not in result["updated"]
+
+
+def test_incremental_calculation_recomputes_only_downstream(client, engine):
+    values = client.post("/form210/calculate", json={"values": {"29": 5_000_000, "30": 1_200_000}}).json()["values"]
+    result = client.post("/form210/calculate", json={"values": values, "changes": {"30": 2_000_000}}).json()
+
+    assert result["values"] == engine.compute({**values, "30": 2_000_000})
+    assert result["updated"]["31"] == 3_000_000
+    assert set(result["updated"]) <= {"30", *engine.downstream(["30"])}
+
+
+def test_invalid_calculations_are_rejected(client):
+    unknown = client.post("/form210/calculate", json={"values": {"9999": 1}})
+    assert unknown.status_code == 400
+    assert "9999" in unknown.json()["detail"]
+
+    calculated = client.post("/form210/calculate", json={"values": {}, "changes": {"31": 1}})
+    assert calculated.status_code == 400
+
+
+def test_batch_calculation_matches_one_declaration_at_a_time(client, engine):
+    inputs = ["29", "30", "32", "33", "35", "36"]
+    rows = [[1_000_000 * (row + 1) + 1000 * column for column in range(len(inputs))] for row in range(20)]
+    rows[3][1] = None
+
+    result = client.post("/form210/calculate-batch", json={"columns": inputs, "rows": rows}).json()
+
+    assert result["columns"][:len(inputs)] == inputs
+    assert set(result["columns"]) == set(inputs) | set(engine.order)
+    for row, computed in zip(rows, result["rows"]):
+        expected = engine.compute({casilla_id: value or 0 for casilla_id, value in zip(inputs, row)})
+        assert dict(zip(result["columns"], computed)) == {
+            casilla_id: expected.get(casilla_id, 0) for casilla_id in result["columns"]
+        }
+
+
+def test_invalid_batches_are_rejected(client, monkeypatch):
+    ragged = client.post("/form210/calculate-batch", json={"columns": ["29", "30"], "rows": [[1, 2], [3]]})
+    assert ragged.status_code == 400
+
+    unknown = client.post("/form210/calculate-batch", json={"columns": ["9999"], "rows": [[1]]})
+    assert unknown.status_code == 400
+
+    monkeypatch.setattr(form210, "FORM_210_BATCH_MAX_ROWS", 2)
+    too_many = client.post("/form210/calculate-batch", json={"columns": ["29"], "rows": [[1], [2], [3]]})
+    assert too_many.status_code == 413
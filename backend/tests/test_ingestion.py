@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import io
+
+import fitz
+import pytest
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+
+import ingestion
+
+MAX_BYTES = 4096
+
+
+def make_client() -> TestClient:
+    app = FastAPI()
+    app.add_middleware(ingestion.RequestSizeLimitMiddleware, max_bytes=MAX_BYTES)
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        return {"size": len(await file.read())}
+
+    return TestClient(app)
+
+
+def multipart_chunks(size: int):
+    """A multipart body with a `size`-byte file, sent without Content-Length (chunked)."""
+    yield b'--boundary\r\nContent-Disposition: form-data; name="file"; filename="a.pdf"\r\n\r\n'
+    for _ in range(size // 1024):
+        yield b"x" * 1024
+    yield b"\r\n--boundary--\r\n"
+
+
+def post_chunked(client: TestClient, size: int):
+    return client.post(
+        "/upload",
+        content=multipart_chunks(size),
+        headers={"Content-Type": "multipart/form-data; boundary=boundary"},
+    )
+
+
+def test_oversized_chunked_body_is_rejected_while_received():
+    response = post_chunked(make_client(), 64 * 1024)
+    assert response.status_code == 413
+    assert str(MAX_BYTES) in response.json()["detail"]
+
+
+def test_chunked_body_within_the_limit_is_accepted():
+    response = post_chunked(make_client(), 2048)
+    assert response.status_code == 200
+    assert response.json() == {"size": 2048}
+
+
+def test_declared_oversized_body_is_rejected_before_it_is_read():
+    response = make_client().post("/upload", files={"file": ("a.pdf", b"x" * (MAX_BYTES + 1))})
+    assert response.status_code == 413
+
+
+def make_pdf(pages: int = 1) -> bytes:
+    document = fitz.open()
+    for _ in range(pages):
+        document.new_page().insert_text((72, 72), "Certificado de ingresos y retenciones")
+    return document.tobytes()
+
+
+def read(data: bytes, filename: str = "cert.pdf", declared_size: int | None = None, **limits) -> ingestion.Upload:
+    upload = UploadFile(io.BytesIO(data), filename=filename, size=declared_size)
+    return asyncio.run(ingestion.read_upload(upload, **limits))
+
+
+def test_upload_is_read_hashed_and_counted():
+    data = make_pdf(3)
+    upload = read(data, filename="../../etc/cert\x00.pdf")
+
+    assert upload.data == data
+    assert upload.content_hash == hashlib.sha256(data).hexdigest()
+    assert upload.page_count == 3
+    assert upload.filename == "cert.pdf"
+
+
+def test_large_uploads_are_read_in_chunks(monkeypatch):
+    monkeypatch.setattr(ingestion, "UPLOAD_CHUNK_BYTES", 1024)
+    data = make_pdf(40)
+    upload = read(data)
+    assert upload.data == data and upload.page_count == 40
+
+
+@pytest.mark.parametrize("declared_size", [None, 10 ** 9])
+def test_files_over_the_byte_limit_are_rejected(declared_size):
+    with pytest.raises(ingestion.UploadRejectedError) as rejected:
+        read(make_pdf(), declared_size=declared_size, max_bytes=512)
+    assert rejected.value.status_code == 413
+
+
+def test_files_over_the_page_limit_are_rejected():
+    with pytest.raises(ingestion.UploadRejectedError) as rejected:
+        read(make_pdf(5), max_pages=4)
+    assert rejected.value.status_code == 413
+    assert "5 pages" in str(rejected.value)
+
+
+@pytest.mark.parametrize("data", [b"", b"%PDF-1.7 truncated", b"not a pdf at all"])
+def test_empty_or_unreadable_files_are_rejected(data):
+    with pytest.raises(ingestion.UploadRejectedError) as rejected:
+        read(data)
+    assert rejected.value.status_code == 400
+
+
+def test_safe_filename():
+    assert ingestion.safe_filename(None) == ingestion.DEFAULT_FILENAME
+    assert ingestion.safe_filename("C:\\Users\\ana\\extracto julio.pdf") == "extracto julio.pdf"
+    assert ingestion.safe_filename(".hidden.pdf") == "hidden.pdf"
+    assert len(ingestion.safe_filename("a" * 400 + ".pdf")) == 255
@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+import llm_scheduler
+from jobs import JobQueue, QueueFullError
+
+
+async def run_jobs(queue: JobQueue, *runs) -> list:
+    await queue.start()
+    try:
+        jobs = [queue.submit(run, f"doc{i}.pdf") for i, run in enumerate(runs)]
+        await queue._queue.join()
+        return jobs
+    finally:
+        await queue.stop()
+
+
+def test_jobs_complete_or_fail_with_their_error():
+    async def completed():
+        return {"chips": [1]}
+
+    async def failed():
+        return {"error": "No pages were processed"}
+
+    async def crashed():
+        raise RuntimeError("boom")
+
+    jobs = asyncio.run(run_jobs(JobQueue(workers=2), completed, failed, crashed))
+
+    assert [job.status for job in jobs] == ["completed", "failed", "failed"]
+    assert jobs[0].to_dict()["result"] == {"chips": [1]}
+    assert jobs[1].to_dict()["error"] == "No pages were processed"
+    assert jobs[2].to_dict()["error"] == "boom"
+    assert all(job.finished_at >= job.started_at >= job.created_at for job in jobs)
+
+
+def test_jobs_run_at_batch_priority():
+    priorities = []
+
+    async def record_priority():
+        priorities.append(llm_scheduler._priority.get())
+        return {}
+
+    asyncio.run(run_jobs(JobQueue(workers=1), record_priority))
+    assert priorities == [llm_scheduler.PRIORITY_BATCH]
+
+
+def test_full_queue_rejects_new_jobs():
+    async def submit_over_capacity():
+        queue = JobQueue(workers=1, max_queue=1)
+        await queue.start()
+        release = asyncio.Event()
+
+        async def blocked():
+            await release.wait()
+            return {}
+
+        try:
+            queue.submit(blocked, "running.pdf")
+            await asyncio.sleep(0)  # the worker takes the first job
+            queue.submit(blocked, "queued.pdf")
+            with pytest.raises(QueueFullError):
+                queue.submit(blocked, "rejected.pdf")
+            assert queue.stats()["running"] == 1 and queue.stats()["queued"] == 1
+        finally:
+            release.set()
+            await queue.stop()
+
+    asyncio.run(submit_over_capacity())
+
+
+def test_submit_requires_started_workers():
+    async def run():
+        return {}
+
+    with pytest.raises(RuntimeError):
+        JobQueue().submit(run, "doc.pdf")
+
+
+def test_finished_jobs_are_forgotten_after_the_ttl():
+    async def completed():
+        return {}
+
+    async def submit_later():
+        queue = JobQueue(workers=1, result_ttl_seconds=0)
+        jobs = await run_jobs(queue, completed)
+        await queue.start()
+        try:
+            await asyncio.sleep(0.01)
+            queue.submit(completed, "next.pdf")
+            return queue, jobs[0]
+        finally:
+            await queue.stop()
+
+    queue, job = asyncio.run(submit_later())
+    assert queue.get(job.id) is None
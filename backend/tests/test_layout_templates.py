@@ -0,0 +1,102 @@
+import json
+import threading
+
+import fitz
+import pytest
+
+from layout_templates import TemplateLibrary, extract_layout
+
+ROWS = [
+    ("CERTIFICADO DE INGRESOS Y RETENCIONES POR RENTAS DE TRABAJO", 60),
+    ("Formulario 220", 80),
+    ("Pagos por salarios", 200),
+    ("Aportes obligatorios por salud", 230),
+    ("Aportes obligatorios a fondos de pensiones", 260),
+    ("Firma del retenedor", 700),
+]
+
+
+def certificate(salarios: str, salud: str, pension: str, shift: float = 0):
+    document = fitz.open()
+    page = document.new_page()
+    for text, y in ROWS:
+        page.insert_text((50, y + shift), text, fontsize=10)
+    for value, y in ((salarios, 200), (salud, 230), (pension, 260)):
+        page.insert_text((450, y + shift), value, fontsize=10)
+    return extract_layout(document.tobytes())
+
+
+@pytest.fixture
+def library(tmp_path):
+    return TemplateLibrary(tmp_path)
+
+
+FIELDS = {"salarios": 85_000_000, "aportes_salud": 3_400_000, "aportes_pension": 3_500_000}
+
+
+def test_learned_template_reads_a_new_document(library):
+    library.learn(certificate("85.000.000", "3.400.000", "3.500.000"), "certificado_ingresos", FIELDS)
+
+    match = library.match(certificate("120.500.000,50", "4.820.000", "6.100.000", shift=4))
+    assert match is not None
+    assert {name: value for name, (value, _, _) in match.values.items()} == {
+        "salarios": 120_500_000.5, "aportes_salud": 4_820_000, "aportes_pension": 6_100_000,
+    }
+    assert match.template.hits == 1
+
+
+def test_unknown_layout_does_not_match(library):
+    library.learn(certificate("85.000.000", "3.400.000", "3.500.000"), "certificado_ingresos", FIELDS)
+    document = fitz.open()
+    document.new_page().insert_text((50, 60), "Extracto bancario cuenta de ahorros 1.234.567")
+    assert library.match(extract_layout(document.tobytes())) is None
+
+
+def test_learn_rejects_values_not_on_the_page(library):
+    with pytest.raises(ValueError):
+        library.learn(certificate("85.000.000", "3.400.000", "3.500.000"), "certificado_ingresos", {"salarios": 1})
+
+
+def test_relearning_replaces_the_fields_dict(library):
+    layout = certificate("85.000.000", "3.400.000", "3.500.000")
+    template = library.learn(layout, "certificado_ingresos", {"salarios": 85_000_000})
+    fields = template.fields
+
+    relearned = library.learn(layout, "certificado_ingresos", {"aportes_salud": 3_400_000})
+    assert relearned is template
+    assert set(template.fields) == {"salarios", "aportes_salud"}
+    # Readers holding the previous dict never see it change
+    assert set(fields) == {"salarios"}
+
+
+def test_concurrent_learn_and_match(library):
+    layout = certificate("85.000.000", "3.400.000", "3.500.000")
+    library.learn(layout, "certificado_ingresos", {"salarios": 85_000_000})
+    errors = []
+
+    def match_repeatedly():
+        try:
+            for _ in range(200):
+                assert library.match(layout) is not None
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=match_repeatedly) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for name, value in list(FIELDS.items()) * 10:
+        library.learn(layout, "certificado_ingresos", {name: value})
+    for reader in readers:
+        reader.join()
+    assert errors == []
+
+
+def test_hits_are_not_saved(library, tmp_path):
+    layout = certificate("85.000.000", "3.400.000", "3.500.000")
+    template = library.learn(layout, "certificado_ingresos", FIELDS)
+    library.match(layout)
+
+    saved = json.loads((tmp_path / f"{template.id}.json").read_text(encoding="utf-8"))
+    assert "hits" not in saved
+    reloaded = TemplateLibrary(tmp_path).templates()
+    assert [(loaded.id, loaded.hits, sorted(loaded.fields)) for loaded in reloaded] == [(template.id, 0, sorted(FIELDS))]
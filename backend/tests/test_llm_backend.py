@@ -0,0 +1,98 @@
+import asyncio
+import json
+
+import openai
+import pytest
+
+import llm_backend
+from llm_backend import RecordingClient, RecordingStore, ReplayClient, make_completion, request_key
+
+
+def vision_request(image: bytes) -> dict:
+    return {
+        "model": "gpt-4o",
+        "messages": [{"role": "user", "content": [
+            {"type": "text", "text": "Extract the chips"},
+            {"type": "image_url", "image_url": {"url": "data:image/png;base64," + image.hex(), "detail": "high"}},
+        ]}],
+        "temperature": 0,
+    }
+
+
+class FakeOpenAI:
+    """Stands in for AsyncOpenAI behind RecordingClient."""
+
+    def __init__(self, content: str):
+        self.chat = llm_backend._Chat(self._create)
+        self.content = content
+
+    async def _create(self, **request):
+        return make_completion(request["model"], self.content, {"prompt_tokens": 900, "completion_tokens": 40})
+
+
+def test_recorded_responses_are_replayed(tmp_path):
+    store = RecordingStore(tmp_path)
+    request = vision_request(b"page 1")
+    recorded = asyncio.run(RecordingClient(FakeOpenAI('{"chips": [1]}'), store).chat.completions.create(**request))
+
+    replay = ReplayClient(store)
+    replayed = asyncio.run(replay.chat.completions.create(**request))
+
+    assert replayed.choices[0].message.content == recorded.choices[0].message.content == '{"chips": [1]}'
+    assert replayed.usage.prompt_tokens == 900
+    assert (replay.calls, replay.misses) == (1, 0)
+
+
+def test_request_key_hashes_images_and_ignores_other_options():
+    key = request_key(vision_request(b"page 1"))
+    assert key == request_key({**vision_request(b"page 1"), "max_tokens": 100})
+    assert key != request_key(vision_request(b"page 2"))
+    assert key != request_key({**vision_request(b"page 1"), "model": "gpt-4o-mini"})
+
+
+def test_unrecorded_requests_get_a_reply_of_the_right_shape(tmp_path):
+    replay = ReplayClient(RecordingStore(tmp_path))
+    schema = {"type": "object", "properties": {"ingresos": {}, "retenciones": {}}}
+    response = asyncio.run(replay.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[{"role": "user", "content": "markdown"}],
+        response_format={"type": "json_schema", "json_schema": {"name": "x", "schema": schema}},
+    ))
+
+    assert json.loads(response.choices[0].message.content) == {"ingresos": None, "retenciones": None}
+    assert replay.misses == 1
+    plain = asyncio.run(replay.chat.completions.create(model="gpt-4o", messages=[]))
+    assert json.loads(plain.choices[0].message.content)["chips"] == []
+
+
+def test_simulated_failures_raise_the_openai_exceptions(tmp_path):
+    store = RecordingStore(tmp_path)
+    with pytest.raises(openai.RateLimitError) as rate_limited:
+        asyncio.run(ReplayClient(store, rate_limit_rate=1, retry_after_seconds=2).chat.completions.create(model="m", messages=[]))
+    assert rate_limited.value.response.headers["retry-after"] == "2"
+
+    with pytest.raises(openai.InternalServerError):
+        asyncio.run(ReplayClient(store, error_rate=1).chat.completions.create(model="m", messages=[]))
+
+
+def test_seeded_failures_are_deterministic(tmp_path):
+    async def outcomes(seed):
+        replay = ReplayClient(RecordingStore(tmp_path), error_rate=0.5, seed=seed)
+        results = []
+        for _ in range(20):
+            try:
+                await replay.chat.completions.create(model="m", messages=[])
+                results.append("ok")
+            except openai.InternalServerError:
+                results.append("error")
+        return results
+
+    first = asyncio.run(outcomes(7))
+    assert first == asyncio.run(outcomes(7))
+    assert {"ok", "error"} == set(first)
+
+
+def test_unknown_backend_is_refused():
+    assert isinstance(llm_backend.create_client("replay"), ReplayClient)
+    with pytest.raises(ValueError):
+        llm_backend.create_client("mock")
@@ -0,0 +1,159 @@
+import asyncio
+import time
+
+import httpx
+import openai
+import pytest
+
+import llm_backend
+from llm_scheduler import (
+    DEFAULT_ACCOUNT_TIER,
+    TIER_RATE_LIMITS,
+    LLMCallError,
+    LLMScheduler,
+    TokenBucket,
+    batch_priority,
+    is_retryable,
+    resolve_rate_limits,
+    retry_after_seconds,
+)
+
+
+def error_response(status_code: int, headers: dict | None = None) -> httpx.Response:
+    request = httpx.Request("POST", "http://replay.local/v1/chat/completions")
+    return httpx.Response(status_code, headers=headers, request=request)
+
+
+def rate_limit_error(headers: dict) -> openai.RateLimitError:
+    return openai.RateLimitError("Rate limited", response=error_response(429, headers), body=None)
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        ({"retry-after": "2"}, 2.0),
+        ({"retry-after-ms": "250"}, 0.25),
+        ({"retry-after-ms": "250", "retry-after": "2"}, 0.25),
+        ({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"}, None),
+        ({}, None),
+    ],
+)
+def test_retry_after_seconds(headers, expected):
+    assert retry_after_seconds(rate_limit_error(headers)) == expected
+
+
+def test_retry_after_seconds_without_response():
+    assert retry_after_seconds(ValueError("no response")) is None
+
+
+def test_is_retryable():
+    assert is_retryable(rate_limit_error({}))
+    assert is_retryable(openai.InternalServerError("boom", response=error_response(500), body=None))
+    assert not is_retryable(openai.BadRequestError("bad", response=error_response(400), body=None))
+    assert not is_retryable(ValueError("not an API error"))
+
+
+def make_scheduler(**kwargs) -> LLMScheduler:
+    return LLMScheduler(rate_limits={}, **{"backoff_base": 0.001, "backoff_max": 0.002, **kwargs})
+
+
+def replayed_call(clients):
+    """A request that uses the next replay client on each attempt."""
+    clients = iter(clients)
+    return lambda: next(clients).chat.completions.create(model="gpt-4o", messages=[{"role": "user", "content": "hola"}])
+
+
+def test_call_honors_retry_after_and_pauses_the_model():
+    scheduler = make_scheduler()
+    limited = llm_backend.ReplayClient(rate_limit_rate=1, retry_after_seconds=0.1, seed=0)
+    healthy = llm_backend.ReplayClient(seed=0)
+
+    async def run():
+        start = time.monotonic()
+        response = await scheduler.call("gpt-4o", replayed_call([limited, healthy]))
+        return response, time.monotonic() - start
+
+    response, elapsed = asyncio.run(run())
+    assert response.choices[0].message.content
+    assert (limited.calls, healthy.calls) == (1, 1)
+    # The backoff (a few ms) is raised to the server's Retry-After
+    assert elapsed >= 0.1
+    assert "gpt-4o" in scheduler._paused_until
+
+
+def test_call_gives_up_after_max_retries():
+    scheduler = make_scheduler(max_retries=2)
+    limited = llm_backend.ReplayClient(rate_limit_rate=1, retry_after_seconds=0, seed=0)
+
+    with pytest.raises(LLMCallError, match="after 3 attempts"):
+        asyncio.run(scheduler.call("gpt-4o", replayed_call([limited] * 3)))
+    assert limited.calls == 3
+
+
+def test_call_does_not_retry_client_errors():
+    scheduler = make_scheduler()
+    calls = []
+
+    async def request():
+        calls.append(1)
+        raise openai.BadRequestError("bad", response=error_response(400), body=None)
+
+    with pytest.raises(LLMCallError):
+        asyncio.run(scheduler.call("gpt-4o", request))
+    assert len(calls) == 1
+
+
+def test_unconfigured_budget_never_waits():
+    bucket = TokenBucket(None)
+    bucket.consume(10 ** 9)
+    assert bucket.wait_time(10 ** 9) == 0
+
+
+def test_configured_budget_waits_for_refill():
+    bucket = TokenBucket(600)  # 10 per second
+    bucket.consume(600)
+    assert bucket.wait_time(5) == pytest.approx(0.5, abs=0.05)
+
+
+def test_budgets_default_to_tier_1():
+    limits, fallback = resolve_rate_limits(DEFAULT_ACCOUNT_TIER)
+    assert limits["gpt-4o"] == {"rpm": 500, "tpm": 30_000}
+    assert fallback == TIER_RATE_LIMITS["1"]["gpt-4o"]
+
+
+def test_overrides_replace_a_models_budget():
+    limits, _ = resolve_rate_limits("3", '{"gpt-4o": {"rpm": 10}}')
+    assert limits["gpt-4o"] == {"rpm": 10}
+    assert limits["gpt-4o-mini"]["tpm"] == 4_000_000
+
+
+def test_unknown_tier_is_refused():
+    with pytest.raises(ValueError, match="LLM_ACCOUNT_TIER"):
+        resolve_rate_limits("free")
+
+
+def test_interactive_call_is_served_before_queued_batch_calls():
+    scheduler = LLMScheduler(rate_limits={}, max_concurrency=1)
+    served = []
+
+    async def main():
+        release = asyncio.Event()
+
+        async def blocking():
+            await release.wait()
+
+        async def request(name):
+            served.append(name)
+
+        holder = asyncio.create_task(scheduler.call("gpt-4o", blocking))
+        await asyncio.sleep(0)
+        with batch_priority():
+            batch = [asyncio.create_task(scheduler.call("gpt-4o", lambda i=i: request(f"batch-{i}"))) for i in range(3)]
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(scheduler.call("gpt-4o", lambda: request("interactive")))
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(holder, interactive, *batch)
+
+    asyncio.run(main())
+    assert served == ["interactive", "batch-0", "batch-1", "batch-2"]
@@ -0,0 +1,97 @@
+import markdown_pruning
+from markdown_pruning import prune_markdown
+
+
+def table(rows: list[str]) -> list[str]:
+    return ["| Fecha | Descripción | Valor |", "|---|---|---|"] + [f"| {row} |" for row in rows]
+
+
+def test_small_tables_are_kept():
+    markdown = "\n".join(["# Resumen"] + table(["01/07 | Pago | 100", "02/07 | Abono | 200"]))
+    assert prune_markdown(markdown, "factura") == markdown
+
+
+def test_large_table_is_collapsed_keeping_header_and_totals():
+    rows = [f"0{day % 9 + 1}/07 | Compra {day} | {day}00" for day in range(20)] + ["| Total | 19000"]
+    markdown = "\n".join(["# Factura"] + table(rows) + ["Gracias por su compra"])
+    pruned = prune_markdown(markdown, "factura").split("\n")
+
+    assert pruned[:3] == ["# Factura", "| Fecha | Descripción | Valor |", "|---|---|---|"]
+    assert pruned[3] == "| … 20 filas de detalle omitidas … |  |  |"
+    assert pruned[4] == "| | Total | 19000 |"
+    assert pruned[-1] == "Gracias por su compra"
+
+
+def test_detail_sections_are_collapsed_at_any_size_across_pages():
+    markdown = "\n".join(
+        ["## Detalle de movimientos"]
+        + table(["01/07 | Retiro | 50"])
+        + ["", "--- PAGE 2 ---", ""]
+        + table(["02/07 | Retiro | 70", "| Saldo final | 880"])
+        + ["## Resumen", "- **Saldo final:** 880"]
+    )
+    pruned = prune_markdown(markdown, "extracto_bancario")
+
+    assert "Retiro" not in pruned
+    assert "--- PAGE 2 ---" in pruned
+    assert "| | Saldo final | 880 |" in pruned
+    assert pruned.endswith("## Resumen\n- **Saldo final:** 880")
+
+
+def test_dated_lines_from_the_text_layer_are_collapsed():
+    lines = [f"{day:02d}/07 Compra {day} 1.000" for day in range(1, 11)]
+    markdown = "\n".join(["# Extracto"] + lines + ["Saldo final 10.000"])
+    pruned = prune_markdown(markdown, "extracto_bancario").split("\n")
+    assert pruned == ["# Extracto", "… 10 líneas de detalle omitidas …", "Saldo final 10.000"]
+
+
+def test_dated_lines_separated_by_blank_lines_are_one_run():
+    lines = [f"{day:02d}/07 Compra {day} 1.000" for day in range(1, 51)]
+    markdown = "\n\n".join(["# Extracto"] + lines + ["Saldo final 50.000"])
+    pruned = prune_markdown(markdown, "extracto_bancario")
+    assert pruned == "# Extracto\n\n… 50 líneas de detalle omitidas …\n\nSaldo final 50.000"
+
+
+def test_keywords_match_without_accents_or_case():
+    rows = [f"0{day % 9 + 1}/07 | Item {day} | 1" for day in range(10)] + ["| SUBTOTÁL | 10"]
+    pruned = prune_markdown("\n".join(table(rows)), "factura")
+    assert "SUBTOTÁL" in pruned
+
+
+def test_off_mode_returns_the_markdown_unchanged(monkeypatch):
+    monkeypatch.setattr(markdown_pruning, "MARKDOWN_PRUNING_MODE", "off")
+    markdown = "\n".join(table([f"0{day % 9 + 1}/07 | x | 1" for day in range(100)]))
+    assert prune_markdown(markdown, "factura") == markdown
+
+
+def test_stage_two_gets_pruned_markdown_and_the_client_the_full_one(monkeypatch):
+    import asyncio
+    import hashlib
+
+    import fitz
+
+    import pipeline
+    import text_extractor
+    from ingestion import Upload
+
+    document = fitz.open()
+    page = document.new_page()
+    page.insert_text((40, 40), "Extracto bancario - Resumen del periodo", fontsize=8)
+    for day in range(60):
+        page.insert_text((40, 60 + 11 * day), f"{day % 28 + 1:02d}/07 Compra {day} 1.000", fontsize=8)
+    page.insert_text((40, 740), "Saldo final 60.000", fontsize=8)
+    data = document.tobytes()
+    stage_two_inputs = []
+
+    async def extract_from_markdown(markdown, document_type, page_num=1, model=None):
+        stage_two_inputs.append(markdown)
+        return [{"label": "Saldo final", "value": 60000}]
+
+    monkeypatch.setattr(text_extractor, "extract_from_markdown", extract_from_markdown)
+    upload = Upload("extracto.pdf", data, hashlib.sha256(data).hexdigest(), 1)
+    result = asyncio.run(pipeline.run_upload_with_relevance(upload, None, use_text_layer=True))
+
+    assert "Compra 30" not in stage_two_inputs[0]
+    assert "60 líneas de detalle omitidas" in stage_two_inputs[0]
+    assert "Saldo final 60.000" in stage_two_inputs[0]
+    assert "Compra 30" in result["markdown"]
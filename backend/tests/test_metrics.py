@@ -0,0 +1,78 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import metrics
+from metrics import MetricsRegistry
+
+
+def test_registry_renders_the_prometheus_text_format():
+    registry = MetricsRegistry()
+    registry.describe("jobs_total", "Jobs by status")
+    registry.inc("jobs_total", {"status": "done"})
+    registry.inc("jobs_total", {"status": "done"}, 2)
+    registry.inc("jobs_total", {"status": 'say "hi"\n'})
+    for seconds in (0.003, 0.2, 100):
+        registry.observe("job_seconds", {"queue": "a"}, seconds)
+
+    lines = registry.render().splitlines()
+    assert lines[:3] == ["# HELP jobs_total Jobs by status", "# TYPE jobs_total counter", 'jobs_total{status="done"} 3']
+    assert 'jobs_total{status="say \\"hi\\"\\n"} 1' in lines
+    assert "# TYPE job_seconds histogram" in lines
+    assert 'job_seconds_bucket{queue="a",le="0.005"} 1' in lines
+    assert 'job_seconds_bucket{queue="a",le="0.25"} 2' in lines
+    assert 'job_seconds_bucket{queue="a",le="+Inf"} 3' in lines
+    assert 'job_seconds_sum{queue="a"} 100.203' in lines
+    assert 'job_seconds_count{queue="a"} 3' in lines
+
+
+def test_llm_cost_uses_the_price_table():
+    assert metrics.llm_cost("gpt-4o", 1_000_000, 100_000) == pytest.approx(3.5)
+    assert metrics.llm_cost("unpriced-model", 1000, 1000) == 0
+
+
+def test_request_breakdown_collects_stages_and_model_usage_from_threads():
+    async def run():
+        request_metrics = metrics.start_request("upload")
+
+        def convert_page():
+            with metrics.stage("vision"):
+                time.sleep(0.01)
+            metrics.record_llm_call("gpt-4o", 0.01, SimpleNamespace(prompt_tokens=1000, completion_tokens=100))
+
+        await asyncio.gather(*(asyncio.to_thread(convert_page) for _ in range(3)))
+        metrics.record_llm_retry("gpt-4o", "rate_limit")
+        metrics.record_cache("upload", hit=False)
+        return request_metrics.breakdown()
+
+    breakdown = asyncio.run(run())
+
+    assert breakdown["cache"] == "miss"
+    assert breakdown["stages"]["vision"]["count"] == 3
+    assert breakdown["stages"]["vision"]["seconds"] >= 0.03
+    model = breakdown["models"]["gpt-4o"]
+    assert (model["calls"], model["retries"], model["prompt_tokens"]) == (3, 1, 3000)
+    assert model["cost_usd"] == pytest.approx(3 * metrics.llm_cost("gpt-4o", 1000, 100))
+
+
+def test_upload_timings_and_metrics_endpoint():
+    import fitz
+    from fastapi.testclient import TestClient
+
+    import main
+
+    document = fitz.open()
+    document.new_page().insert_text((72, 72), "Saldo final 1.234.567")
+    client = TestClient(main.app)
+    response = client.post("/upload", params={"timings": True}, files={"file": ("a.pdf", document.tobytes())})
+
+    timings = response.json()["timings"]
+    assert {"render", "vision"} <= set(timings["stages"])
+    assert "gpt-4o" in timings["models"]
+
+    exposed = client.get("/metrics")
+    assert exposed.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'pipeline_requests_total{endpoint="upload",status="processed"}' in exposed.text
+    assert 'pipeline_stage_duration_seconds_count{stage="vision"}' in exposed.text
@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+from types import SimpleNamespace
+
+import fitz
+import pytest
+
+import number_parser
+import pdf_utils
+from number_parser import NumberIndex, check_chip_values, parse_number
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("$ -1.234", -1234.0),
+        ("-$1.234", -1234.0),
+        ("COP -54.822", -54822.0),
+        ("(1.234)", -1234.0),
+        ("$ (1.234)", -1234.0),
+        ("1.234-", -1234.0),
+        ("1.234.567,89", 1234567.89),
+        ("1,234,567.89", 1234567.89),
+        ("$ 1.234.567", 1234567.0),
+        ("54.822", 54822.0),
+        ("26,15", 26.15),
+        ("0.125", 0.125),
+        ("0,5%", 0.5),
+        (".5", 0.5),
+        (1500, 1500.0),
+    ],
+)
+def test_parse_number(text, expected):
+    assert parse_number(text) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("value", [None, "", "N/A", "$", True])
+def test_parse_number_without_a_number(value):
+    assert parse_number(value) is None
+
+
+def page_indexes(*pages):
+    """Stand-ins for PageWordIndex: only `number_index` is used by the check."""
+    return [SimpleNamespace(number_index=NumberIndex(values)) for values in pages]
+
+
+def test_confirmed_value():
+    chips = check_chip_values(page_indexes([54822.21, 7]), [{"value": 54822.21, "page": 1}])
+    assert chips[0]["value_check"] == "confirmed"
+
+
+def test_whole_number_matches_printed_decimals():
+    # The models are told to drop decimals: 54822 is 54.822,21 on the page
+    chips = check_chip_values(page_indexes([54822.21]), [{"value": 54822, "page": 1}])
+    assert chips[0]["value_check"] == "confirmed"
+    chips = check_chip_values(page_indexes([54822.21]), [{"value": 54821, "page": 1}])
+    assert chips[0]["value_check"] == "not_found"
+
+
+def test_correct_mode_rescales_misread_separator():
+    chips = check_chip_values(page_indexes([54822]), [{"value": 54.822, "page": 1}], mode="correct")
+    assert chips[0] == {"value": 54822, "page": 1, "original_value": 54.822, "value_check": "corrected"}
+
+
+def test_flag_mode_only_suggests():
+    chips = check_chip_values(page_indexes([54822]), [{"value": 54.822, "page": 1}], mode="flag")
+    assert chips[0] == {"value": 54.822, "page": 1, "suggested_value": 54822, "value_check": "mismatch"}
+
+
+def test_off_mode_leaves_chips_alone():
+    chips = [{"value": 54.822, "page": 1}]
+    assert check_chip_values(page_indexes([54822]), chips, mode="off") == [{"value": 54.822, "page": 1}]
+
+
+def test_small_values_are_never_corrected():
+    # 999 is printed and 0.999 * 1000 matches it, but it is under MIN_CORRECTED_VALUE
+    assert number_parser.MIN_CORRECTED_VALUE == 1000
+    chips = check_chip_values(page_indexes([999]), [{"value": 0.999, "page": 1}], mode="correct")
+    assert chips[0]["value_check"] == "not_found"
+    assert chips[0]["value"] == 0.999
+
+
+def test_rescaled_value_needs_the_same_digits():
+    # 54822 is printed, but 12.345 * 1000 is not it
+    chips = check_chip_values(page_indexes([54822]), [{"value": 12.345, "page": 1}])
+    assert chips[0]["value_check"] == "not_found"
+
+
+def test_pages_without_text_layer_are_not_checked():
+    chips = check_chip_values([None], [{"value": 54.822, "page": 1}])
+    assert "value_check" not in chips[0]
+
+
+def test_search_all_pages():
+    chips = check_chip_values(page_indexes([1], [54822]), [{"value": 54822, "page": 1}], search_all_pages=True)
+    assert chips[0]["value_check"] == "confirmed"
+
+
+def test_check_against_a_real_text_layer():
+    document = fitz.open()
+    document.new_page().insert_text((72, 72), "Saldo final $ 1.234.567,89 Intereses 54.822")
+    indexes = pdf_utils.build_word_indexes(document.tobytes())
+
+    chips = check_chip_values(indexes, [{"value": 1234.56789, "page": 1}, {"value": 54822, "page": 1}])
+    assert [chip["value_check"] for chip in chips] == ["corrected", "confirmed"]
+    assert chips[0]["value"] == 1234567.89
+
+
+def statement_upload(*lines: str):
+    from ingestion import Upload
+
+    document = fitz.open()
+    page = document.new_page()
+    for i, line in enumerate(lines):
+        page.insert_text((72, 72 + 20 * i), line)
+    data = document.tobytes()
+    return Upload("extracto.pdf", data, hashlib.sha256(data).hexdigest(), 1)
+
+
+def test_upload_pipeline_corrects_misread_vision_values(monkeypatch):
+    import pipeline
+    import vision_processor
+
+    async def extract_chips_from_page(image, page_num, pdf_path=None, document_type=None):
+        # "54.822" read as fifty-four point eight
+        return {"chips": [{"label": "Retenciones", "value": 54.822, "page": page_num}]}
+
+    monkeypatch.setattr(vision_processor, "extract_chips_from_page", extract_chips_from_page)
+    upload = statement_upload("Retenciones en la fuente 54.822", "Saldo final 1.234.567,89")
+    result = asyncio.run(pipeline.run_upload(upload, pdf_utils.get_render_profile()))
+
+    chip = result["chips"][0]
+    assert (chip["value"], chip["original_value"], chip["value_check"]) == (54822, 54.822, "corrected")
+
+
+def test_relevance_pipeline_checks_stage_two_values_on_every_page(monkeypatch):
+    import pipeline
+    import text_extractor
+
+    async def extract_from_markdown(markdown, document_type, page_num=1, model=None):
+        return [
+            {"label": "Saldo final", "value": 1234567.89},
+            {"label": "Intereses", "value": 123456789},
+            {"label": "Comisiones", "value": 777777},
+        ]
+
+    monkeypatch.setattr(text_extractor, "extract_from_markdown", extract_from_markdown)
+    upload = statement_upload("Saldo final 1.234.567,89", "Intereses 1.234.567,89")
+    result = asyncio.run(pipeline.run_upload_with_relevance(upload, None, use_text_layer=True))
+
+    checks = {chip["label"]: (chip["value"], chip["value_check"]) for chip in result["chips"]}
+    assert checks == {
+        "Saldo final": (1234567.89, "confirmed"),
+        "Intereses": (1234567.89, "corrected"),
+        "Comisiones": (777777, "not_found"),
+    }
@@ -0,0 +1,44 @@
+import page_routing
+
+SUMMARY = "Resumen del periodo. Saldo final 1.234.567"
+DETAIL = "Detalle de movimientos 01/02 compra 45.000"
+
+
+def test_statement_converts_first_last_and_summary_pages():
+    texts = ["Extracto", DETAIL, SUMMARY, DETAIL, DETAIL, "Fin"]
+    assert page_routing.select_pages("extracto_bancario", texts) == {1, 3, 6}
+
+
+def test_statement_skips_scanned_middle_pages_without_ocr():
+    texts = ["", DETAIL, "", "  \n", DETAIL, ""]
+    assert page_routing.select_pages("extracto_bancario", texts) == {1, 6}
+
+
+def test_statement_converts_scanned_pages_where_ocr_finds_a_summary():
+    texts = ["Extracto", DETAIL, "", "", DETAIL, "Fin"]
+    asked = []
+
+    def ocr(page_nums):
+        asked.append(page_nums)
+        return {3: DETAIL, 4: SUMMARY}
+
+    assert page_routing.select_pages("extracto_bancario", texts, ocr) == {1, 4, 6}
+    assert asked == [[3, 4]]
+
+
+def test_ocr_is_not_asked_for_pages_already_selected():
+    asked = []
+    page_routing.select_pages("extracto_bancario", ["", DETAIL, ""], lambda page_nums: asked.append(page_nums) or {})
+    assert asked == []
+
+
+def test_types_without_a_policy_convert_every_page():
+    assert page_routing.select_pages("nomina", [DETAIL] * 4) == {1, 2, 3, 4}
+    assert page_routing.select_pages(None, [DETAIL, ""]) == {1, 2}
+
+
+def test_policy_can_convert_every_scanned_page(monkeypatch):
+    policy = page_routing.PagePolicy(keywords=("resumen",), include_scanned=True)
+    monkeypatch.setitem(page_routing.PAGE_POLICIES, "extracto_bancario", policy)
+    texts = ["Extracto", "", DETAIL, SUMMARY, DETAIL]
+    assert page_routing.select_pages("extracto_bancario", texts) == {1, 2, 4, 5}
@@ -0,0 +1,75 @@
+import threading
+
+import fitz
+import pytest
+
+import pdf_utils
+from page_store import PageStore, StoredPage
+
+
+def page_image(page_num: int = 1, width: int = 800, height: int = 1000) -> pdf_utils.PageImage:
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, width, height), False)
+    pix.clear_with(255)
+    return pdf_utils.PageImage(page_num, pix.tobytes("png"))
+
+
+def test_downscales_and_counts_the_variant():
+    store = PageStore()
+    store.put("doc", page_image())
+    before = store.stats()["bytes"]
+
+    data, mime_type, etag = store.get("doc", 1, "thumb")
+
+    pix = fitz.Pixmap(data)
+    assert max(pix.width, pix.height) == 256
+    assert mime_type == "image/png"
+    assert store.stats()["bytes"] == before + len(data)
+    assert store.get("doc", 1, "thumb") == (data, mime_type, etag)
+    assert store.stats()["bytes"] == before + len(data)
+
+
+def test_downscales_without_holding_the_lock(monkeypatch):
+    store = PageStore()
+    store.put("doc", page_image())
+    store.put("other", page_image())
+    downscale = StoredPage._downscale
+    served_meanwhile = []
+
+    def slow_downscale(stored, max_long_edge):
+        assert not store._lock.locked()
+        # Another thread serves a page while this one is downscaled
+        thread = threading.Thread(target=lambda: served_meanwhile.append(store.get("other", 1)))
+        thread.start()
+        thread.join(timeout=5)
+        return downscale(stored, max_long_edge)
+
+    monkeypatch.setattr(StoredPage, "_downscale", slow_downscale)
+    assert store.get("doc", 1, "preview") is not None
+    assert served_meanwhile and served_meanwhile[0] is not None
+
+
+def test_page_deleted_while_downscaling_is_not_counted(monkeypatch):
+    store = PageStore()
+    store.put("doc", page_image())
+    downscale = StoredPage._downscale
+
+    def deleting_downscale(stored, max_long_edge):
+        store.delete("doc")
+        return downscale(stored, max_long_edge)
+
+    monkeypatch.setattr(StoredPage, "_downscale", deleting_downscale)
+    assert store.get("doc", 1, "thumb") is not None
+    assert store.stats()["bytes"] == 0
+
+
+@pytest.mark.parametrize("size", ["thumb", "preview"])
+def test_aliases_count_their_own_variants(size):
+    store = PageStore()
+    store.put("doc", page_image())
+    store.alias("doc", "copy")
+    data, _, _ = store.get("copy", 1, size)
+
+    store.delete("doc")
+    assert store.stats()["bytes"] == len(page_image().data) + len(data)
+    store.delete("copy")
+    assert store.stats()["bytes"] == 0
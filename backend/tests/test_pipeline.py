@@ -0,0 +1,282 @@
+import asyncio
+import hashlib
+
+import fitz
+import pytest
+
+import metrics
+import pdf_utils
+import pipeline
+from ingestion import Upload
+
+
+def make_upload(pages: int = 2) -> Upload:
+    document = fitz.open()
+    for i in range(pages):
+        document.new_page().insert_text((72, 72), f"Saldo final 1.234.567 pagina {i + 1}")
+    data = document.tobytes()
+    return Upload("statement.pdf", data, hashlib.sha256(data).hexdigest(), pages)
+
+
+def make_scanned_upload(pages: int) -> Upload:
+    """A PDF whose pages are images only, like a scanned document."""
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 60, 80), False)
+    pix.clear_with(200)
+    document = fitz.open()
+    for _ in range(pages):
+        document.new_page().insert_image(fitz.Rect(72, 72, 300, 400), pixmap=pix)
+    data = document.tobytes()
+    return Upload("scan.pdf", data, hashlib.sha256(data).hexdigest(), pages)
+
+
+def failed_requests(endpoint: str) -> float:
+    series = f'pipeline_requests_total{{endpoint="{endpoint}",status="failed"}} '
+    for line in metrics.registry.render().splitlines():
+        if line.startswith(series):
+            return float(line.removeprefix(series))
+    return 0
+
+
+async def collect(events) -> list[dict]:
+    return [event async for event in events]
+
+
+@pytest.fixture
+def failing_render(monkeypatch):
+    async def iter_render_pages(pdf, profile=None, page_count=None):
+        yield pdf_utils.render_pages(pdf, profile)[0]
+        raise RuntimeError("render failed")
+
+    monkeypatch.setattr(pdf_utils, "iter_render_pages", iter_render_pages)
+
+
+def test_upload_render_failure_ends_with_an_error_event(failing_render):
+    before = failed_requests("upload")
+    events = asyncio.run(collect(pipeline.iter_upload_events(make_upload(), pdf_utils.get_render_profile())))
+
+    assert events[0]["event"] == "start"
+    assert events[-1]["event"] == "error"
+    assert events[-1]["status"] == "failed"
+    assert "render failed" in events[-1]["error"]
+    assert failed_requests("upload") == before + 1
+
+
+def test_run_upload_reports_the_failure(failing_render):
+    result = asyncio.run(pipeline.run_upload(make_upload(), pdf_utils.get_render_profile()))
+    assert result["status"] == "failed"
+    assert result["cached"] is False
+
+
+def test_request_ends_when_the_client_disconnects():
+    before = failed_requests("upload")
+
+    async def disconnect_after_start():
+        events = pipeline.iter_upload_events(make_upload(), pdf_utils.get_render_profile())
+        assert (await anext(events))["event"] == "start"
+        await anext(events)
+        await events.aclose()
+
+    asyncio.run(disconnect_after_start())
+    assert failed_requests("upload") == before + 1
+
+
+def test_runs_without_chips_are_not_cached(monkeypatch):
+    stored = []
+
+    async def cache_store(cache_key, payload):
+        stored.append(payload)
+
+    monkeypatch.setattr(pipeline, "cache_store", cache_store)
+    # The replay backend's synthetic reply has no chips on any page
+    result = asyncio.run(pipeline.run_upload(make_upload(), pdf_utils.get_render_profile()))
+    assert result["status"] == "processed"
+    assert result["chips"] == []
+    assert stored == []
+
+
+def test_batch_duplicates_get_their_own_pages():
+    from layout_templates import pending_layouts
+    from page_store import page_store
+
+    original = make_upload()
+    copy = Upload("copy.pdf", original.data, original.content_hash, original.page_count)
+    result = asyncio.run(pipeline.run_batch([original, copy], pdf_utils.get_render_profile(), use_text_layer=True))
+
+    first, duplicate = result["documents"]
+    assert duplicate["duplicate_of"] == 0
+    assert duplicate["filename"] == "copy.pdf"
+    assert duplicate["doc_id"] != first["doc_id"]
+    assert all(f"/documents/{duplicate['doc_id']}/" in url for url in duplicate["image_urls"])
+    assert pending_layouts.get(duplicate["doc_id"]) is not None
+
+    # Deleting the original leaves the duplicate's pages in place
+    assert page_store.delete(first["doc_id"])
+    assert page_store.get(duplicate["doc_id"], 1) is not None
+
+
+def test_batch_stream_duplicates_get_their_own_pages():
+    from page_store import page_store
+
+    upload = make_upload()
+    events = asyncio.run(collect(pipeline.iter_batch_events(
+        [upload, upload], pdf_utils.get_render_profile(), use_text_layer=True
+    )))
+    done = next(event for event in events if event["event"] == "done")
+    duplicate = next(event for event in events if event["event"] == "duplicate")
+
+    assert (duplicate["index"], duplicate["duplicate_of"]) == (1, 0)
+    assert duplicate["doc_id"] != done["doc_id"]
+    assert len(duplicate["image_urls"]) == 2
+    assert page_store.get(duplicate["doc_id"], 2) is not None
+    assert events.index(duplicate) > events.index(done)
+
+
+@pytest.fixture
+def vision_calls(monkeypatch):
+    """Page numbers sent to the vision model for markdown; page 1 is classified as a bank statement."""
+    import vision_processor
+
+    calls = []
+
+    async def convert_to_markdown(image, page_num):
+        calls.append(page_num)
+        return {"markdown": "Extracto", "document_type": "extracto_bancario", "confidence": "alta"}
+
+    monkeypatch.setattr(vision_processor, "convert_to_markdown", convert_to_markdown)
+    return calls
+
+
+def test_long_scanned_statement_sends_only_routed_pages_to_vision(monkeypatch, vision_calls):
+    monkeypatch.setattr(pdf_utils, "ocr_available", lambda: False)
+    result = asyncio.run(pipeline.run_upload_with_relevance(
+        make_scanned_upload(12), pdf_utils.get_render_profile(), use_text_layer=True
+    ))
+
+    assert sorted(vision_calls) == [1, 12]
+    sources = [page["source"] for page in result["pages"]]
+    assert sources == ["vision"] + ["skipped"] * 10 + ["vision"]
+
+
+def test_scanned_summary_pages_found_by_ocr_are_converted(monkeypatch, vision_calls):
+    monkeypatch.setattr(pdf_utils, "ocr_page_texts", lambda pdf, page_nums: {7: "Resumen del periodo"})
+    asyncio.run(pipeline.run_upload_with_relevance(
+        make_scanned_upload(12), pdf_utils.get_render_profile(), use_text_layer=True
+    ))
+    assert sorted(vision_calls) == [1, 7, 12]
+
+
+@pytest.fixture
+def call_priorities(monkeypatch):
+    """Priority of every model call made through the scheduler."""
+    import llm_scheduler
+
+    priorities = []
+    call = llm_scheduler.scheduler.call
+
+    async def recording_call(*args, **kwargs):
+        priorities.append(llm_scheduler._priority.get())
+        return await call(*args, **kwargs)
+
+    monkeypatch.setattr(llm_scheduler.scheduler, "call", recording_call)
+    return priorities
+
+
+def test_batch_model_calls_run_at_batch_priority(call_priorities):
+    from llm_scheduler import PRIORITY_BATCH
+
+    uploads = [make_upload(), make_upload(3)]
+    asyncio.run(pipeline.run_batch(uploads, pdf_utils.get_render_profile(), use_text_layer=True))
+    assert call_priorities and set(call_priorities) == {PRIORITY_BATCH}
+
+
+def test_batch_stream_model_calls_run_at_batch_priority(call_priorities):
+    from llm_scheduler import PRIORITY_BATCH
+
+    uploads = [make_upload(), make_upload(3)]
+    asyncio.run(collect(pipeline.iter_batch_events(uploads, pdf_utils.get_render_profile(), use_text_layer=True)))
+    assert call_priorities and set(call_priorities) == {PRIORITY_BATCH}
+
+
+def test_single_uploads_run_at_interactive_priority(call_priorities):
+    from llm_scheduler import PRIORITY_INTERACTIVE
+
+    asyncio.run(pipeline.run_upload_with_relevance(make_upload(), pdf_utils.get_render_profile(), use_text_layer=True))
+    assert call_priorities and set(call_priorities) == {PRIORITY_INTERACTIVE}
+
+
+
+@pytest.fixture
+def extraction_cache(monkeypatch, tmp_path):
+    from extraction_cache import ExtractionCache
+
+    monkeypatch.setattr(pipeline, "CACHE_ENABLED", True)
+    monkeypatch.setattr(pipeline, "extraction_cache", ExtractionCache(str(tmp_path)))
+
+
+def count_renders(monkeypatch, calls: list):
+    """Records ("render", page number or None for a whole document) in `calls`."""
+    iter_render_pages, render_page_range = pdf_utils.iter_render_pages, pdf_utils.render_page_range
+
+    def count_document_renders(pdf, profile=None, page_count=None):
+        calls.append(("render", None))
+        return iter_render_pages(pdf, profile, page_count)
+
+    def count_page_renders(pdf, profile, start, stop):
+        calls.append(("render", start + 1))
+        return render_page_range(pdf, profile, start, stop)
+
+    monkeypatch.setattr(pdf_utils, "iter_render_pages", count_document_renders)
+    monkeypatch.setattr(pdf_utils, "render_page_range", count_page_renders)
+
+
+def test_upload_cache_hits_call_neither_the_model_nor_the_renderer(monkeypatch, extraction_cache):
+    import vision_processor
+    from page_store import page_store
+
+    calls = []
+
+    async def extract_chips_from_page(image, page_num, pdf_path=None, document_type=None):
+        calls.append(("model", page_num))
+        return {"chips": [{"label": "Saldo final", "value": 1234567, "page": page_num}]}
+
+    monkeypatch.setattr(vision_processor, "extract_chips_from_page", extract_chips_from_page)
+    upload, profile = make_upload(3), pdf_utils.get_render_profile()
+    assert asyncio.run(pipeline.run_upload(upload, profile))["cached"] is False
+
+    calls.clear()
+    count_renders(monkeypatch, calls)
+    events = asyncio.run(collect(pipeline.iter_upload_events(upload, profile)))
+
+    assert events[0]["cached"] is True
+    assert [event["page"] for event in events if event["event"] == "page"] == [1, 2, 3]
+    assert calls == []
+
+    # A page is rendered when the client first requests it, and only that page
+    data, mime_type, _ = page_store.get(events[0]["doc_id"], 2)
+    assert data and mime_type.startswith("image/")
+    assert page_store.get(events[0]["doc_id"], 2, "thumb") is not None
+    assert calls == [("render", 2)]
+
+
+def test_relevance_cache_hits_call_neither_the_model_nor_the_renderer(monkeypatch, extraction_cache):
+    import text_extractor
+
+    calls = []
+
+    async def extract_from_markdown(markdown, document_type, page_num=1, model=None):
+        calls.append(("model", None))
+        return [{"label": "Saldo final", "value": 1234567}]
+
+    monkeypatch.setattr(text_extractor, "extract_from_markdown", extract_from_markdown)
+    upload, profile = make_upload(2), pdf_utils.get_render_profile()
+    first = asyncio.run(collect(pipeline.iter_relevance_events(upload, profile, use_text_layer=True)))
+    assert first[-1]["event"] == "done" and first[-1]["cached"] is False
+
+    calls.clear()
+    count_renders(monkeypatch, calls)
+    events = asyncio.run(collect(pipeline.iter_relevance_events(upload, profile, use_text_layer=True)))
+
+    assert events[-1]["event"] == "done" and events[-1]["cached"] is True
+    assert events[-1]["chips"][0]["value"] == 1234567
+    assert [event["page"] for event in events if event["event"] == "page"] == [1, 2]
+    assert calls == []
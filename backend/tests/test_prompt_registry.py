@@ -0,0 +1,74 @@
+import pytest
+from pydantic import BaseModel
+
+from prompt_registry import response_format_for, strict_json_schema
+from schemas.document_specific_schemas import DOCUMENT_TYPE_TO_SCHEMA
+
+
+@pytest.mark.parametrize("document_type", sorted(DOCUMENT_TYPE_TO_SCHEMA))
+def test_matches_the_sdk_response_format(document_type):
+    completions = pytest.importorskip("openai.lib._parsing._completions")
+    schema_class = DOCUMENT_TYPE_TO_SCHEMA[document_type]
+    assert response_format_for(schema_class) == completions.type_to_response_format_param(schema_class)
+
+
+def objects(schema):
+    if isinstance(schema, dict):
+        if schema.get("type") == "object":
+            yield schema
+        for value in schema.values():
+            yield from objects(value)
+    elif isinstance(schema, list):
+        for value in schema:
+            yield from objects(value)
+
+
+@pytest.mark.parametrize("document_type", sorted(DOCUMENT_TYPE_TO_SCHEMA))
+def test_every_object_is_closed_and_fully_required(document_type):
+    response_format = response_format_for(DOCUMENT_TYPE_TO_SCHEMA[document_type])
+    assert response_format["json_schema"]["strict"] is True
+    for schema in objects(response_format["json_schema"]["schema"]):
+        assert schema["additionalProperties"] is False
+        assert schema.get("required", []) == list(schema.get("properties", {}))
+
+
+class Amount(BaseModel):
+    value: float
+    note: str | None = None
+
+
+class Line(BaseModel):
+    amount: Amount
+    label: str = "x"
+
+
+def test_inlines_single_all_of_and_drops_null_defaults():
+    schema = strict_json_schema({
+        "type": "object",
+        "properties": {"a": {"allOf": [{"type": "string"}], "default": None}},
+    })
+    assert schema == {
+        "type": "object",
+        "properties": {"a": {"type": "string"}},
+        "required": ["a"],
+        "additionalProperties": False,
+    }
+
+
+def test_resolves_refs_with_sibling_keys():
+    schema = {
+        "$defs": {"Amount": {"type": "object", "properties": {"value": {"type": "number"}}}},
+        "type": "object",
+        "properties": {"amount": {"$ref": "#/$defs/Amount", "description": "Paid"}},
+    }
+    amount = strict_json_schema(schema)["properties"]["amount"]
+    assert "$ref" not in amount
+    assert amount["description"] == "Paid"
+    assert amount["required"] == ["value"]
+
+
+def test_nested_models_keep_plain_refs():
+    schema = response_format_for(Line)["json_schema"]["schema"]
+    assert schema["properties"]["amount"] == {"$ref": "#/$defs/Amount"}
+    assert schema["$defs"]["Amount"]["required"] == ["value", "note"]
+    assert "default" not in schema["$defs"]["Amount"]["properties"]["note"]
@@ -0,0 +1,61 @@
+import asyncio
+
+import fitz
+import pytest
+
+import pdf_utils
+
+
+def make_pdf(pages: int) -> bytes:
+    document = fitz.open()
+    for i in range(pages):
+        document.new_page().insert_text((72, 72), f"Pagina {i + 1}")
+    return document.tobytes()
+
+
+async def render(pdf: bytes) -> list[int]:
+    return [image.page_num async for image in pdf_utils.iter_render_pages(pdf)]
+
+
+@pytest.fixture
+def render_pool(monkeypatch):
+    monkeypatch.setattr(pdf_utils, "RENDER_PROCESSES", 2)
+    monkeypatch.setattr(pdf_utils, "RENDER_PROCESS_MIN_PAGES", 4)
+    monkeypatch.setattr(pdf_utils, "RENDER_CHUNK_PAGES", 2)
+    yield
+    pdf_utils.shutdown_render_pool()
+
+
+def test_thread_rendering_yields_pages_in_order(monkeypatch):
+    monkeypatch.setattr(pdf_utils, "RENDER_CHUNK_PAGES", 2)
+    chunks = []
+    render_page_range = pdf_utils._timed_render_page_range
+
+    def recording_render(pdf, profile, start, stop):
+        chunks.append((start, stop))
+        return render_page_range(pdf, profile, start, stop)
+
+    monkeypatch.setattr(pdf_utils, "_timed_render_page_range", recording_render)
+    assert asyncio.run(render(make_pdf(5))) == [1, 2, 3, 4, 5]
+    assert chunks == [(0, 2), (2, 4), (4, 5)]
+    assert pdf_utils.get_render_pool() is None
+
+
+def test_large_documents_are_split_across_worker_processes(render_pool):
+    assert sorted(asyncio.run(render(make_pdf(7)))) == [1, 2, 3, 4, 5, 6, 7]
+    assert pdf_utils.get_render_pool() is not None
+
+
+def test_small_documents_stay_in_a_thread(render_pool, monkeypatch):
+    def no_pool():
+        raise AssertionError("the pool is only for large documents")
+
+    monkeypatch.setattr(pdf_utils, "get_render_pool", no_pool)
+    assert asyncio.run(render(make_pdf(3))) == [1, 2, 3]
+
+
+def test_shutdown_releases_the_pool(render_pool):
+    pool = pdf_utils.get_render_pool()
+    assert pdf_utils.get_render_pool() is pool
+    pdf_utils.shutdown_render_pool()
+    assert pdf_utils._render_pool is None
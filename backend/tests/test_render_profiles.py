@@ -0,0 +1,58 @@
+import asyncio
+import hashlib
+
+import fitz
+import pytest
+
+import pdf_utils
+import pipeline
+from ingestion import Upload
+
+
+def make_pdf(page_text: str | None) -> bytes:
+    document = fitz.open()
+    page = document.new_page()
+    if page_text is None:
+        pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 60, 80), False)
+        pix.clear_with(200)
+        page.insert_image(fitz.Rect(72, 72, 300, 400), pixmap=pix)
+    else:
+        page.insert_text((72, 72), page_text)
+    return document.tobytes()
+
+
+@pytest.mark.parametrize(
+    "page_text, expected",
+    [
+        ("Extracto - Estado de cuenta - Detalle de movimientos - Saldo anterior", "dense_tables"),
+        ("Comprobante de pago de nomina - Total devengado - Neto pagado", "dense_tables"),
+        ("Certificado de ingresos y retenciones - Formulario 220", pdf_utils.DEFAULT_RENDER_PROFILE),
+        ("Hola", pdf_utils.DEFAULT_RENDER_PROFILE),
+        (None, "scanned"),
+    ],
+)
+def test_profile_is_picked_from_page_1(page_text, expected):
+    profile = asyncio.run(pipeline.document_render_profile(make_pdf(page_text)))
+    assert profile.name == expected
+
+
+def test_explicit_profile_wins():
+    assert pdf_utils.get_render_profile("legacy", "extracto_bancario").name == "legacy"
+    assert pdf_utils.get_render_profile(None, "nomina").name == "dense_tables"
+    with pytest.raises(ValueError):
+        pdf_utils.get_render_profile("poster")
+
+
+def test_relevance_pipeline_renders_statements_with_dense_tables(monkeypatch):
+    profiles = []
+    iter_render_pages = pdf_utils.iter_render_pages
+
+    def recording_iter_render_pages(pdf, profile=None, page_count=None):
+        profiles.append(profile.name)
+        return iter_render_pages(pdf, profile, page_count)
+
+    monkeypatch.setattr(pdf_utils, "iter_render_pages", recording_iter_render_pages)
+    data = make_pdf("Extracto - Estado de cuenta - Detalle de movimientos - Saldo anterior")
+    upload = Upload("statement.pdf", data, hashlib.sha256(data).hexdigest(), 1)
+    asyncio.run(pipeline.run_upload_with_relevance(upload, None, use_text_layer=True))
+    assert profiles == ["dense_tables"]
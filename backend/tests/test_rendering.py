@@ -0,0 +1,56 @@
+import base64
+
+import fitz
+
+import pdf_utils
+
+
+def make_pdf(pages: int = 3) -> bytes:
+    document = fitz.open()
+    for i in range(pages):
+        document.new_page(width=612, height=792).insert_text((100, 100), f"Pagina {i + 1} - Saldo 1.234.567")
+    return document.tobytes()
+
+
+def test_renders_from_bytes_without_writing_temp_files():
+    from temp_janitor import TEMP_DIR
+
+    before = set(TEMP_DIR.glob("**/*")) if TEMP_DIR.exists() else set()
+    images = pdf_utils.render_pages(make_pdf())
+
+    assert [image.page_num for image in images] == [1, 2, 3]
+    assert all(image.data.startswith(b"\x89PNG") for image in images)
+    # The legacy profile renders the full page at 72 DPI
+    assert images[0].size == (612, 792)
+    assert images[0].clip is None
+    assert (set(TEMP_DIR.glob("**/*")) if TEMP_DIR.exists() else set()) == before
+
+
+def test_page_range_is_clamped_to_the_document():
+    images = pdf_utils.render_page_range(make_pdf(), pdf_utils.RENDER_PROFILES["legacy"], 1, 10)
+    assert [image.page_num for image in images] == [2, 3]
+
+
+def test_cropped_profile_reports_the_visible_region():
+    image = pdf_utils.render_pages(make_pdf(1), pdf_utils.RENDER_PROFILES["compact"])[0]
+
+    x0, y0, x1, y1 = image.clip
+    assert 0 <= x0 < x1 <= 1 and 0 <= y0 < y1 <= 1
+    # Only the line of text near the top is kept
+    assert y1 < 0.2
+    assert max(image.size) <= pdf_utils.RENDER_PROFILES["compact"].max_long_edge
+    assert fitz.Pixmap(image.data).n == 1  # grayscale
+
+
+def test_jpeg_profile_and_data_url():
+    image = pdf_utils.render_pages(make_pdf(1), pdf_utils.RENDER_PROFILES["scanned"])[0]
+
+    assert image.mime_type == "image/jpeg"
+    assert image.data.startswith(b"\xff\xd8")
+    prefix = "data:image/jpeg;base64,"
+    assert image.data_url.startswith(prefix)
+    assert base64.b64decode(image.data_url[len(prefix):]) == image.data
+
+
+def test_count_pages_from_bytes():
+    assert pdf_utils.count_pages(make_pdf(4)) == 4
@@ -0,0 +1,112 @@
+import base64
+import hashlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import session_store
+from session_store import SessionStore
+
+PAGE_1 = (b"\x89PNG page 1", "image/png")
+PAGE_2 = (b"\xff\xd8 page 2", "image/jpeg")
+
+
+@pytest.fixture
+def store(tmp_path) -> SessionStore:
+    return SessionStore(tmp_path / "sessions.db")
+
+
+def test_session_summary_lists_documents_without_their_chips(store):
+    session_id = store.create({"name": "Ana"}, {"activeTab": "documents"})
+    store.add_document(session_id, "doc-1", "extracto.pdf", [{"id": "c1", "value": 1}, {"value": 2}], [PAGE_1, PAGE_2])
+    store.update(session_id, state={"activeDocumentId": "doc-1"})
+    store.set_bucket(session_id, "rentas_trabajo", 100.0, [{"chip": "c1"}])
+    store.set_bucket(session_id, "rentas_trabajo", 250.0, [])
+
+    session = store.get(session_id)
+
+    assert session["taxpayer"] == {"name": "Ana"}
+    assert session["state"] == {"activeTab": "documents", "activeDocumentId": "doc-1"}
+    assert session["buckets"] == {"rentas_trabajo": {"value": 250.0, "sources": []}}
+    assert session["documents"] == [
+        {"id": "doc-1", "name": "extracto.pdf", "metadata": {}, "chip_count": 2, "page_count": 2}
+    ]
+
+
+def test_documents_keep_chip_order_and_replace_chips_by_id(store):
+    session_id = store.create()
+    store.add_document(session_id, "doc-1", "a.pdf", [{"id": "c1", "value": 1}, {"id": "c2", "value": 2}], [PAGE_1])
+    store.add_chips(session_id, "doc-1", [{"id": "c1", "value": 10}, {"id": "c3", "value": 3}])
+
+    document = store.get_document(session_id, "doc-1")
+    assert [(chip["id"], chip["value"]) for chip in document["chips"]] == [("c1", 10), ("c2", 2), ("c3", 3)]
+    assert document["image_urls"][0].endswith(f"/sessions/{session_id}/images/{hashlib.sha256(PAGE_1[0]).hexdigest()}")
+
+
+def test_images_are_stored_once_and_dropped_when_unused(store):
+    first, second = store.create(), store.create()
+    store.add_document(first, "doc-1", "a.pdf", [], [PAGE_1, PAGE_2])
+    store.add_document(first, "doc-2", "copy.pdf", [], [PAGE_1, PAGE_2])
+    store.add_document(second, "doc-1", "a.pdf", [], [PAGE_1])
+    assert store.stats()["images"] == 2
+
+    image_hash = store.get_document(first, "doc-1")["image_urls"][1].rsplit("/", 1)[-1]
+    assert store.get_image(first, image_hash) == PAGE_2
+    # Images are only served to sessions that use them
+    assert store.get_image(second, image_hash) is None
+
+    store.delete_document(first, "doc-1")
+    assert store.stats()["images"] == 2
+    store.delete(first)
+    assert store.stats()["images"] == 1
+
+
+def test_missing_sessions_and_duplicate_documents(store):
+    assert store.add_document("missing", "doc-1", "a.pdf", [], []) is None
+    session_id = store.create()
+    assert store.add_document(session_id, "doc-1", "a.pdf", [], []) is True
+    assert store.add_document(session_id, "doc-1", "b.pdf", [], []) is False
+    assert store.add_chips(session_id, "doc-2", [{"value": 1}]) is False
+    assert store.update("missing", state={}) is False
+    assert store.get("missing") is None
+
+
+def test_expired_sessions_are_purged(tmp_path):
+    store = SessionStore(tmp_path / "sessions.db", ttl_seconds=-1)
+    session_id = store.create()
+    store.add_document(session_id, "doc-1", "a.pdf", [], [PAGE_1])
+
+    assert store.purge_expired() == 1
+    assert store.get(session_id) is None
+    assert store.stats() == {"sessions": 0, "images": 0, "image_bytes": 0}
+
+
+def test_decode_data_url():
+    data_url = "data:image/png;base64," + base64.b64encode(PAGE_1[0]).decode()
+    assert session_store.decode_data_url(data_url) == PAGE_1
+    for invalid in ("https://example.com/page.png", "data:image/png;base64,***"):
+        with pytest.raises(ValueError):
+            session_store.decode_data_url(invalid)
+
+
+def test_session_api_saves_rendered_pages_from_the_page_store(store, monkeypatch):
+    import pdf_utils
+    from page_store import page_store
+
+    monkeypatch.setattr(main, "sessions", store)
+    page_store.put("upload-1", pdf_utils.PageImage(1, PAGE_1[0]))
+    client = TestClient(main.app)
+
+    session_id = client.post("/sessions", json={"taxpayer": {"name": "Ana"}}).json()["session_id"]
+    saved = client.post(f"/sessions/{session_id}/documents", json={
+        "id": "doc-1", "name": "a.pdf", "chips": [{"value": 5}], "source_doc_id": "upload-1",
+    })
+    assert saved.status_code == 201
+    image = client.get(saved.json()["image_urls"][0].removeprefix(main.API_BASE_URL))
+    assert (image.content, image.headers["content-type"]) == PAGE_1
+
+    assert client.post(f"/sessions/{session_id}/documents", json={"id": "doc-1", "name": "a.pdf"}).status_code == 409
+    expired = client.post(f"/sessions/{session_id}/documents", json={"name": "b.pdf", "source_doc_id": "gone"})
+    assert expired.status_code == 404
+    assert client.get(f"/sessions/{session_id}").json()["documents"][0]["chip_count"] == 1
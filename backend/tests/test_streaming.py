@@ -0,0 +1,110 @@
+import json
+
+import fitz
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+def make_pdf(pages: int) -> bytes:
+    document = fitz.open()
+    for i in range(pages):
+        page = document.new_page()
+        page.insert_text((72, 72), "Extracto bancario - Resumen del periodo")
+        page.insert_text((72, 96), f"Saldo final 1.234.567,89 - pagina {i + 1}")
+    return document.tobytes()
+
+
+@pytest.fixture
+def client() -> TestClient:
+    return TestClient(main.app)
+
+
+def stream_events(client: TestClient, path: str, pdf: bytes, **params) -> list[dict]:
+    with client.stream("POST", path, params=params, files={"file": ("extracto.pdf", pdf)}) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        return [json.loads(line) for line in response.iter_lines() if line]
+
+
+def test_upload_stream_emits_one_page_event_per_page(client):
+    events = stream_events(client, "/upload/stream", make_pdf(3))
+
+    assert [event["event"] for event in events] == ["start", "page", "page", "page", "done"]
+    start, done = events[0], events[-1]
+    assert start["total_pages"] == 3
+    assert sorted(event["page"] for event in events[1:-1]) == [1, 2, 3]
+    assert all(f"/documents/{start['doc_id']}/pages/" in event["image_url"] for event in events[1:-1])
+    assert done["doc_id"] == start["doc_id"]
+    assert done["status"] == "processed"
+
+
+def test_relevance_stream_ends_with_the_document_chips(client, monkeypatch):
+    import text_extractor
+
+    async def extract_from_markdown(markdown, document_type, page_num=1, model=None):
+        return [{"label": "Saldo final", "value": 1234567.89}]
+
+    monkeypatch.setattr(text_extractor, "extract_from_markdown", extract_from_markdown)
+    events = stream_events(client, "/upload-with-relevance/stream", make_pdf(2), text_layer=True)
+
+    assert [event["event"] for event in events] == ["start", "page", "page", "done"]
+    assert {event["source"] for event in events[1:-1]} == {"text_layer"}
+    done = events[-1]
+    assert [chip["value"] for chip in done["chips"]] == [1234567.89]
+    assert done["chips"][0]["doc_id"] == done["doc_id"]
+    assert done["total_fields"] == 1
+
+
+def test_non_streaming_upload_collects_the_same_events(client):
+    response = client.post("/upload", files={"file": ("extracto.pdf", make_pdf(2))})
+
+    assert response.status_code == 200
+    result = response.json()
+    assert result["status"] == "processed"
+    assert [url.rsplit("/", 1)[-1] for url in result["image_urls"]] == ["1", "2"]
+    assert response.headers["X-Extraction-Cache"] == "miss"
+
+
+UPLOAD_ENDPOINTS = [
+    ("/upload", "file"),
+    ("/upload/stream", "file"),
+    ("/upload-with-relevance", "file"),
+    ("/upload-with-relevance/stream", "file"),
+    ("/upload-batch", "files"),
+    ("/upload-batch/stream", "files"),
+    ("/jobs", "file"),
+]
+
+
+@pytest.mark.parametrize("path,field", UPLOAD_ENDPOINTS)
+def test_upload_endpoints_reject_an_unknown_render_profile(client, path, field):
+    response = client.post(path, params={"render_profile": "bogus"}, files={field: ("extracto.pdf", make_pdf(1))})
+
+    assert response.status_code == 400
+
+
+def test_upload_options_apply_the_server_defaults(monkeypatch):
+    monkeypatch.setattr(main.pipeline, "INLINE_PAGE_IMAGES", True)
+    monkeypatch.setattr(main.pipeline, "INCLUDE_TIMINGS", False)
+    monkeypatch.setattr(main.pipeline, "TEXT_LAYER_MODE", "auto")
+
+    options = main.relevance_options(main.upload_options())
+    assert options == main.UploadOptions(profile=None, inline_images=True, timings=False, use_text_layer=True)
+
+    options = main.relevance_options(main.upload_options(inline_images=False, timings=True), text_layer=False)
+    assert (options.inline_images, options.timings, options.use_text_layer) == (False, True, False)
+
+
+def test_text_layer_is_only_a_parameter_of_the_two_stage_endpoints(client):
+    paths = client.get("/openapi.json").json()["paths"]
+
+    def query_params(path):
+        return {param["name"] for param in paths[path]["post"].get("parameters", [])}
+
+    shared = {"render_profile", "document_type", "inline_images", "timings"}
+    assert query_params("/upload") == shared
+    assert query_params("/upload/stream") == shared
+    for path in ["/upload-with-relevance", "/upload-with-relevance/stream", "/upload-batch", "/upload-batch/stream", "/jobs"]:
+        assert query_params(path) == shared | {"text_layer"}
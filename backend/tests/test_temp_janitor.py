@@ -0,0 +1,96 @@
+import asyncio
+import os
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+from temp_janitor import TempJanitor, sweep
+
+
+def set_age(path, age: float):
+    modified_at = time.time() - age
+    os.utime(path, (modified_at, modified_at))
+
+
+def write(path, nbytes: int = 100, age: float = 0):
+    """Writes a file last modified `age` seconds ago."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * nbytes)
+    set_age(path, age)
+    return path
+
+
+def test_expired_entries_are_removed(tmp_path):
+    write(tmp_path / "old.png", age=7200)
+    write(tmp_path / "new.png", age=10)
+    write(tmp_path / "old_dir" / "page_1.png", age=7200)
+    # A directory is as recent as its newest file
+    write(tmp_path / "active_dir" / "page_1.png", age=7200)
+    write(tmp_path / "active_dir" / "page_2.png", age=5)
+    set_age(tmp_path / "old_dir", 7200)
+    set_age(tmp_path / "active_dir", 7200)
+
+    result = sweep(tmp_path, ttl_seconds=3600, max_bytes=10 ** 9)
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["active_dir", "new.png"]
+    assert result == {"expired": 2, "quota": 0, "bytes": 300}
+
+
+def test_oldest_entries_go_first_to_meet_the_quota(tmp_path):
+    for age, name in ((600, "a.png"), (500, "b.png"), (400, "c.png"), (5, "in_flight.png")):
+        write(tmp_path / name, nbytes=100, age=age)
+
+    result = sweep(tmp_path, ttl_seconds=3600, max_bytes=150, grace_seconds=60)
+
+    # The recent file is kept even though the directory is still over the quota
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["in_flight.png"]
+    assert result == {"expired": 0, "quota": 3, "bytes": 100}
+
+
+def test_modified_before_removes_leftovers_regardless_of_ttl(tmp_path):
+    write(tmp_path / "previous_run.png", age=30)
+    result = sweep(tmp_path, ttl_seconds=3600, modified_before=time.time() - 1)
+    assert result["expired"] == 1
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_missing_directory_is_not_an_error(tmp_path):
+    assert sweep(tmp_path / "missing") == {"expired": 0, "quota": 0, "bytes": 0}
+
+
+def test_janitor_clears_leftovers_first_then_only_expired_files(tmp_path):
+    async def run():
+        write(tmp_path / "previous_run.png", age=30)
+        janitor = TempJanitor(tmp_path, interval_seconds=0.01)
+        janitor.start()
+        await asyncio.sleep(0.05)
+        assert not (tmp_path / "previous_run.png").exists()
+
+        write(tmp_path / "current_request.png")
+        await asyncio.sleep(0.05)
+        await janitor.stop()
+        assert (tmp_path / "current_request.png").exists()
+
+    asyncio.run(run())
+
+
+def test_server_accepts_requests_before_deferred_startup_finishes(tmp_path, monkeypatch):
+    import main
+
+    release = threading.Event()
+    purged = threading.Event()
+
+    class SlowSessions:
+        def purge_expired(self):
+            release.wait(5)
+            purged.set()
+
+    monkeypatch.setattr(main, "sessions", SlowSessions())
+    monkeypatch.setattr(main, "WARM_UP_ON_STARTUP", False)
+    monkeypatch.setattr(main, "temp_janitor", TempJanitor(tmp_path))
+    with TestClient(main.app) as client:
+        assert client.get("/health").status_code == 200
+        assert not purged.is_set()
+        release.set()
+        assert purged.wait(5)
@@ -0,0 +1,74 @@
+import fitz
+import pytest
+
+import pdf_utils
+
+SUMMARY_LINES = [
+    "Resumen del periodo",
+    "Saldo anterior 1.234.567,89",
+    "Total abonos 2.000.000,00",
+    "Saldo final 3.234.567,89",
+]
+
+
+def make_pdf(pages: list[list[str]]) -> bytes:
+    """A digital PDF with the given text lines on each page (an empty list: a blank, scanned-like page)."""
+    document = fitz.open()
+    for lines in pages:
+        page = document.new_page()
+        for i, line in enumerate(lines):
+            page.insert_text((72, 72 + 18 * i), line)
+    return document.tobytes()
+
+
+@pytest.fixture
+def opened_documents(monkeypatch):
+    documents = []
+    open_pdf = pdf_utils.open_pdf
+
+    def recording_open_pdf(pdf):
+        documents.append(open_pdf(pdf))
+        return documents[-1]
+
+    monkeypatch.setattr(pdf_utils, "open_pdf", recording_open_pdf)
+    return documents
+
+
+def test_digital_pages_become_markdown_and_scanned_pages_none():
+    markdown = pdf_utils.extract_text_layer_markdown(make_pdf([SUMMARY_LINES, []]))
+
+    assert len(markdown) == 2
+    assert "Saldo final" in markdown[0]
+    assert "3.234.567,89" in markdown[0]
+    assert markdown[1] is None
+
+
+def test_a_failing_page_falls_back_to_vision(monkeypatch, opened_documents):
+    page_to_markdown = pdf_utils.page_to_markdown
+
+    def failing_second_page(page):
+        if page.number == 1:
+            raise RuntimeError("bad font")
+        return page_to_markdown(page)
+
+    monkeypatch.setattr(pdf_utils, "page_to_markdown", failing_second_page)
+    markdown = pdf_utils.extract_text_layer_markdown(make_pdf([SUMMARY_LINES, SUMMARY_LINES]))
+
+    assert markdown[0] is not None and markdown[1] is None
+    assert opened_documents[0].is_closed
+
+
+def test_document_is_closed_when_extraction_is_interrupted(monkeypatch, opened_documents):
+    def interrupted(page):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(pdf_utils, "page_to_markdown", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        pdf_utils.extract_text_layer_markdown(make_pdf([SUMMARY_LINES]))
+    assert opened_documents[0].is_closed
+
+
+def test_pages_with_too_little_text_are_not_usable():
+    document = fitz.open(stream=make_pdf([["Hoja 1"], SUMMARY_LINES]), filetype="pdf")
+    assert not pdf_utils.has_usable_text_layer(document[0])
+    assert pdf_utils.has_usable_text_layer(document[1])
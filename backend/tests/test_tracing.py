@@ -0,0 +1,129 @@
+import asyncio
+import json
+
+import pytest
+
+import tracing
+
+
+def run_traced(body) -> tracing.Trace:
+    """Runs `body()` (a coroutine function) inside a new trace and finishes it."""
+    async def run():
+        trace = tracing.start_trace("upload", doc_id="doc-1")
+        await body()
+        await tracing.finish_trace(trace, "processed")
+        return trace
+
+    return asyncio.run(run())
+
+
+def spans_by_name(trace: tracing.Trace) -> dict[str, list[tracing.Span]]:
+    spans = {}
+    for span in trace.spans:
+        spans.setdefault(span.name, []).append(span)
+    return spans
+
+
+def test_spans_nest_across_tasks_and_threads():
+    def model_call():
+        with tracing.span("llm_call", model="gpt-4o"):
+            pass
+
+    async def page(page_num):
+        with tracing.span("page", page=page_num):
+            await asyncio.to_thread(model_call)
+
+    async def body():
+        await asyncio.gather(page(1), page(2))
+
+    spans = spans_by_name(run_traced(body))
+
+    trace_root = spans["upload"][0]
+    assert {span.parent_id for span in spans["page"]} == {trace_root.span_id}
+    assert {span.parent_id for span in spans["llm_call"]} == {span.span_id for span in spans["page"]}
+    assert all(span.duration is not None for span in spans["page"] + spans["llm_call"])
+    assert trace_root.attributes["status"] == "processed"
+
+
+def test_failed_and_cancelled_spans_are_marked():
+    async def body():
+        with pytest.raises(ValueError):
+            with tracing.span("vision"):
+                raise ValueError("bad reply")
+
+        async def cancelled():
+            with tracing.span("classification"):
+                await asyncio.sleep(10)
+
+        task = asyncio.create_task(cancelled())
+        await asyncio.sleep(0)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    spans = spans_by_name(run_traced(body))
+    assert (spans["vision"][0].status, spans["vision"][0].attributes["error"]) == ("error", "bad reply")
+    assert spans["classification"][0].status == "cancelled"
+
+
+def test_logs_carry_the_trace_context(capsys):
+    async def body():
+        with tracing.span("vision"):
+            tracing.log("Vision error", level="error", page=2)
+
+    trace = run_traced(body)
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+    error = next(record for record in records if record["message"] == "Vision error")
+    assert (error["level"], error["page"]) == ("error", 2)
+    assert (error["trace_id"], error["doc_id"]) == (trace.trace_id, "doc-1")
+    assert error["span_id"] == spans_by_name(trace)["vision"][0].span_id
+    finished = next(record for record in records if record["message"] == "Document finished")
+    assert finished["spans"] == 2
+
+
+def test_text_log_format(capsys, monkeypatch):
+    monkeypatch.setattr(tracing, "LOG_FORMAT", "text")
+    tracing.log("Cache write error", level="error", key="ab")
+    assert capsys.readouterr().out == "ERROR Cache write error key=ab\n"
+
+
+def test_spans_over_the_limit_are_only_counted(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_MAX_SPANS", 3)
+
+    async def body():
+        for page in range(5):
+            with tracing.span("page", page=page):
+                pass
+
+    trace = run_traced(body)
+    assert len(trace.spans) == 3
+    assert trace.dropped == 3
+
+
+def test_slow_traces_are_exported_for_chrome(monkeypatch, tmp_path):
+    monkeypatch.setattr(tracing, "TRACE_EXPORT_DIR", str(tmp_path))
+
+    async def body():
+        with tracing.span("render"):
+            pass
+        tracing.record_span("render", 0.5, pages="1-4")
+
+    trace = run_traced(body)
+    exported = json.loads(next(tmp_path.glob("*_doc-1.json")).read_text())
+
+    assert exported["otherData"]["trace_id"] == trace.trace_id
+    complete = [event for event in exported["traceEvents"] if event["ph"] == "X"]
+    assert [event["name"] for event in complete] == ["upload", "render", "render"]
+    assert complete[2]["dur"] == 500_000
+    assert complete[2]["args"]["pages"] == "1-4"
+
+
+def test_fast_traces_are_not_exported(monkeypatch, tmp_path):
+    monkeypatch.setattr(tracing, "TRACE_EXPORT_DIR", str(tmp_path))
+    monkeypatch.setattr(tracing, "TRACE_EXPORT_MIN_SECONDS", 60)
+
+    async def body():
+        pass
+
+    run_traced(body)
+    assert list(tmp_path.iterdir()) == []
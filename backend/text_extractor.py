@@ -1,7 +1,12 @@
 import os
-from openai import AsyncOpenAI
+import json
+import traceback
+import llm_backend
+import number_parser
+import tracing
 from dotenv import load_dotenv
-from pathlib import Path
+from llm_scheduler import LLMCallError, estimate_tokens, scheduler
+from prompt_registry import prompt_registry
 from schemas.document_specific_schemas import (
     DOCUMENT_TYPE_TO_SCHEMA,
     get_schema_for_document_type
@@ -9,8 +14,14 @@ from schemas.document_specific_schemas import (
 
 load_dotenv()
 
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-TAX_GUIDES_DIR = Path(__file__).parent.parent / "tax_guides"
+# OpenAI, or a recording/replaying stand-in (see llm_backend)
+client = llm_backend.create_client()
+
+TEXT_MODEL = "gpt-4o-mini"
+# Bump whenever the system/user prompts below change so cached extractions are invalidated
+PROMPT_VERSION = "2"
+# Completion tokens reserved per extraction call when budgeting tokens-per-minute
+COMPLETION_TOKEN_BUDGET = 1000
 
 
 def load_document_guide(document_type: str) -> str:
@@ -18,17 +29,85 @@ def load_document_guide(document_type: str) -> str:
     Load the tax guide for a specific document type.
     Returns the guide content or empty string if not found.
     """
+    return prompt_registry.guide(document_type)
+
+
+def build_extraction_system_prompt(document_type: str, guide: str) -> str:
+    """
+    System prompt for schema extraction. The generic rules come first so every
+    document type shares the same prefix; the type and its guide follow.
+    """
+    return f"""
+You are an expert in Colombian tax law and Form 210 tax declarations.
+
+IMPORTANT RULES:
+- ONLY extract values that are EXPLICITLY present in the document
+- DO NOT perform calculations or sum values yourself
+- DO NOT hallucinate or invent values
+- If a field is not present, leave it as null
+- Convert Colombian number format (1.234,56) to proper numbers
+- Focus on totals and summary values, not individual transaction details
+
+Return the extracted data in the specified JSON schema format.
+
+You are analyzing a {document_type.replace('_', ' ').title()} document.
+
+{guide if guide else 'Extract all relevant fields from this tax document.'}
+"""
+
+
+def build_classification_prompt() -> str:
+    """System prompt for classify_markdown; the page markdown is the user message."""
+    document_types = ", ".join(DOCUMENT_TYPE_TO_SCHEMA.keys())
+    return f"""
+You are a document classifier specialized in Colombian tax documents.
+Classify the Colombian tax document whose first page (as markdown) the user sends into one of: {document_types}
+
+Return JSON: {{"document_type": "...", "confidence": "alta/media/baja"}}
+"""
+
+
+prompt_registry.register("extraction_system", build_extraction_system_prompt, per_document_type=True)
+prompt_registry.register("classification", build_classification_prompt)
+
+
+async def classify_markdown(markdown: str, model: str = TEXT_MODEL) -> dict:
+    """
+    Classify the document type from the markdown of its first page.
+    Used when page 1 was built from the PDF text layer and never reached the vision model.
+    
+    Returns:
+        dict with keys 'document_type' and 'confidence'
+    """
+    system_prompt = prompt_registry.prompt("classification")
+    
     try:
-        md_filename = f"{document_type}_guide.md"
-        md_path = TAX_GUIDES_DIR / md_filename
+        response = await scheduler.call(
+            model,
+            lambda: client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": markdown}
+                ],
+                response_format={"type": "json_object"},
+                temperature=0
+            ),
+            estimated_tokens=estimate_tokens(system_prompt + markdown) + 50
+        )
+        
+        content = response.choices[0].message.content
+        if not content:
+            return {"document_type": None, "confidence": None}
         
-        if md_path.exists():
-            with open(md_path, 'r', encoding='utf-8') as f:
-                return f.read()
+        data = json.loads(content)
+        return {
+            "document_type": data.get("document_type"),
+            "confidence": data.get("confidence")
+        }
     except Exception as e:
-        print(f"Warning: Could not load guide for {document_type}: {e}")
-    
-    return ""
+        tracing.log("Classification error", level="error", error=str(e))
+        return {"document_type": None, "confidence": None, "error": str(e)}
 
 
 def schema_to_chips(schema_data: dict, schema_class) -> list[dict]:
@@ -61,6 +140,10 @@ def schema_to_chips(schema_data: dict, schema_class) -> list[dict]:
         # Convert field name to display label
         label = field_name.replace('_', ' ').title()
         
+        # Amounts returned as printed ("1.234.567,89") are parsed deterministically
+        if isinstance(value, str):
+            value = number_parser.parse_number(value)
+
         # Only create chips for numeric values
         if isinstance(value, (int, float)):
             chip = {
@@ -77,7 +160,7 @@ async def extract_from_markdown(
     markdown: str,
     document_type: str,
     page_num: int = 1,
-    model: str = "gpt-4o-mini"
+    model: str = TEXT_MODEL
 ) -> list[dict]:
     """
     Extract structured data using document-specific schemas.
@@ -91,34 +174,17 @@ async def extract_from_markdown(
     Returns:
         List of chip dictionaries
     """
-    # Load the document-specific guide
-    guide = load_document_guide(document_type)
+    # Unclassified documents (e.g. a failed classification call) use the generic guide and schema
+    document_type = document_type or "otro"
     
-    # Get the appropriate schema
-    try:
-        schema_class = get_schema_for_document_type(document_type)
-    except ValueError:
-        print(f"Warning: Unknown document type '{document_type}', using generic extraction")
-        schema_class = get_schema_for_document_type("otro")
+    if document_type not in DOCUMENT_TYPE_TO_SCHEMA:
+        tracing.log("Unknown document type, using generic extraction", level="warning", document_type=document_type)
+        document_type = "otro"
+    schema_class = get_schema_for_document_type(document_type)
     
-    # Build system prompt with role and guide
-    system_prompt = f"""
-You are an expert in Colombian tax law and Form 210 tax declarations.
-
-You are analyzing a {document_type.replace('_', ' ').title()} document.
-
-{guide if guide else 'Extract all relevant fields from this tax document.'}
-
-IMPORTANT RULES:
-- ONLY extract values that are EXPLICITLY present in the document
-- DO NOT perform calculations or sum values yourself
-- DO NOT hallucinate or invent values
-- If a field is not present, leave it as null
-- Convert Colombian number format (1.234,56) to proper numbers
-- Focus on totals and summary values, not individual transaction details
-
-Return the extracted data in the specified JSON schema format.
-"""
+    # Prompt and JSON schema are precomputed per document type
+    system_prompt = prompt_registry.prompt("extraction_system", document_type)
+    response_format = prompt_registry.response_format(document_type)
     
     user_prompt = f"""
 Document Content (Markdown):
@@ -131,22 +197,26 @@ Extract the relevant fields from this document according to the schema.
 """
     
     try:
-        # Use structured outputs with Pydantic schema
-        response = await client.beta.chat.completions.parse(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            response_format=schema_class,
-            temperature=0
+        # Use structured outputs with the Pydantic schema's precomputed JSON schema
+        response = await scheduler.call(
+            model,
+            lambda: client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                response_format=response_format,
+                temperature=0
+            ),
+            estimated_tokens=estimate_tokens(system_prompt + user_prompt) + COMPLETION_TOKEN_BUDGET
         )
         
-        # Get parsed response
-        parsed = response.choices[0].message.parsed
-        
-        if not parsed:
+        # Refusals come back without content
+        content = response.choices[0].message.content
+        if not content:
             return []
+        parsed = schema_class.model_validate_json(content)
         
         # Convert to dictionary
         schema_data = parsed.model_dump()
@@ -160,8 +230,12 @@ Extract the relevant fields from this document according to the schema.
         
         return chips
         
+    except LLMCallError:
+        # Rate limits/outages that survived retries must not look like an empty document
+        raise
     except Exception as e:
-        print(f"Schema Extraction Error: {e}")
-        import traceback
-        traceback.print_exc()
+        tracing.log(
+            "Schema extraction error", level="error", document_type=document_type,
+            error=str(e), traceback=traceback.format_exc(),
+        )
         return []
@@ -0,0 +1,250 @@
+"""
+Request-scoped tracing and structured logs.
+
+Each pipeline run starts a trace (`start_trace`) and records nested, timed
+spans with `span()`: one per page, per pipeline stage (see metrics.stage) and
+per model call. The current trace and span live in context variables, so
+tasks (asyncio.gather, create_task) and threads (asyncio.to_thread) spawned
+during the run record into the same trace under the right parent.
+
+`log()` writes one JSON object per line (LOG_FORMAT=json, the default) or a
+plain text line, tagged with the current trace_id, span_id and doc_id, so
+errors from concurrent uploads can be told apart.
+
+With TRACE_EXPORT_DIR set, finished traces taking at least
+TRACE_EXPORT_MIN_SECONDS are written there in the Chrome trace event format;
+open them in https://ui.perfetto.dev or chrome://tracing for a flame graph.
+"""
+
+import asyncio
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+# "json": one JSON object per line; "text": human-readable lines
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Directory for exported traces (empty: no export)
+TRACE_EXPORT_DIR = os.getenv("TRACE_EXPORT_DIR", "")
+# Only export traces at least this long (seconds), to keep the slow uploads
+TRACE_EXPORT_MIN_SECONDS = float(os.getenv("TRACE_EXPORT_MIN_SECONDS", "0"))
+# Spans kept per trace; further spans are only counted
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "5000"))
+
+_trace = contextvars.ContextVar("trace", default=None)
+_span = contextvars.ContextVar("span", default=None)
+
+
+def _lane() -> str:
+    """Name of the task (or thread) running the caller; spans of one lane nest properly."""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is not None:
+        return task.get_name()
+    return f"thread-{threading.get_ident()}"
+
+
+class Span:
+    def __init__(self, name: str, parent_id: str | None, attributes: dict):
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.lane = _lane()
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+        self.status = "ok"
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def fail(self, error: BaseException):
+        self.status = "cancelled" if isinstance(error, asyncio.CancelledError) else "error"
+        self.attributes["error"] = str(error) or type(error).__name__
+
+    def end(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self._started
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "lane": self.lane,
+            "start": self.start,
+            "duration": self.duration,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class Trace:
+    def __init__(self, name: str, attributes: dict):
+        self.trace_id = secrets.token_hex(16)
+        self.spans: list[Span] = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self.root = self.start_span(name, None, attributes)
+
+    @property
+    def doc_id(self) -> str | None:
+        return self.root.attributes.get("doc_id")
+
+    def start_span(self, name: str, parent_id: str | None, attributes: dict) -> Span:
+        span = Span(name, parent_id, attributes)
+        with self._lock:
+            if len(self.spans) < TRACE_MAX_SPANS:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+        return span
+
+    def to_chrome_trace(self) -> dict:
+        """The trace in the Chrome trace event format (one lane per task or thread)."""
+        lanes = {}
+        events = []
+        for span in self.spans:
+            tid = lanes.setdefault(span.lane, len(lanes) + 1)
+            duration = span.duration if span.duration is not None else time.perf_counter() - span._started
+            events.append({
+                "name": span.name,
+                "cat": "pipeline",
+                "ph": "X",
+                "ts": int(span.start * 1_000_000),
+                "dur": int(duration * 1_000_000),
+                "pid": 1,
+                "tid": tid,
+                "args": {
+                    **span.attributes,
+                    "span_id": span.span_id,
+                    "parent_id": span.parent_id,
+                    "status": span.status,
+                },
+            })
+        events.extend(
+            {"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": lane}}
+            for lane, tid in lanes.items()
+        )
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {"trace_id": self.trace_id, "dropped_spans": self.dropped, **self.root.attributes},
+        }
+
+
+def start_trace(name: str, **attributes) -> Trace:
+    """
+    Starts a trace in the current context, with a root span `name`. Called at
+    the top of the pipeline's event generators, so it applies to the task
+    consuming them and every task and thread it spawns afterwards.
+    """
+    trace = Trace(name, attributes)
+    _trace.set(trace)
+    _span.set(trace.root)
+    return trace
+
+
+def current_trace() -> Trace | None:
+    return _trace.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Records the enclosed block (sync or across awaits, within one task) as a
+    child of the current span. Yields the Span; outside a trace it is not recorded.
+    """
+    trace = _trace.get()
+    parent = _span.get()
+    if trace is None:
+        current = Span(name, None, attributes)
+    else:
+        current = trace.start_span(name, parent.span_id if parent else None, attributes)
+    token = _span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.fail(e)
+        raise
+    finally:
+        _span.reset(token)
+        current.end()
+
+
+def record_span(name: str, seconds: float, **attributes):
+    """Records a span that just finished after `seconds`, measured elsewhere (e.g. in a worker process)."""
+    trace = _trace.get()
+    if trace is None:
+        return
+    parent = _span.get()
+    recorded = trace.start_span(name, parent.span_id if parent else None, attributes)
+    recorded.start -= seconds
+    recorded.duration = seconds
+
+
+def set_attributes(**attributes):
+    """Adds attributes to the current span."""
+    current = _span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def log(message: str, level: str = "info", **fields):
+    """Writes a log line tagged with the current trace, span and document."""
+    trace = _trace.get()
+    current = _span.get()
+    context = {}
+    if trace is not None:
+        context = {"trace_id": trace.trace_id, "span_id": current.span_id if current else None, "doc_id": trace.doc_id}
+
+    if LOG_FORMAT == "json":
+        record = {
+            "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "level": level,
+            "message": message,
+            **context,
+            **fields,
+        }
+        print(json.dumps(record, ensure_ascii=False, default=str), flush=True)
+    else:
+        prefix = f"[{context['doc_id'] or context['trace_id'][:8]}] " if context else ""
+        details = "".join(f" {key}={value}" for key, value in fields.items())
+        print(f"{level.upper()} {prefix}{message}{details}", flush=True)
+
+
+def export_trace(trace: Trace, directory: str = TRACE_EXPORT_DIR) -> Path:
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    started = datetime.fromtimestamp(trace.root.start, timezone.utc).strftime("%Y%m%dT%H%M%S")
+    path = directory / f"{started}_{trace.doc_id or trace.trace_id}.json"
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(trace.to_chrome_trace(), f, ensure_ascii=False, default=str)
+    return path
+
+
+async def finish_trace(trace: Trace, status: str):
+    """Ends the root span, logs a summary and exports the trace if configured."""
+    trace.root.set(status=status)
+    if status == "failed":
+        trace.root.status = "error"
+    trace.root.end()
+    log(
+        "Document finished",
+        status=status,
+        duration_seconds=round(trace.root.duration, 4),
+        spans=len(trace.spans) + trace.dropped,
+    )
+    if TRACE_EXPORT_DIR and trace.root.duration >= TRACE_EXPORT_MIN_SECONDS:
+        try:
+            await asyncio.to_thread(export_trace, trace, TRACE_EXPORT_DIR)
+        except OSError as e:
+            log("Trace export error", level="error", error=str(e))
@@ -1,17 +1,28 @@
 import os
-from openai import AsyncOpenAI
+import llm_backend
 from dotenv import load_dotenv
 import json
 import asyncio
+import number_parser
 import pdf_utils
+import tracing
+from llm_scheduler import estimate_tokens, scheduler
+from prompt_registry import prompt_registry
 from pathlib import Path
 # System uses Markdown guides directly
 
 load_dotenv()
 
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# OpenAI, or a recording/replaying stand-in (see llm_backend)
+client = llm_backend.create_client()
 TAX_GUIDES_DIR = Path(__file__).parent.parent / "tax_guides"
 
+VISION_MODEL = "gpt-4o"
+# Bump whenever the prompts below change so cached extractions are invalidated
+PROMPT_VERSION = "1"
+# Completion tokens reserved per vision call when budgeting tokens-per-minute
+COMPLETION_TOKEN_BUDGET = 1500
+
 DOCUMENT_TYPES = [
     "extracto_bancario",
     "nomina",
@@ -97,23 +108,11 @@ Example: {{
     return base_prompt
 
 
-async def convert_to_markdown(image_path: str, page_num: int) -> dict:
+def build_markdown_prompt() -> str:
     """
-    Convert document image to structured markdown.
-    
-    Args:
-        image_path: Path to the page image
-        page_num: Page number
-    
-    Returns:
-        dict with keys:
-            - markdown: Structured markdown representation
-            - document_type: Classified document type (only for page 1)
-            - confidence: Classification confidence (only for page 1)
+    Build the page-to-markdown conversion prompt.
     """
-    base64_image = pdf_utils.encode_image(image_path)
-    
-    prompt = f"""
+    return f"""
 Convert this Colombian tax document image to structured markdown.
 
 **Your Tasks:**
@@ -165,30 +164,55 @@ Return JSON:
   "markdown": "# Document title\\n\\n## Section..."
 }}
 """
+
+
+prompt_registry.register("chip_extraction", build_chip_prompt)
+prompt_registry.register("markdown_conversion", build_markdown_prompt)
+
+
+async def convert_to_markdown(image, page_num: int) -> dict:
+    """
+    Convert document image to structured markdown.
+    
+    Args:
+        image: In-memory page image (pdf_utils.PageImage) or path to the page image
+        page_num: Page number
+    
+    Returns:
+        dict with keys:
+            - markdown: Structured markdown representation
+            - document_type: Classified document type (only for page 1)
+            - confidence: Classification confidence (only for page 1)
+    """
+    image_url_content = pdf_utils.image_url_content(image)
+    
+    prompt = prompt_registry.prompt("markdown_conversion")
     
     try:
-        response = await client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a document converter specialized in Colombian tax documents. Return valid JSON with 'document_type' (str or null), 'confidence' (str or null), and 'markdown' (str) keys."
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{base64_image}"
+        response = await scheduler.call(
+            VISION_MODEL,
+            lambda: client.chat.completions.create(
+                model=VISION_MODEL,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "You are a document converter specialized in Colombian tax documents. Return valid JSON with 'document_type' (str or null), 'confidence' (str or null), and 'markdown' (str) keys."
+                    },
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": prompt},
+                            {
+                                "type": "image_url",
+                                "image_url": image_url_content
                             }
-                        }
-                    ]
-                }
-            ],
-            response_format={ "type": "json_object" },
-            temperature=0
+                        ]
+                    }
+                ],
+                response_format={ "type": "json_object" },
+                temperature=0
+            ),
+            estimated_tokens=estimate_tokens(prompt) + pdf_utils.estimate_image_tokens(image) + COMPLETION_TOKEN_BUDGET
         )
         
         message = response.choices[0].message
@@ -210,16 +234,16 @@ Return JSON:
         }
         
     except Exception as e:
-        print(f"Markdown Conversion Error: {e}")
-        return {"markdown": "", "document_type": None, "confidence": None}
+        tracing.log("Markdown conversion error", level="error", page=page_num, error=str(e))
+        return {"markdown": "", "document_type": None, "confidence": None, "error": str(e)}
 
 
-async def extract_chips_from_page(image_path: str, page_num: int, pdf_path: str = None, document_type: str = None):
+async def extract_chips_from_page(image, page_num: int, pdf_path: str = None, document_type: str = None):
     """
     Extract chips, classify document type, and determine relevance from a page image.
     
     Args:
-        image_path: Path to the page image
+        image: In-memory page image (pdf_utils.PageImage) or path to the page image
         page_num: Page number
         pdf_path: Optional path to source PDF
         document_type: Optional known document type (for loading specific guide)
@@ -230,34 +254,36 @@ async def extract_chips_from_page(image_path: str, page_num: int, pdf_path: str
             - document_type: Classified document type (only for page 1)
             - confidence: Classification confidence (only for page 1)
     """
-    base64_image = pdf_utils.encode_image(image_path)
+    image_url_content = pdf_utils.image_url_content(image)
     
     # Build prompt for chip extraction
-    prompt = build_chip_prompt()
+    prompt = prompt_registry.prompt("chip_extraction")
     
     try:
-        response = await client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a professional tax document parser with expertise in Colombian Form 210. You must return a valid JSON object with 'document_type', 'confidence', and 'chips' keys. Each chip must have: value (int), label (str), is_relevant (bool), relevance_reason (str), relevance_confidence (str)."
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{base64_image}"
+        response = await scheduler.call(
+            VISION_MODEL,
+            lambda: client.chat.completions.create(
+                model=VISION_MODEL,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "You are a professional tax document parser with expertise in Colombian Form 210. You must return a valid JSON object with 'document_type', 'confidence', and 'chips' keys. Each chip must have: value (int), label (str), is_relevant (bool), relevance_reason (str), relevance_confidence (str)."
+                    },
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": prompt},
+                            {
+                                "type": "image_url",
+                                "image_url": image_url_content
                             }
-                        }
-                    ]
-                }
-            ],
-            response_format={ "type": "json_object" },
-            temperature=0
+                        ]
+                    }
+                ],
+                response_format={ "type": "json_object" },
+                temperature=0
+            ),
+            estimated_tokens=estimate_tokens(prompt) + pdf_utils.estimate_image_tokens(image) + COMPLETION_TOKEN_BUDGET
         )
         
         message = response.choices[0].message
@@ -268,7 +294,8 @@ async def extract_chips_from_page(image_path: str, page_num: int, pdf_path: str
             return {"chips": [], "document_type": None, "confidence": None}
             
         data = json.loads(content)
-        chips = data.get("chips", [])
+        # Values may come back as printed ("54.822,21"); parse them deterministically
+        chips = number_parser.normalize_chip_values(data.get("chips", []))
         document_type = data.get("document_type")
         confidence = data.get("confidence")
         
@@ -285,5 +312,5 @@ async def extract_chips_from_page(image_path: str, page_num: int, pdf_path: str
             
         return result
     except Exception as e:
-        print(f"Vision Processing Error: {e}")
-        return {"chips": [], "document_type": None, "confidence": None}
+        tracing.log("Vision processing error", level="error", page=page_num, error=str(e))
+        return {"chips": [], "document_type": None, "confidence": None, "error": str(e)}
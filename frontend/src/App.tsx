@@ -11,6 +11,10 @@ import { CheckCircle } from 'lucide-react'
 import axios from 'axios'
 import { calculateBuckets, CALCULATED_FIELD_IDS } from './utils/formulas'
 
+const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000'
+// The server-side session being edited, restored on reload
+const SESSION_STORAGE_KEY = 'sessionId'
+
 interface BucketSource {
   docName: string;
   value: number;
@@ -33,6 +37,8 @@ interface UploadedDocument {
   chips: Chip[];
   imageUrls: string[];
   originalFile?: File;
+  // doc_id of the upload, whose rendered pages the server saves with the session
+  sourceDocId?: string;
 }
 
 interface TaxpayerInfo {
@@ -43,6 +49,43 @@ interface TaxpayerInfo {
   taxYear: string;
 }
 
+// Response of /upload-with-relevance (the fields the workbench reads)
+interface UploadResponse {
+  doc_id: string;
+  chips: Chip[];
+  image_urls: string[];
+}
+
+interface SavedSession {
+  taxpayer: Partial<TaxpayerInfo>;
+  state: { activeTab?: string; activeDocumentId?: string | null };
+  buckets: Record<string, { value: number; sources: BucketSource[] }>;
+  documents: Array<{ id: string; name: string }>;
+}
+
+interface SavedDocument {
+  id: string;
+  name: string;
+  chips: Chip[];
+  image_urls: string[];
+}
+
+// What was last written to the session, to send only what changed
+interface SyncedSession {
+  sessionId: string | null;
+  state: string;
+  // document id -> name
+  documents: Map<string, string>;
+  // bucket id -> JSON of its value and sources
+  buckets: Map<string, string>;
+}
+
+const sessionBody = (taxpayer: TaxpayerInfo, activeTab: string, activeDocumentId: string | null) =>
+  ({ taxpayer, state: { activeTab, activeDocumentId } })
+
+const bucketBody = (bucket: { value: number; sources: BucketSource[] }) =>
+  JSON.stringify({ value: bucket.value, sources: bucket.sources })
+
 const INITIAL_BUCKETS: Bucket[] = [
   // Patrimonio
   { id: '29', name: 'Total patrimonio bruto', value: 0, sources: [], section: 'Patrimonio' },
@@ -199,6 +242,10 @@ function App() {
   const [hoveredChip, setHoveredChip] = useState<Chip | null>(null)
   const [successAnimation, setSuccessAnimation] = useState<string | null>(null)
   const [undoHistory, setUndoHistory] = useState<Array<{ buckets: Bucket[], documents: UploadedDocument[] }>>([])
+  const [sessionId, setSessionId] = useState<string | null>(null)
+  const syncedRef = useRef<SyncedSession>({ sessionId: null, state: '', documents: new Map(), buckets: new Map() })
+  // Saves run one after another, so each one sees what the previous one wrote
+  const syncQueueRef = useRef<Promise<void>>(Promise.resolve())
 
   const activeDocument = documents.find(doc => doc.id === activeDocumentId)
   const chips = activeDocument?.chips || []
@@ -481,49 +528,146 @@ function App() {
     }, 100)
   }
 
-  const saveSession = () => {
-    const session = {
-      buckets,
-      documents: documents.map(doc => ({
-        ...doc,
-        imageUrls: [] // Don't save image URLs to reduce file size
-      })),
-      activeDocumentId,
-      activeTab,
-      taxpayerInfo,
-      timestamp: new Date().toISOString()
+  // Chips are saved as uploaded; those placed in a bucket are hidden again when the session is loaded
+  const documentChips = (doc: UploadedDocument): Chip[] => [
+    ...doc.chips,
+    ...buckets.flatMap(b => b.sources)
+      .filter(source => source.documentId === doc.id && source.originalChip)
+      .map(source => source.originalChip!)
+  ]
+
+  const saveDocument = async (id: string, doc: UploadedDocument) => {
+    const body = { id: doc.id, name: doc.name, chips: documentChips(doc) }
+    const inlineImages = doc.imageUrls.length > 0 && doc.imageUrls.every(url => url.startsWith('data:'))
+    try {
+      await axios.post(`${API_URL}/sessions/${id}/documents`,
+        inlineImages ? { ...body, images: doc.imageUrls } : { ...body, source_doc_id: doc.sourceDocId })
+    } catch (error) {
+      if (inlineImages || !axios.isAxiosError(error) || error.response?.status !== 404) throw error
+      // The server no longer holds the rendered pages: keep the chips at least
+      console.warn(`Page images of ${doc.name} expired; saving its values only`)
+      await axios.post(`${API_URL}/sessions/${id}/documents`, body)
     }
+  }
 
-    const blob = new Blob([JSON.stringify(session, null, 2)], { type: 'application/json' })
-    const link = document.createElement('a')
-    link.href = URL.createObjectURL(blob)
-    link.download = `session_${new Date().toISOString().split('T')[0]}.json`
-    link.click()
+  const syncSession = async (id: string) => {
+    const synced = syncedRef.current
+    // Queued before another session was loaded
+    if (synced.sessionId !== id) return
+    const state = JSON.stringify(sessionBody(taxpayerInfo, activeTab, activeDocumentId))
+    if (state !== synced.state) {
+      await axios.patch(`${API_URL}/sessions/${id}`, JSON.parse(state))
+      synced.state = state
+    }
+
+    for (const doc of documents) {
+      if (!synced.documents.has(doc.id)) {
+        await saveDocument(id, doc)
+      } else if (synced.documents.get(doc.id) !== doc.name) {
+        await axios.patch(`${API_URL}/sessions/${id}/documents/${encodeURIComponent(doc.id)}`, { name: doc.name })
+      }
+      synced.documents.set(doc.id, doc.name)
+    }
+    for (const docId of [...synced.documents.keys()]) {
+      if (!documents.some(doc => doc.id === docId)) {
+        await axios.delete(`${API_URL}/sessions/${id}/documents/${encodeURIComponent(docId)}`)
+        synced.documents.delete(docId)
+      }
+    }
+
+    for (const bucket of buckets) {
+      if (CALCULATED_FIELD_IDS.includes(bucket.id)) continue
+      const body = bucketBody(bucket)
+      if (body !== (synced.buckets.get(bucket.id) ?? bucketBody({ value: 0, sources: [] }))) {
+        await axios.patch(`${API_URL}/sessions/${id}/buckets/${bucket.id}`, JSON.parse(body))
+        synced.buckets.set(bucket.id, body)
+      }
+    }
   }
 
-  const loadSession = (event: React.ChangeEvent<HTMLInputElement>) => {
-    const file = event.target.files?.[0]
-    if (!file) return
-
-    const reader = new FileReader()
-    reader.onload = (e) => {
-      try {
-        const session = JSON.parse(e.target?.result as string)
-        setBuckets(calculateBuckets(session.buckets || INITIAL_BUCKETS))
-        setDocuments(session.documents || [])
-        setActiveDocumentId(session.activeDocumentId || null)
-        setActiveTab(session.activeTab || 'Laboral')
-        if (session.taxpayerInfo) {
-          setTaxpayerInfo(session.taxpayerInfo)
-        }
-        alert('Sesión cargada exitosamente')
-      } catch (error) {
-        console.error('Error loading session:', error)
-        alert('Error al cargar la sesión')
+  // Once saved, every change is written to the session as it happens
+  useEffect(() => {
+    if (!sessionId) return
+    syncQueueRef.current = syncQueueRef.current
+      .then(() => syncSession(sessionId))
+      .catch(error => console.error('Error saving session:', error))
+  }, [sessionId, documents, buckets, taxpayerInfo, activeTab, activeDocumentId])
+
+  const restoreSession = async (id: string, quiet = false) => {
+    try {
+      const { data: session } = await axios.get<SavedSession>(`${API_URL}/sessions/${id}`)
+      const savedDocuments = await Promise.all(session.documents.map(doc =>
+        axios.get<SavedDocument>(`${API_URL}/sessions/${id}/documents/${encodeURIComponent(doc.id)}`)
+          .then(response => response.data)
+      ))
+
+      const restoredBuckets = calculateBuckets(INITIAL_BUCKETS.map(b =>
+        session.buckets[b.id] ? { ...b, ...session.buckets[b.id] } : b
+      ))
+      const usedChipIds = new Set(restoredBuckets.flatMap(b => b.sources.map(source => source.chipId)))
+      const restoredDocuments = savedDocuments.map(doc => ({
+        id: doc.id,
+        name: doc.name,
+        chips: doc.chips.filter(chip => !usedChipIds.has(chip.id)),
+        imageUrls: doc.image_urls
+      }))
+      const restoredTaxpayer = { ...taxpayerInfo, ...session.taxpayer }
+      const restoredTab = session.state.activeTab || 'Patrimonio'
+      const restoredDocumentId = session.state.activeDocumentId ?? restoredDocuments[0]?.id ?? null
+
+      syncedRef.current = {
+        sessionId: id,
+        state: JSON.stringify(sessionBody(restoredTaxpayer, restoredTab, restoredDocumentId)),
+        documents: new Map(restoredDocuments.map(doc => [doc.id, doc.name])),
+        buckets: new Map(Object.entries(session.buckets).map(([bucketId, bucket]) => [bucketId, bucketBody(bucket)]))
+      }
+      // Restored documents shouldn't be taken for new uploads
+      prevDocumentCountRef.current = restoredDocuments.length
+      setBuckets(restoredBuckets)
+      setDocuments(restoredDocuments)
+      setActiveDocumentId(restoredDocumentId)
+      setActiveTab(restoredTab)
+      setTaxpayerInfo(restoredTaxpayer)
+      setUndoHistory([])
+      setSessionId(id)
+      localStorage.setItem(SESSION_STORAGE_KEY, id)
+      if (!quiet) alert('Sesión cargada exitosamente')
+    } catch (error) {
+      console.error('Error loading session:', error)
+      if (axios.isAxiosError(error) && error.response?.status === 404) {
+        localStorage.removeItem(SESSION_STORAGE_KEY)
       }
+      if (!quiet) alert('Error al cargar la sesión')
+    }
+  }
+
+  useEffect(() => {
+    const savedSessionId = localStorage.getItem(SESSION_STORAGE_KEY)
+    if (savedSessionId) restoreSession(savedSessionId, true)
+  }, [])
+
+  const saveSession = async () => {
+    if (sessionId) {
+      alert(`Los cambios se guardan automáticamente en la sesión ${sessionId}`)
+      return
+    }
+    try {
+      const body = sessionBody(taxpayerInfo, activeTab, activeDocumentId)
+      const { data } = await axios.post<{ session_id: string }>(`${API_URL}/sessions`, body)
+      // Documents and buckets are then saved by the sync effect
+      syncedRef.current = { sessionId: data.session_id, state: JSON.stringify(body), documents: new Map(), buckets: new Map() }
+      setSessionId(data.session_id)
+      localStorage.setItem(SESSION_STORAGE_KEY, data.session_id)
+      alert(`Sesión guardada: ${data.session_id}\nDesde ahora los cambios se guardan automáticamente.`)
+    } catch (error) {
+      console.error('Error saving session:', error)
+      alert('Error al guardar la sesión')
     }
-    reader.readAsText(file)
-    event.target.value = ''
+  }
+
+  const loadSession = () => {
+    const id = prompt('ID de la sesión:', sessionId || '')?.trim()
+    if (id) restoreSession(id)
   }
 
   const handleDeleteDocument = (docId: string) => {
@@ -567,7 +711,7 @@ function App() {
         formData.append('file', file)
 
         // Use the new endpoint with relevance classification
-        const response = await axios.post(`${import.meta.env.VITE_API_URL || 'http://localhost:8000'}/upload-with-relevance`, formData, {
+        const response = await axios.post<UploadResponse>(`${API_URL}/upload-with-relevance`, formData, {
           onUploadProgress: (progressEvent) => {
             if (progressEvent.total) {
               const fileProgress = (progressEvent.loaded / progressEvent.total) * 100
@@ -587,7 +731,8 @@ function App() {
           name: file.name,
           chips: response.data.chips,
           imageUrls: response.data.image_urls,
-          originalFile: file
+          originalFile: file,
+          sourceDocId: response.data.doc_id
         }
       })
 
@@ -888,7 +1033,8 @@ function App() {
             >
               💾 Guardar
             </button>
-            <label
+            <button
+              onClick={loadSession}
               style={{
                 flex: 1,
                 padding: '8px 12px',
@@ -899,18 +1045,13 @@ function App() {
                 cursor: 'pointer',
                 fontSize: '11px',
                 fontWeight: 600,
-                transition: 'all 0.2s',
-                textAlign: 'center',
-                display: 'flex',
-                alignItems: 'center',
-                justifyContent: 'center'
+                transition: 'all 0.2s'
               }}
               onMouseEnter={(e) => e.currentTarget.style.background = 'rgba(255, 255, 255, 0.1)'}
               onMouseLeave={(e) => e.currentTarget.style.background = 'rgba(255, 255, 255, 0.05)'}
             >
-              <input type="file" onChange={loadSession} style={{ display: 'none' }} accept=".json" />
               📂 Cargar
-            </label>
+            </button>
           </div>
 
           {/* Keyboard Shortcuts Hint */}
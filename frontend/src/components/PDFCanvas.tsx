@@ -9,6 +9,11 @@ export interface Chip {
     page: number;
     doc_id?: string;
     field_name?: string;  // Schema field name from backend
+    // Bounding box on the page image (percentages), when found in the PDF text layer
+    x?: number;
+    y?: number;
+    width?: number;
+    height?: number;
 }
 
 interface PDFCanvasProps {